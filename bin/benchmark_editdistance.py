@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# README
+#
+# Compares the speed of textutils.editDistance with the reference implementation
+# (textutils.levenshtein), on the kind of strings smewt compares.
+#
+# run with:
+#   python bin/benchmark_editdistance.py
+
+from smewt.base.textutils import levenshtein, editDistance, editDistances
+import random
+import timeit
+
+REPEAT = 3
+
+rnd = random.Random(0)
+def randomTitle(words):
+    return ' '.join(''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for i in range(rnd.randint(2, 8)))
+                    for w in range(words))
+
+# matching series names returned by thetvdb.com for a query
+query = 'the office us'
+series = [ 'the office', 'the office (us)', 'the office (uk)', 'office space' ] + \
+         [ randomTitle(rnd.randint(1, 5)) for i in range(200) ]
+
+# unique key strings compared by the SimpleSolver, with a cutoff of 80
+titles = [ randomTitle(rnd.randint(1, 10)) for i in range(200) ]
+pairs = [ (rnd.choice(titles), rnd.choice(titles)) for i in range(200) ]
+
+
+def bench(name, func, number = 5):
+    best = min(timeit.repeat(func, number = number, repeat = REPEAT)) / number
+    print '%-45s %9.2f ms' % (name, best * 1000)
+    return best
+
+
+for q, candidates in [ (query, series) ]:
+    assert [ levenshtein(q, c) for c in candidates ] == editDistances(q, candidates)
+for a, b in pairs:
+    assert min(levenshtein(a, b), 81) == editDistance(a, b, 80)
+
+
+print 'Sorting %d series names for a query:' % len(series)
+ref = bench('  levenshtein', lambda: [ levenshtein(query, s) for s in series ])
+new = bench('  editDistances', lambda: editDistances(query, series))
+print '  speedup: %.1fx' % (ref / new)
+print
+
+print 'Comparing %d pairs of titles:' % len(pairs)
+ref = bench('  levenshtein', lambda: [ levenshtein(a, b) for a, b in pairs ])
+new = bench('  editDistance', lambda: [ editDistance(a, b) for a, b in pairs ])
+print '  speedup: %.1fx' % (ref / new)
+new = bench('  editDistance, cutoff = 5', lambda: [ editDistance(a, b, 5) for a, b in pairs ])
+print '  speedup: %.1fx' % (ref / new)
@@ -20,10 +20,10 @@
 
 from smewtexception import SmewtException
 from solvingchain import SolvingChain
-from cache import cachedmethod
+from cache import cachedmethod, cachedlookup
 from eventserver import EventServer
-from taskmanager import Task, TaskManager
-from importtask import ImportTask
+from taskmanager import Task, TaskManager, TaskCancelled, TaskRetry
+from importtask import ImportTask, EnrichTask, BatchImportTask, RemoveTask
 from graphaction import GraphAction
 from collection import Collection
 from smewtdaemon import SmewtDaemon
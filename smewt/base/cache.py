@@ -20,13 +20,40 @@
 
 from __future__ import unicode_literals
 from functools import wraps
+from smewtexception import SmewtException
+from smewt import config
+from threading import Lock, Event
 import cPickle
+import time
 import logging
 
 log = logging.getLogger(__name__)
 
 globalCache = {}
 
+# number of seconds during which a failed lookup is remembered (see cachedlookup)
+negativeTTL = config.NEGATIVE_CACHE_TTL
+
+# returned by globalCache.get() for the keys that aren't in the cache
+_missing = object()
+
+# keys of the cached methods which are being computed, and the events set when they are
+_inflight = {}
+_inflightLock = Lock()
+
+
+class NegativeResult(object):
+    """Cached value recording that a lookup failed, and when."""
+    def __init__(self, message, timestamp = None):
+        self.message = message
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def expired(self):
+        return time.time() > self.timestamp + negativeTTL
+
+    def __unicode__(self):
+        return 'NegativeResult(%s)' % self.message
+
 def clear():
     log.info('Cache: clearing memory cache')
     global globalCache
@@ -42,6 +69,15 @@ def load(filename):
     except EOFError:
         log.error('Cache: cache file is corrupted... Please remove it.')
 
+def purgeNegative():
+    """Remove all the failed lookups from the cache, so that they are tried again."""
+    keys = [ key for key, value in globalCache.items() if isinstance(value, NegativeResult) ]
+    log.info('Cache: purging %d failed lookups' % len(keys))
+    for key in keys:
+        # another thread might have expired it already
+        globalCache.pop(key, None)
+    return len(keys)
+
 def save(filename):
     log.info('Cache: saving cache to %s' % filename)
     cPickle.dump(globalCache, open(filename, 'wb'))
@@ -55,6 +91,13 @@ def has_cached_func_value(func, args, kwargs={}):
     key = (func_key, args, tuple(sorted(kwargs.items())))
     return key in globalCache
 
+def store_cached_value(func, args, value, kwargs={}, cls=None):
+    """Set the cached value of the given call, as if it had returned value. cls needs
+    to be given for class methods, in which case args doesn't contain the instance."""
+    func_key = cached_func_key(func, cls)
+    key = (func_key, tuple(args), tuple(sorted(kwargs.items())))
+    globalCache[key] = value
+
 def log_cache(key, result=None):
     if result:
         res = unicode(result)
@@ -84,8 +127,9 @@ def cachedfunc(function):
     return cached
 
 
-def cachedmethod(function):
-    """Make a class method (not a module function) use the cache."""
+def _cachedmethod(function, negative):
+    """Return a version of the given class method that uses the cache, and also
+    remembers when it fails with a SmewtException if negative is True."""
 
     @wraps(function)
     def cached(*args, **kwargs):
@@ -94,14 +138,54 @@ def cachedmethod(function):
         # instance pointer and we don't want the cache to know which instance
         # called it, it is shared among all instances of the same class
         key = (func_key, args[1:], tuple(sorted(kwargs.items())))
-        if key in globalCache:
-            result = globalCache[key]
+
+        # other threads might be removing it at the same time, so don't look it up twice
+        result = globalCache.get(key, _missing)
+        if isinstance(result, NegativeResult):
+            if not result.expired():
+                log_cache(key, result)
+                raise SmewtException(result.message)
+            globalCache.pop(key, None)
+        elif result is not _missing:
             log_cache(key, result)
             return result
 
+        # if another thread is already computing it, wait for its result instead of
+        # doing the same lookup a second time
+        with _inflightLock:
+            done = _inflight.get(key)
+            if done is None:
+                _inflight[key] = Event()
+        if done is not None:
+            done.wait()
+            return cached(*args, **kwargs)
+
         log_cache(key)
-        result = function(*args, **kwargs)
-        globalCache[key] = result
+        try:
+            try:
+                result = function(*args, **kwargs)
+            except SmewtException, e:
+                if negative:
+                    globalCache[key] = NegativeResult(unicode(e))
+                raise
+            globalCache[key] = result
+        finally:
+            with _inflightLock:
+                _inflight.pop(key).set()
+
         return result
 
     return cached
+
+
+def cachedmethod(function):
+    """Make a class method (not a module function) use the cache. Concurrent calls
+    with the same arguments are only performed once."""
+    return _cachedmethod(function, negative = False)
+
+
+def cachedlookup(function):
+    """Make a class method use the cache like cachedmethod, but also remember when it
+    fails with a SmewtException, so that the same failing lookup isn't tried again
+    before negativeTTL seconds have passed."""
+    return _cachedmethod(function, negative = True)
@@ -20,7 +20,8 @@
 
 from __future__ import unicode_literals
 
-from smewt.base import utils, ImportTask
+from smewt.base import utils, Task, ImportTask, EnrichTask, RemoveTask
+from smewt.base.importtask import commitLock
 from smewt.ontology import Media, CollectionSettings
 from smewt.base.textutils import u
 import json
@@ -91,38 +92,122 @@ class Collection(object):
         del self.folders[index]
         self.saveSettings()
 
-    def collectionFiles(self):
-        for folder, recursive in self.folders:
+    def isCollectionFile(self, filename, matched = False):
+        """Return whether the given file belongs to this collection, matched being True
+        if we already know that it is in one of its folders and is a valid file."""
+        if not matched:
+            if not utils.matchFile(filename, self.validFiles):
+                return False
+            if not any(self.inFolder(filename, folder, recursive)
+                       for folder, recursive in self.folders):
+                return False
+
+        p = os.path.split(filename)
+        if '.AppleDouble' in p:
+            return False
+        if p[-1].startswith('._'):
+            return False
+        return True
+
+    @staticmethod
+    def inFolder(filename, folder, recursive):
+        if not folder:
+            return False
+        folder = os.path.join(folder, '')
+        if not filename.startswith(folder):
+            return False
+        return recursive or os.sep not in filename[len(folder):]
+
+    def collectionFiles(self, folders = None):
+        """Yield all the files of the collection, only looking in the given folders,
+        which default to all of them."""
+        for folder, recursive in (folders if folders is not None else self.folders):
             for f in utils.dirwalk(folder, self.validFiles, recursive):
-                p = os.path.split(f)
-                if '.AppleDouble' in p:
-                    continue
-                if p[-1].startswith('._'):
-                    continue
-                yield f
-
-    def modifiedFiles(self):
-        lastModified = dict((f.filename, f.get('lastModified', None)) for f in self.graph.find_all(Media))
-        for f in self.collectionFiles():
+                if self.isCollectionFile(f, matched = True):
+                    yield f
+
+    def knownFiles(self, folder):
+        """Return the files in the given folder that have been imported already."""
+        with commitLock:
+            return [ f.filename for f in self.graph.find_all(Media)
+                     if self.inFolder(f.filename, folder, True) ]
+
+    def deletedFiles(self, folders = None):
+        """Yield the files of the collection that are not on the disk anymore, only
+        looking in the given folders, which default to all of them."""
+        for folder, recursive in (folders if folders is not None else self.folders):
+            # an unmounted drive or network share doesn't mean that its files are gone
+            if not folder or not os.path.isdir(folder):
+                continue
+            for f in self.knownFiles(folder):
+                if (recursive or self.inFolder(f, folder, False)) and not os.path.exists(f):
+                    yield f
+
+    def modifiedFiles(self, folders = None):
+        with commitLock:
+            lastModified = dict((f.filename, f.get('lastModified', None)) for f in self.graph.find_all(Media))
+        for f in self.collectionFiles(folders):
             # yield a file if we haven't heard of it yet or if it has been modified recently
             if f not in lastModified or os.path.getmtime(f) > lastModified[f]:
                 yield f
 
     def importFiles(self, files):
+        files = list(files)
+        if self.taskManager:
+            # get a head start on guessing the filenames, the import tasks will pick up the results
+            self.mediaTagger.prefetch(files)
+
         for f in files:
             # new import task
             log.info('Import in %s collection: %s' % (u(self.name), u(f)))
             if self.taskManager:
-                importTask = ImportTask(self.graph, self.mediaTagger, f)
+                # first import what we can guess locally so that the file shows up right
+                # away, and look up the rest of the information online later
+                importTask = ImportTask(self.graph, self.mediaTagger, f, online = False)
                 self.taskManager.add(importTask)
+                self.taskManager.add(EnrichTask(self.graph, self.mediaTagger, f))
 
         # save newly imported files
         self.saveSettings()
 
-    def update(self):
+    def removeFiles(self, files):
+        files = list(files)
+        for f in files:
+            log.info('Remove from %s collection: %s' % (u(self.name), u(f)))
+        if self.taskManager and files:
+            self.taskManager.add(RemoveTask(self.graph, files))
+
+    def update(self, folders = None):
         log.info('Updating %s collection' % self.name)
-        self.importFiles(self.modifiedFiles())
+        self.removeFiles(self.deletedFiles(folders))
+        self.importFiles(self.modifiedFiles(folders))
 
     def rescan(self):
         log.info('Rescanning %s collection' % self.name)
         self.importFiles(self.collectionFiles())
+
+
+class UpdateTask(Task):
+    """Update the given collections, queueing the tasks to import or remove the files
+    that changed in their folders.
+
+    It is recorded in the task journal like the tasks it queues, so that an update which
+    was interrupted is performed again after a restart, while one which completed isn't."""
+
+    def __init__(self, collections):
+        super(UpdateTask, self).__init__()
+        self.collections = list(collections)
+        self.description = 'Update collections'
+
+    def key(self):
+        return (self.__class__.__name__, tuple(c.name for c in self.collections))
+
+    def journalEntry(self):
+        return { 'type': 'update',
+                 'collections': [ c.name for c in self.collections ],
+                 'priority': self.priority }
+
+    def perform(self):
+        for collection in self.collections:
+            self.token.check()
+            collection.update()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from threading import Thread, Timer, Lock
+import ctypes
+import ctypes.util
+import select
+import struct
+import errno
+import time
+import sys
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+"""The CollectionWatcher keeps the collections up-to-date with the files in their
+folders as they change, without having to walk through all of them.
+
+On Linux, it uses inotify to be told about the files that are created, moved or
+deleted, and turns these events into import and removal tasks once things have
+settled down. The folders that can't be watched this way (other systems, network
+filesystems, too many directories, ...) are scanned periodically instead.
+"""
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# changes on these are not reported to inotify when they are made by other machines
+NETWORK_FILESYSTEMS = set([ 'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs',
+                            'coda', '9p', 'fuse.sshfs', 'fuse.davfs2' ])
+
+DEFAULT_DEBOUNCE = 2
+DEFAULT_SCAN_INTERVAL = 3600
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Minimal binding to the Linux inotify API. Raises OSError if it isn't available."""
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+            self._init = libc.inotify_init
+            self._addWatch = libc.inotify_add_watch
+            self._rmWatch = libc.inotify_rm_watch
+        except (OSError, AttributeError), e:
+            raise OSError(errno.ENOSYS, 'inotify is not available: %s' % e)
+
+        self._addWatch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        self._rmWatch.argtypes = [ ctypes.c_int, ctypes.c_int ]
+
+        self.fd = self._init()
+        if self.fd < 0:
+            self._raise('inotify_init')
+
+    def _raise(self, what):
+        e = ctypes.get_errno()
+        raise OSError(e, '%s: %s' % (what, os.strerror(e)))
+
+    def addWatch(self, path, mask = WATCH_MASK):
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self._addWatch(self.fd, path, mask)
+        if wd < 0:
+            self._raise('inotify_add_watch %s' % path)
+        return wd
+
+    def removeWatch(self, wd):
+        # the watch might already be gone with its directory, that's fine
+        self._rmWatch(self.fd, wd)
+
+    def read(self, timeout = None):
+        """Return the list of (wd, mask, cookie, name) events that happened, waiting at
+        most timeout seconds for them."""
+        ready, _, _ = select.select([ self.fd ], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos+length].rstrip('\0')
+            pos += length
+            try:
+                name = name.decode(sys.getfilesystemencoding())
+            except UnicodeDecodeError:
+                pass
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def filesystemType(path):
+    """Return the type of the filesystem the given path is on, or None if we can't
+    tell (only on Linux)."""
+    path = os.path.realpath(path)
+    mountpoint, fstype = '', None
+    try:
+        for line in open('/proc/mounts'):
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            mp = fields[1].replace('\\040', ' ')
+            if ((path == mp or path.startswith(os.path.join(mp, ''))) and
+                len(mp) > len(mountpoint)):
+                mountpoint, fstype = mp, fields[2]
+    except IOError:
+        return None
+    return fstype
+
+
+class CollectionWatcher(object):
+
+    def __init__(self, collections, debounce = DEFAULT_DEBOUNCE,
+                 scanInterval = DEFAULT_SCAN_INTERVAL):
+        self.collections = collections
+        self.debounce = debounce
+        # events keep coming while big folders are being copied, don't wait forever
+        self.maxDelay = debounce * 10
+        self.scanInterval = scanInterval
+
+        self.lock = Lock()
+        # wd -> (directory, [ (collection, recursive) ])
+        self.watches = {}
+        # (collection, filename) -> 'import' or 'remove'
+        self.pending = {}
+        self.firstEvent = self.lastEvent = None
+        # collection -> folders that need to be scanned periodically
+        self.unwatched = {}
+        # whether we missed some events, and whether the collections are being updated
+        # because of it
+        self.overflowed = False
+        self.updating = False
+
+        try:
+            self.inotify = Inotify()
+        except OSError, e:
+            log.info('Cannot watch the collections, scanning them periodically instead: %s' % e)
+            self.inotify = None
+
+        self.running = True
+        self._scanTimer = None
+        self.reload()
+
+        if self.inotify is not None:
+            self.thread = Thread(target = self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+        self.scheduleScan()
+
+    def reload(self):
+        """Watch the folders of the collections again, after they changed."""
+        with self.lock:
+            if self.inotify is not None:
+                for wd in self.watches:
+                    self.inotify.removeWatch(wd)
+            self.watches = {}
+            self.unwatched = {}
+
+            for collection in self.collections:
+                for folder, recursive in collection.folders:
+                    if not folder or not os.path.isdir(folder):
+                        continue
+                    if self._canWatch(folder):
+                        try:
+                            self._watchTree(folder, collection, recursive)
+                            continue
+                        except OSError, e:
+                            log.warning('Cannot watch %s, scanning it periodically instead: %s' % (folder, e))
+                    self.unwatched.setdefault(collection, []).append((folder, recursive))
+
+        log.info('Watching %d folders for changes' % len(self.watches))
+
+    def _canWatch(self, folder):
+        if self.inotify is None:
+            return False
+        fstype = filesystemType(folder)
+        if fstype in NETWORK_FILESYSTEMS:
+            log.info('%s is on a network filesystem (%s), it will be scanned periodically' % (folder, fstype))
+            return False
+        return True
+
+    def _watchTree(self, folder, collection, recursive):
+        folders = [ folder ]
+        if recursive:
+            folders += [ os.path.join(root, d)
+                         for root, dirs, files in os.walk(folder, followlinks = True)
+                         for d in dirs ]
+
+        for f in folders:
+            wd = self.inotify.addWatch(f)
+            directory, owners = self.watches.setdefault(wd, (f, []))
+            if (collection, recursive) not in owners:
+                owners.append((collection, recursive))
+
+    def quit(self):
+        self.running = False
+        if self._scanTimer is not None:
+            self._scanTimer.cancel()
+
+    def scheduleScan(self):
+        if not self.running or not self.scanInterval:
+            return
+        t = Timer(self.scanInterval, self.scan)
+        t.daemon = True
+        self._scanTimer = t
+        t.start()
+
+    def scan(self):
+        """Look for new and deleted files in the folders that are not watched."""
+        with self.lock:
+            unwatched = dict(self.unwatched)
+        for collection, folders in unwatched.items():
+            try:
+                collection.update(folders)
+            except Exception, e:
+                log.warning('Could not scan %s collection: %s' % (collection.name, e))
+        self.scheduleScan()
+
+    def _run(self):
+        while self.running:
+            try:
+                events = self.inotify.read(timeout = self.debounce / 2.0)
+            except (OSError, select.error), e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                log.error('Stopped watching the collections: %s' % e)
+                return
+
+            with self.lock:
+                for event in events:
+                    self._processEvent(*event)
+                toFlush = self._takePending()
+                self._updateIfOverflowed()
+
+            self._flush(toFlush)
+
+        self.inotify.close()
+
+    def _processEvent(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            # we missed some events, everything will be looked at again
+            self.overflowed = True
+            return
+
+        watch = self.watches.get(wd)
+        if watch is None:
+            return
+        directory, owners = watch
+
+        if mask & IN_IGNORED:
+            # the directory is gone, or has been unwatched
+            del self.watches[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # the files inside it are dealt with by the parent directory events
+            return
+
+        filename = os.path.join(directory, name)
+        now = time.time()
+
+        for collection, recursive in owners:
+            if mask & IN_ISDIR:
+                if not recursive:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watchTree(filename, collection, True)
+                    except OSError, e:
+                        log.warning('Cannot watch %s: %s' % (filename, e))
+                    # files could have been there before we started watching
+                    for f in collection.collectionFiles([ (filename, True) ]):
+                        self.pending[(collection, f)] = 'import'
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    for f in collection.knownFiles(filename):
+                        self.pending[(collection, f)] = 'remove'
+                else:
+                    continue
+
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                if not collection.isCollectionFile(filename):
+                    continue
+                self.pending[(collection, filename)] = 'import'
+
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.pending[(collection, filename)] = 'remove'
+
+            else:
+                continue
+
+            if self.firstEvent is None:
+                self.firstEvent = now
+            self.lastEvent = now
+
+    def _updateIfOverflowed(self):
+        """Update all the collections in the background if we missed some events, unless
+        they are being updated already. Should be called with the lock held."""
+        if not self.overflowed or self.updating:
+            return
+        log.warning('Too many changes in the collections, updating them')
+        self.overflowed = False
+        self.updating = True
+        t = Thread(target = self._updateAll)
+        t.daemon = True
+        t.start()
+
+    def _updateAll(self):
+        while True:
+            for collection in self.collections:
+                try:
+                    collection.update()
+                except Exception, e:
+                    log.warning('Could not update %s collection: %s' % (collection.name, e))
+
+            # the events missed during the update might not have been seen by it
+            with self.lock:
+                if not self.overflowed or not self.running:
+                    self.updating = False
+                    return
+                self.overflowed = False
+
+    def _takePending(self):
+        """Return the pending changes if things have settled down, and forget them."""
+        if not self.pending:
+            return {}
+        now = time.time()
+        if now - self.lastEvent < self.debounce and now - self.firstEvent < self.maxDelay:
+            return {}
+
+        pending = self.pending
+        self.pending = {}
+        self.firstEvent = self.lastEvent = None
+        return pending
+
+    def _flush(self, pending):
+        imports, removals = {}, {}
+        for (collection, filename), action in pending.items():
+            # only keep what is still true
+            if action == 'import' and os.path.exists(filename):
+                imports.setdefault(collection, []).append(filename)
+            elif action == 'remove' and not os.path.exists(filename):
+                removals.setdefault(collection, []).append(filename)
+
+        for collection, files in removals.items():
+            collection.removeFiles(sorted(files))
+        for collection, files in imports.items():
+            collection.importFiles(sorted(files))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+import hashlib
+import json
+import time
+import sys
+import os
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+"""This module contains an on-disk cache for HTTP responses which remembers their
+validators (ETag and Last-Modified headers), so that a stale response can be
+revalidated with a conditional request instead of being downloaded again.
+"""
+
+
+def maxAge(headers):
+    """Return the number of seconds a response can be used without revalidating it
+    according to its Cache-Control header, or None if it shouldn't be stored at all."""
+    cacheControl = (headers.get('cache-control') or '').lower()
+    if 'no-store' in cacheControl:
+        return None
+    if 'no-cache' in cacheControl:
+        return 0
+    m = re.search(r'max-age\s*=\s*(\d+)', cacheControl)
+    if m:
+        return int(m.group(1))
+    return 0
+
+
+class HttpCache(object):
+    """Store the body of responses along with their validators and expiration date,
+    in two files named after the hash of the url."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, url, ext):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return os.path.join(self.directory, '%s.%s' % (hashlib.sha1(url).hexdigest(), ext))
+
+    def _write(self, filename, data):
+        # write to a temp file first so that no other thread ever reads a partial file
+        tmpfile = '%s.%d.tmp' % (filename, id(data))
+        with open(tmpfile, 'wb') as f:
+            f.write(data)
+        self._replace(tmpfile, filename)
+
+    def _replace(self, tmpfile, filename):
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpfile, filename)
+
+    def lookup(self, url):
+        """Return (info, body) for the given url, info being a dict containing its
+        'etag', 'lastModified' and 'expires' values, or (None, None) if not cached."""
+        try:
+            info = json.load(open(self._filename(url, 'json')))
+            body = open(self._filename(url, 'body'), 'rb').read()
+            return info, body
+        except (IOError, ValueError):
+            return None, None
+
+    def lookupInfo(self, url):
+        """Return the info of the given url (see lookup), or None if not cached."""
+        try:
+            return json.load(open(self._filename(url, 'json')))
+        except (IOError, ValueError):
+            return None
+
+    def openBody(self, url):
+        """Return the cached body of the given url as an open file, or None."""
+        try:
+            return open(self._filename(url, 'body'), 'rb')
+        except IOError:
+            return None
+
+    def isFresh(self, info):
+        return info is not None and time.time() < info['expires']
+
+    def conditionalHeaders(self, info):
+        """Return the headers to send to revalidate a cached response."""
+        headers = {}
+        if info is None:
+            return headers
+        if info.get('etag'):
+            headers['If-None-Match'] = info['etag']
+        if info.get('lastModified'):
+            headers['If-Modified-Since'] = info['lastModified']
+        return headers
+
+    def store(self, url, headers, body):
+        """Store a full (200) response. Return False if it isn't allowed to be cached."""
+        if maxAge(headers) is None:
+            return False
+        self._write(self._filename(url, 'body'), body)
+        self._storeInfo(url, headers)
+        return True
+
+    def _storeInfo(self, url, headers):
+        info = { 'url': url,
+                 'etag': headers.get('etag'),
+                 'lastModified': headers.get('last-modified'),
+                 'expires': time.time() + maxAge(headers) }
+        self._write(self._filename(url, 'json'), json.dumps(info))
+
+    def storeStream(self, url, headers, chunks):
+        """Same as store, but for a body given as an iterator of strings. Return an
+        iterator generating the same strings, which stores the response once they have
+        all been read. Nothing is stored if they aren't."""
+        if maxAge(headers) is None:
+            return chunks
+        return self._storing(url, headers, chunks)
+
+    def _storing(self, url, headers, chunks):
+        filename = self._filename(url, 'body')
+        tmpfile = '%s.%d.tmp' % (filename, id(chunks))
+        try:
+            with open(tmpfile, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+        except:
+            # incomplete body, or the reader stopped before its end
+            os.remove(tmpfile)
+            raise
+
+        self._replace(tmpfile, filename)
+        self._storeInfo(url, headers)
+
+    def refresh(self, url, info, headers):
+        """Update the expiration date of a cached response after it has been
+        revalidated (304), using the headers of the new response."""
+        age = maxAge(headers)
+        info['expires'] = time.time() + (age or 0)
+        for key, header in (('etag', 'etag'), ('lastModified', 'last-modified')):
+            if headers.get(header):
+                info[key] = headers[header]
+        self._write(self._filename(url, 'json'), json.dumps(info))
+
+    def clear(self):
+        for f in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, f))
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from StringIO import StringIO
+from threading import Lock
+from urllib import urlencode
+from smewt.base.httpcache import HttpCache
+import requests
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+"""This module contains the HTTP client used by all the parts of smewt that need to
+fetch something on the web. It keeps the connections to each host alive and shares
+them between threads, and retries the requests that fail because of the network."""
+
+DEFAULT_TIMEOUT = 20
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 10
+
+# size of the pieces in which the streamed responses are read
+CHUNK_SIZE = 64 * 1024
+
+
+class HttpClient(object):
+    """Thin wrapper around a requests session with connection pooling, timeouts and
+    retries. The get/post/delete methods take the same arguments as the requests
+    functions of the same name and return the response.
+
+    gzip compression is negotiated and handled by requests itself."""
+
+    # wait that many seconds before the first retry, then twice as long for each next one
+    retryDelay = 0.5
+
+    def __init__(self, timeout = DEFAULT_TIMEOUT, retries = DEFAULT_RETRIES, poolSize = DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+
+        headers = { 'Accept-Encoding': 'gzip, deflate',
+                    'Connection': 'keep-alive' }
+
+        if hasattr(requests, 'adapters'):
+            # requests >= 1.0
+            self.session = requests.Session()
+            self.session.headers.update(headers)
+            adapter = requests.adapters.HTTPAdapter(pool_connections = poolSize,
+                                                    pool_maxsize = poolSize)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        else:
+            self.session = requests.session(headers = headers,
+                                            config = { 'keep_alive': True,
+                                                       'pool_connections': poolSize,
+                                                       'pool_maxsize': poolSize })
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        delay = self.retryDelay
+        for attempt in range(self.retries + 1):
+            last = (attempt == self.retries)
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code < 500 or last:
+                    return response
+                log.debug('HTTP %s %s: server error %d' % (method, url, response.status_code))
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout), e:
+                if last:
+                    raise
+                log.debug('HTTP %s %s: %s' % (method, url, e))
+
+            log.info('Retrying %s %s in %.1f seconds' % (method, url, delay))
+            time.sleep(delay)
+            delay *= 2
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def read(self, url, **kwargs):
+        """Return the contents at the given url, raising an exception if it couldn't
+        be retrieved."""
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.content
+
+    def urlopen(self, url):
+        """Same as read, but return a file-like object, like urllib.urlopen."""
+        return StringIO(self.read(url))
+
+    def getStreaming(self, url, **kwargs):
+        """Same as get, but the body of the response is only downloaded as it is read,
+        through its iter_content() method."""
+        if hasattr(requests, 'adapters'):
+            kwargs['stream'] = True
+        else:
+            kwargs['prefetch'] = False
+        return self.get(url, **kwargs)
+
+    def stream(self, url, chunkSize = CHUNK_SIZE):
+        """Same as urlopen, but the returned file-like object reads the contents as
+        they arrive instead of keeping them all in memory."""
+        response = self.getStreaming(url)
+        response.raise_for_status()
+        return ChunkReader(response.iter_content(chunkSize))
+
+    def download(self, url, filename, chunkSize = CHUNK_SIZE):
+        """Write the contents at the given url to a file as they arrive, instead of
+        keeping them in memory."""
+        response = self.getStreaming(url)
+        response.raise_for_status()
+        with open(filename, 'wb') as f:
+            for chunk in response.iter_content(chunkSize):
+                f.write(chunk)
+
+
+class ChunkReader(object):
+    """File-like object reading the strings generated by an iterator."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size = -1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class CachedResponse(object):
+    """Response served from an HttpCache, with the same interface as the ones
+    from requests that are used in smewt."""
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+        self.status_code = 200
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+
+class CachingHttpClient(object):
+    """Same interface as HttpClient, except that its GET requests go through an
+    HttpCache, and are revalidated with conditional requests once stale."""
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def get(self, url, params = None, headers = None, **kwargs):
+        fullurl = url
+        if params:
+            fullurl += ('&' if '?' in url else '?') + urlencode(sorted(params.items()))
+
+        info, body = self.cache.lookup(fullurl)
+        if self.cache.isFresh(info):
+            log.debug('HTTP cache: fresh %s' % fullurl)
+            return CachedResponse(fullurl, body)
+
+        headers = dict(headers or {})
+        headers.update(self.cache.conditionalHeaders(info))
+        response = self.client.get(url, params = params, headers = headers, **kwargs)
+
+        if response.status_code == 304 and info is not None:
+            log.debug('HTTP cache: not modified %s' % fullurl)
+            self.cache.refresh(fullurl, info, response.headers)
+            return CachedResponse(fullurl, body)
+
+        if response.status_code == 200:
+            self.cache.store(fullurl, response.headers, response.content)
+
+        return response
+
+    def post(self, url, **kwargs):
+        return self.client.post(url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.client.delete(url, **kwargs)
+
+    def read(self, url, **kwargs):
+        response = self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.content
+
+    def urlopen(self, url):
+        return StringIO(self.read(url))
+
+    def stream(self, url):
+        info = self.cache.lookupInfo(url)
+        if self.cache.isFresh(info):
+            body = self.cache.openBody(url)
+            if body is not None:
+                log.debug('HTTP cache: fresh %s' % url)
+                return body
+
+        response = self.client.getStreaming(url, headers = self.cache.conditionalHeaders(info))
+        if response.status_code == 304 and info is not None:
+            body = self.cache.openBody(url)
+            if body is not None:
+                log.debug('HTTP cache: not modified %s' % url)
+                self.cache.refresh(url, info, response.headers)
+                return body
+            # it disappeared in the meantime
+            response = self.client.getStreaming(url)
+
+        response.raise_for_status()
+        chunks = response.iter_content(CHUNK_SIZE)
+        if response.status_code == 200:
+            chunks = self.cache.storeStream(url, response.headers, chunks)
+        return ChunkReader(chunks)
+
+
+_client = None
+_cache = None
+_clientLock = Lock()
+
+def setClient(client):
+    global _client
+    with _clientLock:
+        _client = client
+
+def setCacheDir(directory):
+    """Use an on-disk HTTP cache in the given directory for cachingClient(), or
+    no cache at all if it is None."""
+    global _cache
+    with _clientLock:
+        _cache = HttpCache(directory) if directory is not None else None
+
+def cachingClient():
+    """Return the shared HTTP client, going through the HTTP cache if there is one."""
+    c = client()
+    with _clientLock:
+        if _cache is None:
+            return c
+        return CachingHttpClient(c, _cache)
+
+def clearCache():
+    with _clientLock:
+        if _cache is not None:
+            _cache.clear()
+
+def client():
+    """Return the HTTP client shared by the whole application."""
+    global _client
+    with _clientLock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def get(url, **kwargs):
+    return client().get(url, **kwargs)
+
+def read(url, **kwargs):
+    return client().read(url, **kwargs)
+
+def urlopen(url):
+    return client().urlopen(url)
+
+def stream(url):
+    return client().stream(url)
+
+def download(url, filename):
+    return client().download(url, filename)
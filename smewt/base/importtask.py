@@ -20,28 +20,315 @@
 #
 
 from pygoo import MemoryObjectGraph, Equal
-from smewt.base import Task
-from smewt.ontology import Media
+from smewt.base import Task, TaskCancelled, TaskRetry, posters
+from smewt.base.pipelinestats import timed, tracing
+from smewt.base.utils import tolist
+from smewt.ontology import Media, Metadata, Series, Episode, Movie, Subtitle
+from threading import RLock
+import os
 import logging
 
 log = logging.getLogger(__name__)
 
+# import tasks run concurrently, but the collection graph can only be modified
+# by one of them at a time
+commitLock = RLock()
+
+
+def unknownMetadata(md):
+    """Return whether the given metadata is the placeholder used by the online
+    guessers when they couldn't find anything."""
+    if md.isinstance(Subtitle):
+        md = md.metadata
+    if md.isinstance(Episode):
+        md = md.series
+    return md.get('title') == 'Unknown'
+
+
+# properties of the metadata that are set by the user rather than found by the taggers
+userProperties = [ 'watched', 'lastViewed', 'lastViewedTab' ]
+
+def transferUserState(old, new):
+    """Copy what the user has set on a metadata node which is being replaced by another
+    one (whether it has been watched, its comments, ...) to the new node."""
+    if old.node is new.node:
+        return
+    if not any(old.isinstance(cls) and new.isinstance(cls) for cls in (Episode, Movie, Series)):
+        return
+
+    for prop in userProperties:
+        if old.get(prop) is not None and new.get(prop) is None:
+            new.set(prop, old.get(prop))
+
+    for comment in tolist(old.get('comments')):
+        comment.metadata = new
+
+    if old.isinstance(Episode):
+        transferUserState(old.series, new.series)
+
+
+def updateMetadata(md, new):
+    """Copy the properties of the given new metadata node (found online for instance) onto
+    the one in the collection which is equal to it, including the ones of its series."""
+    if md.node is new.node:
+        return
+    for name, value in new.node.literal_items():
+        if md.get(name) != value:
+            md.set(name, value)
+
+    if md.isinstance(Episode) and new.isinstance(Episode):
+        updateMetadata(md.series, new.series)
+
+
+def removeOrphan(collection, md):
+    """Delete the given metadata node if nothing refers to it anymore, and then do the
+    same with the nodes it referred to."""
+    for prop in ('files', 'subtitles', 'episodes', 'comments'):
+        if tolist(md.get(prop)):
+            return
+
+    parents = [ md.get(prop) for prop in ('series', 'metadata') if md.get(prop) is not None ]
+    log.debug('Removing orphaned metadata: %s' % md)
+    collection.delete_node(md.node)
+
+    for parent in parents:
+        removeOrphan(collection, parent)
+
+
 class ImportTask(Task):
-    def __init__(self, collection, taggerType, filename):
+    """Tag a file and import it into the collection.
+
+    If online is False, only the information that can be guessed locally from the
+    filename is used, and an EnrichTask should be queued to complete it later."""
+
+    # most of the time is spent waiting for the online metadata providers
+    concurrency = 8
+    timeout = 120
+
+    # consecutive imports into the same collection are done in batches (see BatchImportTask)
+    batchSize = 20
+
+    def __init__(self, collection, taggerType, filename, online = True):
         super(ImportTask, self).__init__()
         self.collection = collection
         self.taggerType = taggerType
         self.filename = filename
+        self.online = online
         self.description = 'Importing %s' % filename
 
+    def key(self):
+        # the tagger tells us which collection the file is being imported into
+        return (self.__class__.__name__, self.taggerType.__name__, self.filename)
+
+    def batchKey(self):
+        return (self.__class__, id(self.collection), self.taggerType, self.online)
+
+    @classmethod
+    def batch(cls, tasks):
+        return BatchImportTask(tasks[0].collection, tasks[0].taggerType,
+                               [ t.filename for t in tasks ], online = tasks[0].online,
+                               merge = cls.merge, token = tasks[0].token, tasks = tasks)
+
+    def journalEntry(self):
+        return { 'type': 'import',
+                 'tagger': self.taggerType.__name__,
+                 'filename': self.filename,
+                 'online': self.online,
+                 'priority': self.priority }
+
+    @staticmethod
+    def merge(collection, media):
+        """Import the given media object and its metadata into the collection."""
+        media = collection.add_object(media, recurse = Equal.OnUnique)
+        # the poster might have become ready while we were busy importing
+        posters.applyPosters(media)
+
     def perform(self):
         query = MemoryObjectGraph()
         query.Media(filename = self.filename)
-        result = self.taggerType().perform(query)
+        with tracing(self.filename):
+            with timed(self.taggerType.__name__):
+                result = self.taggerType(online = self.online).perform(query)
 
         # TODO: check that we actually found something useful
         #result.display_graph()
 
-        # import the data into our collection
-        self.collection.add_object(result.find_one(Media),
-                                   recurse = Equal.OnUnique)
+        # import the data into our collection, unless we have been cancelled in the meantime
+        with commitLock:
+            self.token.commit()
+            with timed('commit'):
+                self.merge(self.collection, result.find_one(Media))
+
+
+class EnrichTask(ImportTask):
+    """Look up online the information about a file that has already been imported
+    with only its local information, and upgrade its metadata in the collection."""
+
+    # run after all the local imports, so that new files show up as soon as possible
+    defaultPriority = 2
+
+    # lookups that failed are tried again a few times, and after a restart if they still fail
+    retryDelays = (5 * 60, 30 * 60, 3 * 3600)
+
+    def __init__(self, collection, taggerType, filename):
+        super(EnrichTask, self).__init__(collection, taggerType, filename, online = True)
+        self.priority = self.defaultPriority
+        self.description = 'Looking up %s' % filename
+
+    def journalEntry(self):
+        entry = super(EnrichTask, self).journalEntry()
+        entry['type'] = 'enrich'
+        del entry['online']
+        return entry
+
+    def perform(self):
+        try:
+            super(EnrichTask, self).perform()
+        except (TaskCancelled, TaskRetry):
+            raise
+        except Exception, e:
+            # most likely the metadata site couldn't be reached
+            raise TaskRetry('Could not look up %s: %s' % (self.filename, e))
+
+    @staticmethod
+    def merge(collection, media):
+        if all(unknownMetadata(md) for md in tolist(media.get('metadata'))):
+            raise TaskRetry('No online information found for %s, keeping the local one for now' % media.filename)
+
+        existing = collection.find_one(Media, filename = media.filename)
+        if existing is None:
+            # it hasn't been imported locally (anymore), this is a normal import
+            ImportTask.merge(collection, media)
+            return
+
+        # adding the media object itself would only find the existing one, unchanged, so
+        # the metadata is added on its own and then linked to it. Metadata that was
+        # already there (same title, same episode, ...) gets the new information
+        previous = tolist(existing.get('metadata'))
+        current = []
+        for md in tolist(media.get('metadata')):
+            new = collection.add_object(md, recurse = Equal.OnUnique)
+            updateMetadata(new, md)
+            current.append(new)
+        existing.metadata = current if len(current) > 1 else current[0]
+        posters.applyPosters(existing)
+
+        for md in previous:
+            if any(md.node is new.node for new in current):
+                continue
+            for new in current:
+                transferUserState(md, new)
+            removeOrphan(collection, md)
+
+
+class BatchImportTask(Task):
+    """Import several files at once, using the same tagger and metadata provider for all
+    of them, and merging all the results into the collection in a single step.
+
+    The TaskManager creates these automatically from consecutive ImportTasks, but they
+    can also be queued directly. In the first case, tasks are the ImportTasks performed
+    by the batch, and the ones that failed are tried again if their class allows it."""
+
+    concurrency = ImportTask.concurrency
+    timeout = ImportTask.timeout * ImportTask.batchSize
+
+    def __init__(self, collection, taggerType, filenames, online = True, merge = ImportTask.merge,
+                 token = None, tasks = None):
+        super(BatchImportTask, self).__init__()
+        self.collection = collection
+        self.taggerType = taggerType
+        self.filenames = list(filenames)
+        self.online = online
+        self.merge = merge
+        self.tasks = dict((t.filename, t) for t in tasks or [])
+        self.description = 'Importing %d files' % len(self.filenames)
+        if token is not None:
+            self.token = token
+
+    def perform(self):
+        mdprovider = self.taggerType.newMetadataProvider() if self.online else None
+        tagger = self.taggerType(mdprovider, online = self.online)
+
+        queries = []
+        for filename in self.filenames:
+            query = MemoryObjectGraph()
+            query.Media(filename = filename)
+            queries.append(query)
+
+        try:
+            with timed('%s.prepare' % self.taggerType.__name__):
+                tagger.prepare(queries)
+        except Exception, e:
+            # not fatal, the files will just be tagged separately
+            log.warning('Could not prepare import of %d files: %s' % (len(queries), e))
+
+        working = MemoryObjectGraph()
+        failed = []
+        for filename, query in zip(self.filenames, queries):
+            self.token.check()
+
+            try:
+                with tracing(filename):
+                    with timed(self.taggerType.__name__):
+                        result = tagger.perform(query)
+            except Exception, e:
+                log.warning('Could not import %s: %s' % (filename, e))
+                failed.append(filename)
+                continue
+
+            working.add_object(result.find_one(Media), recurse = Equal.OnUnique)
+
+        with commitLock:
+            self.token.commit()
+            with timed('commit'):
+                for media in working.find_all(Media):
+                    try:
+                        self.merge(self.collection, media)
+                    except TaskRetry, e:
+                        log.info('%s' % e)
+                        failed.append(media.filename)
+
+        retry = [ self.tasks[f] for f in failed if f in self.tasks and self.tasks[f].retryDelays ]
+        if retry:
+            raise TaskRetry('%d files out of %d could not be imported' % (len(retry), len(self.filenames)),
+                            tasks = retry)
+
+
+class RemoveTask(Task):
+    """Remove files that have disappeared from the disk from the collection, along
+    with the metadata that only they were referring to."""
+
+    def __init__(self, collection, filenames):
+        super(RemoveTask, self).__init__()
+        self.collection = collection
+        self.filenames = list(filenames)
+        if len(self.filenames) == 1:
+            self.description = 'Removing %s' % self.filenames[0]
+        else:
+            self.description = 'Removing %d files' % len(self.filenames)
+
+    def key(self):
+        return (self.__class__.__name__, tuple(sorted(self.filenames)))
+
+    def journalEntry(self):
+        return { 'type': 'remove',
+                 'files': self.filenames,
+                 'priority': self.priority }
+
+    def perform(self):
+        with commitLock:
+            self.token.commit()
+            for filename in self.filenames:
+                # it might have come back in the meantime
+                if os.path.exists(filename):
+                    continue
+
+                media = self.collection.find_one(Media, filename = filename)
+                if media is None:
+                    continue
+
+                log.info('Removing from collection: %s' % filename)
+                metadata = tolist(media.get('metadata'))
+                self.collection.delete_node(media.node)
+                for md in metadata:
+                    removeOrphan(self.collection, md)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, local
+import heapq
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class StageStats(object):
+    """Timing statistics for one stage of the import pipeline. Only the most recent
+    durations are kept for computing the percentiles."""
+
+    maxSamples = 1000
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen = self.maxSamples)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+    def toDict(self):
+        return { 'count': self.count,
+                 'total': self.total,
+                 'mean': self.total / self.count if self.count else 0.0,
+                 'max': self.max,
+                 'p50': self.percentile(50),
+                 'p90': self.percentile(90),
+                 'p99': self.percentile(99) }
+
+
+class PipelineStats(object):
+    """Collect the time spent in each stage of the import pipeline (guessers, solvers,
+    taggers, online lookups, ...).
+
+    Stages can be nested, so the total times of the different stages overlap: the time
+    spent in a tagger also includes the time spent in the guessers it uses.
+
+    If slowestTraces is not 0, the detailed list of stages of the slowest imports
+    (one trace per file, see tracing()) is kept as well."""
+
+    def __init__(self, slowestTraces = 0):
+        self.lock = Lock()
+        self.slowestTraces = slowestTraces
+        self.current = local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.traces = []  # heap of (duration, filename, [ (stage, duration) ])
+
+    def record(self, stage, duration):
+        with self.lock:
+            self.stages.setdefault(stage, StageStats()).add(duration)
+
+        trace = getattr(self.current, 'trace', None)
+        if trace is not None:
+            trace.append((stage, duration))
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start)
+
+    @contextmanager
+    def tracing(self, filename):
+        """Time the import of the given file, and keep the trace of all the stages
+        it went through if it is one of the slowest ones."""
+        if not self.slowestTraces or getattr(self.current, 'trace', None) is not None:
+            with self.timed('import'):
+                yield
+            return
+
+        self.current.trace = []
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            trace, self.current.trace = self.current.trace, None
+            self.record('import', duration)
+
+            with self.lock:
+                item = (duration, filename, trace)
+                if len(self.traces) < self.slowestTraces:
+                    heapq.heappush(self.traces, item)
+                elif duration > self.traces[0][0]:
+                    heapq.heapreplace(self.traces, item)
+
+    def setSlowestTraces(self, n):
+        with self.lock:
+            self.slowestTraces = n
+            self.traces = heapq.nlargest(n, self.traces)
+            heapq.heapify(self.traces)
+
+    def toDict(self):
+        with self.lock:
+            return { 'stages': dict((name, s.toDict()) for name, s in self.stages.items()),
+                     'slowest': [ { 'filename': filename,
+                                    'duration': duration,
+                                    'stages': trace }
+                                  for duration, filename, trace in sorted(self.traces, reverse = True) ] }
+
+
+stats = PipelineStats()
+
+def timed(stage):
+    """Context manager recording the time spent in its block as the given stage
+    in the global pipeline stats."""
+    return stats.timed(stage)
+
+def tracing(filename):
+    return stats.tracing(filename)
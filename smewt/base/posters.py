@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from smewt.base import httpclient
+from smewt.base.pipelinestats import timed
+from smewt.base.utils import tolist
+from threading import Thread, Lock
+from Queue import Queue
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import sys
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+"""This module takes care of the posters of the series and movies, outside of the
+import tasks: they are downloaded by a small pool of threads, and their resized
+versions are created by a separate worker and kept in a PosterStore.
+
+Metadata objects only need to know the url of their poster (posterUrl property):
+until it is ready, they show a placeholder image instead, and they are updated
+by the listeners of the pipeline once it is.
+"""
+
+PLACEHOLDER = '/static/images/noposter.png'
+
+DEFAULT_DOWNLOADS = 4
+
+DEFAULT_RESIZED_CACHE_SIZE = 50 * 1024 * 1024
+
+
+def _atomicWrite(filename, data):
+    tmpfile = '%s.%d.tmp' % (filename, id(data))
+    with open(tmpfile, 'wb') as f:
+        f.write(data)
+    if sys.platform == 'win32' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmpfile, filename)
+
+def _fileHash(filename, chunkSize = 64 * 1024):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PosterStore(object):
+    """Content-addressed store for the posters.
+
+    Images are kept under the hash of their contents, so the same artwork is only
+    stored once even when it comes from several urls, and the store remembers which
+    url gave which image so that each url is only downloaded once.
+
+    The index of the urls is kept in index.json, and the images added since it was
+    last written are appended to index.log, one JSON line each. The log is merged into
+    index.json when loading the store and when it has grown over compactionThreshold
+    lines, so that adding an image doesn't need to rewrite the whole index.
+
+    Only resized JPEG variants of the images are kept, as the files never change
+    once written they can be served with immutable cache headers."""
+
+    # bounding boxes of the variants, (width, height)
+    variants = { 'list': (60, 90),
+                 'grid': (160, 240),
+                 'detail': (400, 600) }
+
+    quality = 85
+
+    # number of lines in index.log after which it is merged into index.json
+    compactionThreshold = 1000
+
+    def __init__(self, directory, baseUrl):
+        self.directory = directory
+        self.baseUrl = baseUrl
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.lock = Lock()
+        self.indexFilename = os.path.join(directory, 'index.json')
+        self.logFilename = os.path.join(directory, 'index.log')
+        self.logLines = 0
+        try:
+            self.index = json.load(open(self.indexFilename))
+        except IOError:
+            self.index = {}
+        except ValueError:
+            log.warning('Poster index is corrupted, starting with an empty one')
+            self.index = {}
+
+        self._loadLog()
+        if self.logLines:
+            self._compact()
+
+    def _loadLog(self):
+        try:
+            lines = open(self.logFilename).readlines()
+        except IOError:
+            return
+
+        for n, line in enumerate(lines):
+            try:
+                url, contentHash = json.loads(line)
+            except (ValueError, TypeError):
+                # most likely the last line was only partially written
+                log.warning('Ignoring invalid line %d in %s' % (n+1, self.logFilename))
+                continue
+            self.index[url] = contentHash
+        self.logLines = len(lines)
+
+    def _compact(self):
+        # index.json is replaced first, so that the log is never lost before being merged
+        _atomicWrite(self.indexFilename, json.dumps(self.index))
+        open(self.logFilename, 'w').close()
+        self.logLines = 0
+
+    def filename(self, contentHash, variant):
+        return os.path.join(self.directory, '%s_%s.jpg' % (contentHash, variant))
+
+    def url(self, contentHash, variant):
+        return '%s/%s_%s.jpg' % (self.baseUrl, contentHash, variant)
+
+    def lookup(self, url):
+        """Return the hash of the image downloaded from the given url, or None if
+        it isn't in the store."""
+        with self.lock:
+            return self.index.get(url)
+
+    def add(self, url, filename):
+        """Add the image in the given file, downloaded from the given url, to the
+        store and return its hash. The variants are only created if we didn't
+        already have the same image."""
+        contentHash = _fileHash(filename)
+
+        if not all(os.path.exists(self.filename(contentHash, variant))
+                   for variant in self.variants):
+            self._createVariants(filename, contentHash)
+        else:
+            log.debug('Poster %s is the same as an already stored one' % url)
+
+        with self.lock:
+            self.index[url] = contentHash
+            with open(self.logFilename, 'a') as f:
+                f.write(json.dumps([ url, contentHash ]) + '\n')
+            self.logLines += 1
+            if self.logLines >= self.compactionThreshold:
+                self._compact()
+
+        return contentHash
+
+    def _createVariants(self, filename, contentHash):
+        # NOTE: we do the resizing here because if we leave it to the browser,
+        #       it will use a fast resampling algorithm, which will be of lower
+        #       quality than what we achieve here
+        from PIL import Image
+
+        original = Image.open(filename)
+        # JPEG has no alpha channel (and some posters are palette-based PNGs)
+        if original.mode != 'RGB':
+            original = original.convert('RGB')
+
+        for variant, size in self.variants.items():
+            im = original.copy()
+            im.thumbnail(size, Image.ANTIALIAS)
+            vfilename = self.filename(contentHash, variant)
+            tmpfile = vfilename + '.tmp'
+            im.save(tmpfile, 'JPEG', quality = self.quality, optimize = True, progressive = True)
+            if sys.platform == 'win32' and os.path.exists(vfilename):
+                os.remove(vfilename)
+            os.rename(tmpfile, vfilename)
+
+
+class PosterPipeline(object):
+
+    def __init__(self, store, downloads = DEFAULT_DOWNLOADS):
+        self.store = store
+
+        self.lock = Lock()
+        self.pending = set()
+        # functions called with the url of each poster once it is ready
+        self.listeners = []
+
+        # the number of downloads is bounded by the number of threads, and we don't
+        # want to accumulate more downloaded images than we can resize
+        self.downloadQueue = Queue()
+        self.thumbnailQueue = Queue(maxsize = downloads)
+
+        self.threads = [ Thread(target = self._downloadWorker) for i in range(downloads) ]
+        self.threads.append(Thread(target = self._thumbnailWorker))
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def images(self, url, variants = ('list', 'detail')):
+        """Return the urls of the given variants of the poster at the given url,
+        or None if it isn't ready yet. By default, these are (lores, hires)."""
+        contentHash = self.store.lookup(url)
+        if contentHash is None:
+            return None
+        return tuple(self.store.url(contentHash, variant) for variant in variants)
+
+    def request(self, url):
+        """Ask for the poster at the given url to be made available, and return its
+        images if it already is (see images())."""
+        images = self.images(url)
+        if images is not None:
+            return images
+
+        with self.lock:
+            if url not in self.pending:
+                self.pending.add(url)
+                self.downloadQueue.put(url)
+        return None
+
+    def addListener(self, func):
+        self.listeners.append(func)
+
+    def quit(self):
+        for i in range(len(self.threads) - 1):
+            self.downloadQueue.put(None)
+        self.thumbnailQueue.put(None)
+
+    def _downloadWorker(self):
+        while True:
+            url = self.downloadQueue.get()
+            if url is None:
+                return
+
+            urlHash = hashlib.sha1(url.encode('utf-8') if isinstance(url, unicode) else url)
+            tmpfile = os.path.join(self.store.directory, '%s.part' % urlHash.hexdigest())
+            try:
+                with timed('poster.download'):
+                    httpclient.download(url, tmpfile)
+            except Exception, e:
+                log.warning('Could not download poster %s: %s' % (url, e))
+                try:
+                    os.remove(tmpfile)
+                except OSError:
+                    pass
+                with self.lock:
+                    self.pending.discard(url)
+                continue
+
+            self.thumbnailQueue.put((url, tmpfile))
+
+    def _thumbnailWorker(self):
+        while True:
+            job = self.thumbnailQueue.get()
+            if job is None:
+                return
+
+            url, tmpfile = job
+            try:
+                with timed('poster.resize'):
+                    self.store.add(url, tmpfile)
+            except Exception, e:
+                log.warning('Could not create thumbnails for poster %s: %s' % (url, e))
+                continue
+            finally:
+                with self.lock:
+                    self.pending.discard(url)
+                try:
+                    os.remove(tmpfile)
+                except OSError:
+                    pass
+
+            log.debug('Poster ready: %s' % url)
+            for func in self.listeners:
+                try:
+                    func(url)
+                except Exception, e:
+                    log.warning('Error while updating poster %s: %s' % (url, e))
+
+
+class ResizedPosterCache(object):
+    """Bounded on-disk cache of the posters of the store resized to arbitrary sizes,
+    created the first time they are asked for. When it grows over maxSize bytes, the
+    least recently used images are removed first.
+
+    The last access of each image is recorded as the modification time of its file,
+    so that the order of the cache survives restarts."""
+
+    validHash = re.compile('^[0-9a-f]{40}$')
+
+    def __init__(self, store, directory, maxSize):
+        self.store = store
+        self.directory = directory
+        self.maxSize = maxSize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.lock = Lock()
+        # name -> size, from the least to the most recently used
+        self.entries = OrderedDict()
+        self.size = 0
+
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith('.jpg'):
+                st = os.stat(os.path.join(directory, name))
+                files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+
+    def clampSize(self, width, height):
+        """Return the size that will actually be used for an image asked with the
+        given size: we never upscale the largest variant of the store."""
+        maxWidth, maxHeight = self.store.variants['detail']
+        return max(1, min(width, maxWidth)), max(1, min(height, maxHeight))
+
+    def exists(self, contentHash):
+        """Return whether there is an image with the given hash in the store."""
+        return (self.validHash.match(contentHash) is not None and
+                os.path.exists(self.store.filename(contentHash, 'detail')))
+
+    def _name(self, contentHash, width, height):
+        width, height = self.clampSize(width, height)
+        return '%s_%dx%d.jpg' % (contentHash, width, height)
+
+    def get(self, contentHash, width, height):
+        """Return the filename of the image with the given hash resized to fit in
+        the given size, or None if there is no such image in the store."""
+        if not self.validHash.match(contentHash):
+            return None
+        width, height = self.clampSize(width, height)
+        name = self._name(contentHash, width, height)
+        filename = os.path.join(self.directory, name)
+
+        with self.lock:
+            if name in self.entries:
+                try:
+                    os.utime(filename, None)
+                    self.entries[name] = self.entries.pop(name)
+                    return filename
+                except OSError:
+                    # it has been removed behind our back, resize it again
+                    self.size -= self.entries.pop(name)
+
+        source = self.store.filename(contentHash, 'detail')
+        if not os.path.exists(source):
+            return None
+
+        from PIL import Image
+        with timed('poster.resize'):
+            im = Image.open(source)
+            im.thumbnail((width, height), Image.ANTIALIAS)
+            tmpfile = '%s.%d.tmp' % (filename, id(im))
+            im.save(tmpfile, 'JPEG', quality = self.store.quality, optimize = True)
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpfile, filename)
+
+        with self.lock:
+            if name not in self.entries:
+                self.entries[name] = os.path.getsize(filename)
+                self.size += self.entries[name]
+            self._evict()
+
+        return filename
+
+    def forget(self, contentHash, width, height):
+        """Forget the resized image returned by get() for the given hash and size, whose
+        file is gone (it was evicted before it could be served, for instance)."""
+        name = self._name(contentHash, width, height)
+        with self.lock:
+            if name in self.entries and not os.path.exists(os.path.join(self.directory, name)):
+                self.size -= self.entries.pop(name)
+
+    def _evict(self):
+        # never remove the most recent one, which we're about to serve
+        while self.size > self.maxSize and len(self.entries) > 1:
+            name, size = self.entries.popitem(last = False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError, e:
+                log.warning('Could not remove resized poster %s: %s' % (name, e))
+
+    def clear(self):
+        with self.lock:
+            for name in self.entries:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.entries.clear()
+            self.size = 0
+
+
+_pipeline = None
+_resized = None
+_pipelineLock = Lock()
+
+def setPipeline(pipeline):
+    global _pipeline
+    with _pipelineLock:
+        _pipeline = pipeline
+
+def pipeline():
+    """Return the poster pipeline shared by the whole application."""
+    global _pipeline
+    with _pipelineLock:
+        if _pipeline is None:
+            import smewt
+            _pipeline = PosterPipeline(PosterStore(os.path.join(smewt.dirs.user_data_dir, 'posters'),
+                                                   '/user/posters'))
+        return _pipeline
+
+def setResizedCache(resized):
+    global _resized
+    with _pipelineLock:
+        _resized = resized
+
+def resizedCache():
+    """Return the cache of resized posters shared by the whole application."""
+    global _resized
+    store = pipeline().store
+    with _pipelineLock:
+        if _resized is None:
+            import smewt
+            _resized = ResizedPosterCache(store, os.path.join(smewt.dirs.user_cache_dir, 'posters'),
+                                          DEFAULT_RESIZED_CACHE_SIZE)
+        return _resized
+
+
+def requestPoster(md, url):
+    """Set the poster of the given metadata object to the one at the given url, which
+    will be downloaded in the background if necessary."""
+    if url:
+        md.posterUrl = url
+        pipeline().request(url)
+    applyPoster(md)
+
+def applyPoster(md):
+    """Update the images of the given metadata object with its poster, or with the
+    placeholder if it isn't available (yet)."""
+    url = md.get('posterUrl')
+    images = pipeline().images(url) if url else None
+    lores, hires = images or (PLACEHOLDER, PLACEHOLDER)
+    if md.get('loresImage') != lores:
+        md.loresImage = lores
+    if md.get('hiresImage') != hires:
+        md.hiresImage = hires
+
+def applyPosters(media):
+    """Update the images of all the metadata objects related to the given media object
+    that have a poster."""
+    for md in tolist(media.get('metadata')):
+        for related in (md, md.get('metadata'), md.get('series')):
+            if related is not None and related.get('posterUrl'):
+                applyPoster(related)
+
+def posterImage(md, width, height):
+    """Return the url of the poster of the given metadata object resized to fit in
+    the given size, as it is displayed in the templates."""
+    url = md.get('posterUrl')
+    contentHash = pipeline().store.lookup(url) if url else None
+    if contentHash is None:
+        # posters from before the store only have a fixed size
+        return md.get('hiresImage') or PLACEHOLDER
+    width, height = resizedCache().clampSize(width, height)
+    return '/img/%s/%dx%d' % (contentHash, width, height)
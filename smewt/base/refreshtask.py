@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewt.base import Task, TaskRetry, SmewtException
+from smewt.base.importtask import commitLock
+from smewt.base.utils import tolist
+from smewt.ontology import Series, Episode
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MetadataRefreshTask(Task):
+    """Update the information about the episodes in the database with the changes that
+    happened on thetvdb.com since the last refresh.
+
+    Only the series that appear in the TVDB updates list are fetched again, and their
+    episodes are updated in place. If the last refresh is too old for the updates lists,
+    all the series are fetched again.
+
+    The time of the last refresh only moves forward once all the series have been
+    refreshed, the ones that couldn't be are tried again later by the same task."""
+
+    # updates lists provided by TVDB, with the number of days they cover
+    periods = [ (1, 'day'), (7, 'week'), (30, 'month') ]
+
+    patchedProperties = [ 'title', 'synopsis', 'originalAirDate' ]
+
+    retryDelays = (5 * 60, 30 * 60, 3 * 3600)
+
+    def __init__(self, database, mdprovider):
+        super(MetadataRefreshTask, self).__init__(priority = 1)
+        self.database = database
+        self.mdprovider = mdprovider
+        self.description = 'Refreshing series information'
+        # when the refresh started, and the TVDB ids of the series which still need
+        # to be refreshed when it is tried again
+        self.start = None
+        self.pending = None
+
+    def key(self):
+        return (self.__class__.__name__,)
+
+    def updatePeriod(self, elapsed):
+        """Return the name of the shortest TVDB updates list covering the given number
+        of seconds, or None if there is none."""
+        for days, period in self.periods:
+            # leave some margin, the lists are only regenerated every now and then
+            if elapsed < days * 24 * 3600 - 3600:
+                return period
+        return None
+
+    def perform(self):
+        if self.pending is not None:
+            updated = self.pending
+            log.info('Trying again to refresh %d series' % len(updated))
+        else:
+            self.start = time.time()
+            lastRefresh = self.database.config.get('lastMetadataRefresh')
+            period = self.updatePeriod(self.start - lastRefresh) if lastRefresh else None
+
+            if period is not None:
+                updated = self.mdprovider.getUpdatedSeries(period)
+                log.info('%d series updated on TVDB during the last %s' % (len(updated), period))
+            else:
+                updated = None
+                log.info('Last metadata refresh is too old, refreshing all series')
+
+        count = 0
+        failed = set()
+        for series in self.database.find_all(Series):
+            self.token.check()
+
+            tvdbId = series.get('tvdbId')
+            if tvdbId is None:
+                # imported before we kept track of the TVDB ids, look it up once
+                if series.title == 'Unknown':
+                    continue
+                try:
+                    tvdbId = int(self.mdprovider.findSeriesId(series.title))
+                except SmewtException, e:
+                    log.warning('Could not find TVDB id for series %s: %s' % (series.title, e))
+                    continue
+
+            elif updated is not None and tvdbId not in updated:
+                continue
+
+            try:
+                result = self.mdprovider.refreshEpisodes(tvdbId)
+            except Exception, e:
+                log.warning('Could not refresh series %s: %s' % (series.title, e))
+                failed.add(tvdbId)
+                continue
+
+            with commitLock:
+                self.token.check()
+                series.tvdbId = tvdbId
+                count += self.patchEpisodes(series, result)
+
+        log.info('Metadata refresh done, %d episodes updated' % count)
+
+        if failed:
+            self.pending = failed
+            raise TaskRetry('Could not refresh %d series' % len(failed))
+
+        with commitLock:
+            self.database.config.lastMetadataRefresh = self.start
+
+    def patchEpisodes(self, series, result):
+        """Update the episodes of the given series with the ones in the result graph,
+        and return how many of them changed."""
+        episodes = dict(((ep.get('season'), ep.get('episodeNumber')), ep)
+                        for ep in tolist(series.get('episodes')))
+
+        count = 0
+        for found in result.find_all(Episode):
+            try:
+                ep = episodes.get((int(found.season), int(found.episodeNumber)))
+            except (TypeError, ValueError):
+                continue
+            if ep is None:
+                continue
+
+            changed = False
+            for prop in self.patchedProperties:
+                value = found.get(prop)
+                if value is not None and ep.get(prop) != value:
+                    ep.set(prop, value)
+                    changed = True
+            count += changed
+
+        return count
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from smewt.base.textutils import normalizeTitle
+from threading import Lock
+import json
+import sys
+import re
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+"""The series index maps the series names guessed from the filenames to the TVDB ids
+of the series we already know, so that they can be found without searching for them
+on thetvdb.com.
+
+Names are first looked up exactly, after normalization, among the titles of the
+series and the aliases learned from the previous successful lookups. Otherwise, the
+series sharing a word with the name are compared using their character trigrams, as
+long as they don't differ by a year or a country, which tell apart the different
+versions of a series (remakes, regional versions, ...).
+"""
+
+# words of the series names that can tell apart two versions of a series
+_YEAR = re.compile(r'^(19|20)\d\d$')
+_COUNTRIES = set([ 'us', 'usa', 'uk', 'gb', 'au', 'nz', 'ca', 'ie', 'fr', 'de', 'nl', 'be', 'dk',
+                   'se', 'no', 'fi', 'es', 'it', 'pt', 'br', 'mx', 'ar', 'jp', 'kr', 'cn', 'in', 'ru' ])
+
+def qualifiers(name):
+    """Return the set of words of a normalized name that are years or countries."""
+    return set(w for w in name.split() if _YEAR.match(w) or w in _COUNTRIES)
+
+def trigrams(name):
+    """Return the set of character trigrams of a normalized name."""
+    padded = '  %s ' % name
+    return set(padded[i:i+3] for i in range(len(padded) - 2))
+
+def similarity(grams1, grams2):
+    """Dice coefficient of two sets of trigrams, between 0 and 1."""
+    if not grams1 or not grams2:
+        return 0.0
+    return 2.0 * len(grams1 & grams2) / (len(grams1) + len(grams2))
+
+
+class SeriesIndex(object):
+
+    # minimum similarity for a name to match a series that isn't known under it
+    threshold = 0.85
+
+    # and by how much the best series needs to be more similar than the next one
+    margin = 0.1
+
+    def __init__(self):
+        self.lock = Lock()
+        # TVDB id -> title
+        self.titles = {}
+        # normalized name -> TVDB id, for the titles and the aliases
+        self.names = {}
+        # word -> set of normalized names, and normalized name -> trigrams
+        self.words = {}
+        self.grams = {}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def clear(self):
+        with self.lock:
+            self.titles.clear()
+            self.names.clear()
+            self.words.clear()
+            self.grams.clear()
+
+    def _addName(self, name, tvdbId):
+        if not name or self.names.get(name) == tvdbId:
+            return
+        self.names[name] = tvdbId
+        self.grams[name] = trigrams(name)
+        for word in name.split():
+            self.words.setdefault(word, set()).add(name)
+
+    def add(self, tvdbId, title):
+        """Add the series with the given TVDB id and title to the index."""
+        with self.lock:
+            self.titles[int(tvdbId)] = title
+            self._addName(normalizeTitle(title), int(tvdbId))
+
+    def addAlias(self, name, tvdbId):
+        """Remember that the given name refers to the series with the given TVDB id."""
+        with self.lock:
+            self._addName(normalizeTitle(name), int(tvdbId))
+
+    def find(self, name):
+        """Return the TVDB id of the series that the given name refers to, or None if
+        we don't know it (well enough)."""
+        name = normalizeTitle(name)
+        with self.lock:
+            tvdbId = self.names.get(name)
+            if tvdbId is not None:
+                return tvdbId
+
+            # best similarity for each series sharing at least a word with the name,
+            # a different year or country meaning that it is another version of it
+            grams = trigrams(name)
+            quals = qualifiers(name)
+            scores = {}
+            for word in name.split():
+                for candidate in self.words.get(word, ()):
+                    if qualifiers(candidate) != quals:
+                        continue
+                    candidateId = self.names[candidate]
+                    score = similarity(grams, self.grams[candidate])
+                    if score > scores.get(candidateId, 0.0):
+                        scores[candidateId] = score
+
+        if not scores:
+            return None
+
+        ranked = sorted(scores.items(), key = lambda x: -x[1])
+        bestId, best = ranked[0]
+        if best < self.threshold:
+            return None
+        if len(ranked) > 1 and best - ranked[1][1] < self.margin:
+            # too ambiguous, better ask thetvdb.com
+            return None
+
+        log.debug('Series index: %s matches %s (%.2f)' % (name, self.titles.get(bestId), best))
+        return bestId
+
+    def save(self, filename):
+        with self.lock:
+            data = { 'titles': self.titles.items(),
+                     'aliases': [ (name, tvdbId) for name, tvdbId in self.names.items()
+                                  if normalizeTitle(self.titles.get(tvdbId, '')) != name ] }
+        tmpfile = filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(data, f)
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpfile, filename)
+
+    def load(self, filename):
+        data = json.load(open(filename))
+        for tvdbId, title in data['titles']:
+            self.add(tvdbId, title)
+        for name, tvdbId in data['aliases']:
+            self.addAlias(name, tvdbId)
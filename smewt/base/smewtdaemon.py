@@ -21,10 +21,19 @@
 from pygoo import MemoryObjectGraph, Equal, ontology
 from guessit.slogging import setupLogging
 from smewt import config
-from smewt.ontology import Episode, Movie, Subtitle, Media, Config
-from smewt.base import cache, utils, Collection
+from smewt.ontology import Episode, Movie, Series, Subtitle, Media, Config
+from smewt.base import cache, utils, pipelinestats, httpclient, posters, SmewtException, Collection, ImportTask, EnrichTask, RemoveTask
 from smewt.base.taskmanager import TaskManager, FuncTask
+from smewt.base.taskjournal import TaskJournal
+from smewt.base.importtask import commitLock
+from smewt.base.collection import UpdateTask
+from smewt.base.subtitletask import SubtitleTask
+from smewt.base.refreshtask import MetadataRefreshTask
+from smewt.base.seriesindex import SeriesIndex
+from smewt.base.collectionwatcher import CollectionWatcher
 from smewt.taggers import EpisodeTagger, MovieTagger
+from smewt.guessers import guessitpool
+from smewt.guessers.tvdbmetadataprovider import TVDBMetadataProvider
 from smewt.plugins.feedwatcher import FeedWatcher
 from threading import Timer
 import smewt
@@ -92,11 +101,35 @@ class SmewtDaemon(object):
         if smewt.config.PERSISTENT_CACHE:
             self.loadCache()
 
-        # get a TaskManager for all the import tasks
-        self.taskManager = TaskManager()
+        pipelinestats.stats.setSlowestTraces(config.PIPELINE_SLOWEST_TRACES)
+        httpclient.setClient(httpclient.HttpClient(timeout = config.HTTP_TIMEOUT,
+                                                   retries = config.HTTP_RETRIES))
+        if config.HTTP_CACHE:
+            httpclient.setCacheDir(utils.path(smewt.dirs.user_cache_dir, 'http'))
+
+        # start the processes for guessing filenames now, as forking once we have
+        # started threads is not safe
+        if config.GUESSIT_PROCESSES != 0:
+            guessitpool.setPool(guessitpool.GuessitPool(config.GUESSIT_PROCESSES))
 
         # get our main graph DB
         self.loadDB()
+        self.loadSeriesIndex()
+
+        # posters are downloaded in the background, and the objects in the DB that
+        # show them are updated once they are ready
+        store = posters.PosterStore(utils.path(smewt.dirs.user_data_dir, 'posters'), '/user/posters')
+        posters.setPipeline(posters.PosterPipeline(store, downloads = config.POSTER_DOWNLOADS))
+        posters.pipeline().addListener(self.posterReady)
+        posters.setResizedCache(posters.ResizedPosterCache(store,
+                                                           utils.path(smewt.dirs.user_cache_dir, 'posters'),
+                                                           config.RESIZED_POSTERS_CACHE_SIZE))
+        self.requestMissingPosters()
+
+        # get a TaskManager for all the import tasks, which keeps track of them in a journal
+        # so that we can resume them if we are stopped before they are all done
+        self.taskJournal = TaskJournal(self._journalFilename())
+        self.taskManager = TaskManager(journal = self.taskJournal)
 
         # get our collections: series and movies for now
         self.episodeCollection = Collection(name = 'Series',
@@ -131,21 +164,40 @@ class SmewtDaemon(object):
             mldonkey.send_command('vm')
 
 
-        # do not rescan as it would be too long and we might delete some files that
-        # are on an unaccessible network share or an external HDD
-        self.taskManager.add(FuncTask('Update collections', self.updateCollections))
+        # finish first what we were doing when we were interrupted, and look for the
+        # files that changed while we were stopped
+        self.resumeTasks()
+
+        # pick up the changes in the collection folders as they happen
+        self.collectionWatcher = None
+        if config.WATCH_COLLECTIONS:
+            self.collectionWatcher = CollectionWatcher([ self.episodeCollection, self.movieCollection ],
+                                                       debounce = config.WATCH_DEBOUNCE,
+                                                       scanInterval = config.COLLECTION_SCAN_INTERVAL)
+
+        # keep the series information up-to-date with the changes on thetvdb.com
+        self._refreshTimer = None
+        if config.METADATA_REFRESH_INTERVAL:
+            self.scheduleMetadataRefresh()
 
 
 
     def quit(self):
         log.info('SmewtDaemon quitting...')
-        self.taskManager.finishNow()
+        self.taskManager.finishNow(timeout = config.SHUTDOWN_TIMEOUT)
+        guessitpool.closePool()
+        posters.pipeline().quit()
+        if self._refreshTimer is not None:
+            self._refreshTimer.cancel()
+        if self.collectionWatcher is not None:
+            self.collectionWatcher.quit()
         try:
             self.feedWatcher.quit()
         except AttributeError:
             pass
 
         self.saveDB()
+        self.taskJournal.close()
 
         if smewt.config.PERSISTENT_CACHE:
             self.saveCache()
@@ -153,6 +205,32 @@ class SmewtDaemon(object):
         log.info('SmewtDaemon quitting OK!')
 
 
+    def refreshMetadata(self):
+        self.taskManager.add(MetadataRefreshTask(self.database, TVDBMetadataProvider.instance()))
+
+    def scheduleMetadataRefresh(self):
+        self.refreshMetadata()
+        t = Timer(config.METADATA_REFRESH_INTERVAL, self.scheduleMetadataRefresh)
+        t.daemon = True
+        self._refreshTimer = t
+        t.start()
+
+
+    def requestMissingPosters(self):
+        """Ask again for the posters that were not ready when we last quit."""
+        for cls in (Series, Movie):
+            for md in self.database.find_all(cls):
+                url = md.get('posterUrl')
+                if url and posters.pipeline().request(url) is None:
+                    posters.applyPoster(md)
+
+    def posterReady(self, url):
+        with commitLock:
+            for cls in (Series, Movie):
+                for md in self.database.find_all(cls, posterUrl = url):
+                    posters.applyPoster(md)
+
+
     def _cacheFilename(self):
         return utils.path(smewt.dirs.user_cache_dir, 'Smewt.cache',
                           createdir=True)
@@ -165,6 +243,13 @@ class SmewtDaemon(object):
 
     def clearCache(self):
         cache.clear()
+        httpclient.clearCache()
+        posters.resizedCache().clear()
+        self.resetSeriesIndex()
+        # the mirror is kept for when we are offline, but everything in it is fetched again
+        mirror = TVDBMetadataProvider.instance().mirror
+        if mirror is not None:
+            mirror.expire()
         cacheFile = self._cacheFilename()
         log.info('Deleting cache file: %s' % cacheFile)
         try:
@@ -173,6 +258,28 @@ class SmewtDaemon(object):
             pass
 
 
+    def importMetadataDump(self, filename):
+        mirror = TVDBMetadataProvider.instance().mirror
+        if mirror is None:
+            raise SmewtException('The metadata mirror is disabled')
+        result = mirror.importDump(filename)
+        # the lookups that failed before might succeed with the new information
+        self.purgeNegativeCache()
+        return result
+
+    def exportMetadataDump(self, filename):
+        mirror = TVDBMetadataProvider.instance().mirror
+        if mirror is None:
+            raise SmewtException('The metadata mirror is disabled')
+        mirror.exportDump(filename)
+
+    def purgeNegativeCache(self):
+        count = cache.purgeNegative()
+        if smewt.config.PERSISTENT_CACHE:
+            self.saveCache()
+        return count
+
+
     def loadDB(self):
         dbfile = smewt.settings.get('database_file')
         if not dbfile:
@@ -190,12 +297,148 @@ class SmewtDaemon(object):
     def saveDB(self):
         dbfile = smewt.settings.get('database_file')
         log.info('Saving database to %s', dbfile)
-        self.database.save(dbfile)
+        # no task can commit its results between the save and the checkpoint, otherwise
+        # it would be recorded as completed without its results being saved
+        with commitLock:
+            self.database.save(dbfile)
+            # results of the completed tasks are now safely on disk
+            self.taskJournal.checkpoint()
+        self.saveSeriesIndex()
 
     def clearDB(self):
         log.info('Clearing database...')
-        self.database.clear_keep_config()
-        self.database.save(smewt.settings.get('database_file'))
+        with commitLock:
+            self.database.clear_keep_config()
+            self.database.save(smewt.settings.get('database_file'))
+            self.taskJournal.clear()
+        self.resetSeriesIndex()
+
+
+    def _seriesIndexFilename(self):
+        # keep the index next to the database, it is built from the same series
+        dbfile = smewt.settings.get('database_file')
+        return os.path.splitext(dbfile)[0] + '.series_index'
+
+    def loadSeriesIndex(self):
+        """Load the index of the known series names and give it to the metadata
+        provider, so that it can find them without searching for them online."""
+        self.seriesIndex = SeriesIndex()
+        try:
+            self.seriesIndex.load(self._seriesIndexFilename())
+        except IOError:
+            pass
+        except (ValueError, KeyError), e:
+            log.warning('Could not load series index: %s' % e)
+
+        # the series in the database are always in it, whatever happened to the file
+        self._indexDatabaseSeries()
+
+        log.info('Series index contains %d series', len(self.seriesIndex))
+        TVDBMetadataProvider.instance().seriesIndex = self.seriesIndex
+
+    def _indexDatabaseSeries(self):
+        for series in self.database.find_all(Series):
+            if series.get('tvdbId') is not None:
+                self.seriesIndex.add(series.tvdbId, series.title)
+
+    def resetSeriesIndex(self):
+        """Forget the names learned from the online lookups, which might have been
+        wrong, and only keep the series of the database in the index."""
+        self.seriesIndex.clear()
+        self._indexDatabaseSeries()
+        self.saveSeriesIndex()
+
+    def saveSeriesIndex(self):
+        try:
+            self.seriesIndex.save(self._seriesIndexFilename())
+        except IOError, e:
+            log.warning('Could not save series index: %s' % e)
+
+    def _journalFilename(self):
+        # keep the journal next to the database, as they need to stay in sync
+        dbfile = smewt.settings.get('database_file')
+        return os.path.splitext(dbfile)[0] + '.journal'
+
+    def taskFromJournal(self, entry):
+        """Recreate a task from its entry in the task journal, or return None if this
+        is not possible anymore."""
+        if entry['type'] in ('import', 'enrich'):
+            if not os.path.exists(entry['filename']):
+                return None
+            for collection in (self.episodeCollection, self.movieCollection):
+                if collection.mediaTagger.__name__ == entry['tagger']:
+                    if entry['type'] == 'enrich':
+                        task = EnrichTask(self.database, collection.mediaTagger, entry['filename'])
+                    else:
+                        task = ImportTask(self.database, collection.mediaTagger, entry['filename'],
+                                          online = entry.get('online', True))
+                    task.priority = entry['priority']
+                    return task
+
+        elif entry['type'] == 'remove':
+            files = [ f for f in entry['files'] if not os.path.exists(f) ]
+            if files:
+                task = RemoveTask(self.database, files)
+                task.priority = entry['priority']
+                return task
+
+        elif entry['type'] == 'update':
+            collections = [ c for c in (self.episodeCollection, self.movieCollection)
+                            if c.name in entry['collections'] ]
+            if collections:
+                task = UpdateTask(collections)
+                task.priority = entry['priority']
+                return task
+
+        elif entry['type'] == 'subtitle':
+            metadata = []
+            for filename in entry['files']:
+                media = self.database.find_all(Media, filename = filename)
+                if media and media[0].get('metadata'):
+                    metadata.append(media[0].metadata)
+            if metadata:
+                task = SubtitleTask(metadata, entry['language'],
+                                    force = entry['force'], services = entry['services'])
+                task.priority = entry['priority']
+                return task
+
+        return None
+
+    def resumeTasks(self):
+        """Queue again all the tasks that didn't complete last time we ran, and return
+        how many of them there were.
+
+        The collections are updated too, unless their last update completed before we
+        were stopped: all the files it found are then among the resumed tasks."""
+        pending = self.taskJournal.pendingEntries()
+        count = 0
+        for key, entry in pending:
+            try:
+                task = self.taskFromJournal(entry)
+            except Exception as e:
+                log.warning('Could not resume task from journal: %s -- %s' % (entry, e))
+                task = None
+
+            if task is None:
+                # nothing left to do for this one, forget about it
+                self.taskJournal.taskDone(key)
+                continue
+
+            self.taskManager.add(task)
+            count += 1
+
+        if count:
+            log.info('Resumed %d unfinished tasks from journal' % count)
+
+        if not any(entry['type'] == 'update' for key, entry in pending):
+            if count:
+                log.info('Last collection update completed, not updating them again')
+            else:
+                # do not rescan as it would be too long and we might delete some files that
+                # are on an unaccessible network share or an external HDD
+                self.taskManager.add(UpdateTask([ self.episodeCollection, self.movieCollection ]))
+
+        return count
 
 
     def updateCollections(self):
@@ -206,6 +449,10 @@ class SmewtDaemon(object):
         self.episodeCollection.rescan()
         self.movieCollection.rescan()
 
+    def collectionFoldersChanged(self):
+        if self.collectionWatcher is not None:
+            self.collectionWatcher.reload()
+
 
     def _regenerateSpeedDialThumbnails(self):
         import shlex, subprocess
@@ -19,6 +19,7 @@
 #
 
 from smewtexception import SmewtException
+from pipelinestats import timed
 import logging
 
 log = logging.getLogger(__name__)
@@ -35,5 +36,6 @@ class SolvingChain(object):
         result = query
         for action in self.chain:
             log.debug("SolvingChain: performing action %s" % action.__class__.__name__)
-            result = action.perform(result)
+            with timed(action.__class__.__name__):
+                result = action.perform(result)
         return result
@@ -20,6 +20,7 @@
 #
 
 from smewt.base import Task, SmewtException
+from smewt.base.importtask import commitLock
 from smewt.base.utils import tolist, path
 from smewt.ontology import Movie, Episode, Metadata
 from guessit import Language
@@ -51,6 +52,8 @@ class SubtitleTask(Task):
     metadata is the list of objects for which to download the subtitle (Movie or Episode).
     """
 
+    timeout = 300
+
     def __init__(self, metadata, language, force=False, services=None):
         super(SubtitleTask, self).__init__()
         if isinstance(metadata, Metadata):
@@ -64,6 +67,27 @@ class SubtitleTask(Task):
         log.info('Creating SubtitleTask (%s) for %s' % (language, list(metadata)[0].get('title', '?')))
 
 
+    def videoFilenames(self):
+        """Return the filenames of the videos for which we want to download subtitles."""
+        result = []
+        for obj in self.metadata:
+            files = tolist(obj.get('files', []))
+            if files:
+                result.append(files[0].filename)
+        return sorted(result)
+
+    def key(self):
+        return (self.__class__.__name__, tuple(self.videoFilenames()), self.language.alpha2)
+
+    def journalEntry(self):
+        return { 'type': 'subtitle',
+                 'files': self.videoFilenames(),
+                 'language': self.language.alpha2,
+                 'force': self.force,
+                 'services': self.services,
+                 'priority': self.priority }
+
+
     def downloadSubtitles(self, requested):
         # list all available subtitles
         lang = self.language.alpha2
@@ -122,6 +146,7 @@ class SubtitleTask(Task):
 
         # download subtitles
         self.downloadSubtitles(requested)
+        self.token.check()
 
         # validate the subtitles
         for videoFilename, subFilename in requested.items():
@@ -143,8 +168,10 @@ class SubtitleTask(Task):
                 filenames = [ f.filename for f in tolist(obj.get('files', [])) ]
                 if videoFilename in filenames:
                     # FIXME: the following 2 lines should happen in a transaction
-                    sub = db.Subtitle(metadata = obj, language = self.language.alpha2)
-                    subfile = db.Media(filename = subFilename, metadata = sub)
+                    with commitLock:
+                        self.token.commit()
+                        sub = db.Subtitle(metadata = obj, language = self.language.alpha2)
+                        subfile = db.Media(filename = subFilename, metadata = sub)
                     break
             else:
                 log.error('Internal error: downloaded subfile for non-requested metadata')
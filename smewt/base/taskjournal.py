@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from collections import OrderedDict
+from threading import Lock
+import json
+import sys
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def _hashable(value):
+    """Convert the lists coming out of JSON back into tuples, so they can be used as keys."""
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+class TaskJournal(object):
+    """A TaskJournal keeps an on-disk record of the tasks that have been queued and
+    not completed yet, so that they can be queued again after a restart.
+
+    The file is append-only: each line is a JSON object recording that a task has been
+    added, that it has been completed, or a checkpoint. As the results of a completed
+    task only become persistent once the database has been saved, completions are only
+    taken into account when followed by a checkpoint, which should be written right
+    after saving the database. Completions that happened after the last checkpoint are
+    forgotten on load, and their tasks will be performed again.
+
+    The file is compacted when loading it, at each checkpoint, and when it has grown to
+    twice its size after the previous compaction."""
+
+    # minimum number of lines in the journal before we consider compacting it
+    compactionThreshold = 1000
+
+    def __init__(self, filename):
+        super(TaskJournal, self).__init__()
+        self.filename = filename
+        self.lock = Lock()
+
+        self.tasks = OrderedDict() # task key -> journal entry for the tasks not durably completed
+        self.completed = set()     # keys of the tasks completed since the last checkpoint
+        self.nlines = 0            # number of lines currently in the journal file
+        self.compactedLines = 0    # number of lines in the journal file right after its last compaction
+        self.journal = None
+
+        with self.lock:
+            self._load()
+            self._compact()
+
+
+    def _load(self):
+        log.info('TaskJournal: loading journal from %s' % self.filename)
+        try:
+            lines = open(self.filename).readlines()
+        except IOError:
+            log.debug('TaskJournal: journal file doesn\'t exist')
+            return
+
+        for n, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+                op, key = record['op'], _hashable(record.get('key'))
+            except (ValueError, KeyError, TypeError):
+                # most likely the last line was only partially written
+                log.warning('TaskJournal: ignoring invalid line %d in %s' % (n+1, self.filename))
+                continue
+
+            if op == 'add':
+                self.tasks[key] = record['task']
+                self.completed.discard(key)
+            elif op == 'done':
+                self.completed.add(key)
+            elif op == 'checkpoint':
+                self._applyCompleted()
+
+        # the results of the tasks completed after the last checkpoint have been lost,
+        # they need to be performed again
+        self.completed.clear()
+        log.info('TaskJournal: %d pending tasks in journal' % len(self.tasks))
+
+
+    def _applyCompleted(self):
+        for key in self.completed:
+            self.tasks.pop(key, None)
+        self.completed.clear()
+
+
+    def _write(self, record):
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        self.nlines += 1
+
+
+    def _compact(self):
+        # write the compacted journal to a temporary file which then replaces the current
+        # one, so that we always have a valid journal on disk
+        if self.journal is not None:
+            self.journal.close()
+
+        tmpfile = self.filename + '.tmp'
+        self.journal = open(tmpfile, 'w')
+        self.nlines = 0
+        for key, entry in self.tasks.items():
+            self._write({ 'op': 'add', 'key': key, 'task': entry })
+        self._write({ 'op': 'checkpoint' })
+        for key in self.completed:
+            self._write({ 'op': 'done', 'key': key })
+        self.journal.close()
+        self.compactedLines = self.nlines
+
+        if sys.platform == 'win32' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmpfile, self.filename)
+        self.journal = open(self.filename, 'a')
+
+
+    def _maybeCompact(self):
+        if self.nlines > max(self.compactionThreshold, 2 * self.compactedLines):
+            self._compact()
+
+
+    def taskAdded(self, key, entry):
+        """Record that the task identified by key has been queued. entry should be a
+        JSON-serializable dict containing all that is needed to recreate the task."""
+        with self.lock:
+            self.tasks[key] = entry
+            self.completed.discard(key)
+            self._write({ 'op': 'add', 'key': key, 'task': entry })
+            self._maybeCompact()
+
+    def taskDone(self, key):
+        """Record that the task identified by key has been completed."""
+        with self.lock:
+            if key not in self.tasks:
+                return
+            self.completed.add(key)
+            self._write({ 'op': 'done', 'key': key })
+            self._maybeCompact()
+
+    def checkpoint(self):
+        """Mark all the tasks completed until now as durably completed. This should be
+        called right after the results of the tasks have been saved."""
+        with self.lock:
+            self._applyCompleted()
+            self._compact()
+
+    def pendingEntries(self):
+        """Return the list of (key, entry) for all the tasks which haven't been completed."""
+        with self.lock:
+            return [ (key, entry) for key, entry in self.tasks.items()
+                     if key not in self.completed ]
+
+    def clear(self):
+        with self.lock:
+            self.tasks.clear()
+            self.completed.clear()
+            self._compact()
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
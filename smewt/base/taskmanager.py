@@ -20,16 +20,131 @@
 #
 
 from __future__ import with_statement
-from Queue import PriorityQueue
-from threading import Thread, Lock, current_thread
+from Queue import PriorityQueue, Empty
+from threading import Thread, Lock, Condition, Event, current_thread
+from smewt.base.smewtexception import SmewtException
+import itertools
+import heapq
 import time
 import logging
 
 log = logging.getLogger(__name__)
 
+# number of worker threads used by default by a TaskManager
+DEFAULT_WORKERS = 8
+
+
+class TaskCancelled(SmewtException):
+    pass
+
+
+class TaskRetry(SmewtException):
+    """Raised by a task that couldn't do its work for now, for instance because a web
+    site can't be reached, and should be tried again later.
+
+    If the task is a batch, tasks can be the list of the tasks in it that need to be
+    tried again, the other ones being considered as completed. By default, all of them
+    are tried again."""
+
+    def __init__(self, msg = '', tasks = None):
+        super(TaskRetry, self).__init__(msg)
+        self.tasks = tasks
+
+
+class CancellationToken(object):
+    """A CancellationToken is handed to each task so that it can be told to stop.
+
+    Stopping is cooperative: tasks should call check() between their steps, and call
+    commit() right before applying their results, so that a task is either cancelled
+    before it touched anything or is allowed to finish applying its results."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._event = Event()
+        self._committed = False
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason = 'cancelled'):
+        """Ask the task to stop. Return False if it is too late because the task is
+        already committing its results."""
+        with self._lock:
+            if self._committed:
+                return False
+            if not self._event.is_set():
+                self.reason = reason
+                self._event.set()
+            return True
+
+    def check(self):
+        """Raise TaskCancelled if the task has been cancelled."""
+        if self._event.is_set():
+            raise TaskCancelled('Task %s' % self.reason)
+
+    def commit(self):
+        """Check that the task hasn't been cancelled, and make sure it can't be anymore,
+        as it is about to apply its results."""
+        with self._lock:
+            self.check()
+            self._committed = True
+
+    def wait(self, timeout = None):
+        """Sleep at most timeout seconds, waking up early if the task gets cancelled.
+        Return whether the task has been cancelled."""
+        return self._event.wait(timeout)
+
+
 class Task(object):
+    # maximum number of tasks of this class that can be performed at the same time.
+    # Tasks that mostly wait on the network can raise it, tasks that need exclusive
+    # access to some resource should leave it at 1
+    concurrency = 1
+
+    # maximum duration in seconds allowed for performing a task of this class, after
+    # which it will be cancelled and given up on. None means no limit
+    timeout = None
+
+    # maximum number of tasks of this class that can be grouped and performed together
+    # (see batchKey() and batch())
+    batchSize = 1
+
+    # number of seconds to wait before queuing again a task of this class that raised
+    # TaskRetry, one for each attempt. Once they are exhausted, the task is left in the
+    # journal to be tried again after a restart
+    retryDelays = ()
+
     def __init__(self, priority = 5):
         self.priority = priority
+        self.token = CancellationToken()
+        self.attempts = 0
+
+    def key(self):
+        """Return a hashable value identifying the work done by this task, or None.
+
+        Two tasks with the same key waiting in the TaskManager's queue are redundant,
+        and only one of them will be performed."""
+        return None
+
+    def batchKey(self):
+        """Return a value identifying which tasks can be performed together with this one
+        in a batch, or None if it can't be batched."""
+        return None
+
+    @classmethod
+    def batch(cls, tasks):
+        """Return a task that performs all the given tasks at once, which all have the
+        same batch key. Its token should be the one of the first task."""
+        raise NotImplementedError
+
+    def journalEntry(self):
+        """Return a JSON-serializable dict containing what is needed to recreate this task
+        after a restart, or None if this task shouldn't be recorded in the task journal.
+
+        Only tasks that also have a key can be recorded."""
+        return None
 
     def perform(self):
         """All tasks should implement this function, which should perform the actual task.
@@ -61,22 +176,56 @@ def worker(taskManager):
             log.info('Worker thread stopped working because TaskManager should finish now')
             return
 
-        try:
-            taskId = taskManager.taskId
-            (_, _), task = taskManager.queue.get()
-            taskManager.taskId + 1
+        item = taskManager.queue.get()
+        (_, taskId), task = item
 
-            # TODO: need to have timeout on the tasks, eg: 5 seconds
-            # TODO: need to be able to stop task immediately
-            taskManager.taskDesc = task.description
+        if taskManager.shouldFinish:
+            # we got woken up with a task while the TaskManager was finishing, leave it in the queue
+            taskManager.queue.put(item)
+            taskManager.queue.task_done()
+            log.info('Worker thread stopped working because TaskManager should finish now')
+            return
+
+        if not taskManager.startTask(item):
+            # either all the slots for this type of task are taken and it has been put aside
+            # until one of them is freed, or the task has been superseded by a duplicate one
+            continue
+
+        # if there are other similar tasks waiting, perform them all at once
+        task = taskManager.gatherBatch(item)
+
+        completed = True
+        retry = ()
+        try:
+            task.token.check()
             task.perform()
 
+        except TaskCancelled as e:
+            log.info('TaskManager: %s: %s' % (task.description, e))
+            completed = False
+
+        except TaskRetry as e:
+            log.info('TaskManager: %s: will try again later: %s' % (task.description, e))
+            retry = e.tasks if e.tasks is not None else taskManager.performedTasks(taskId)
+
         except Exception:
             import sys, traceback
             log.warning('TaskManager: task failed with error: %s' % ''.join(traceback.format_exception(*sys.exc_info())))
 
         finally:
-            taskManager.taskDone(taskId)
+            if not taskManager.taskDone(taskId, completed, retry):
+                # the task took too long and has been given up on, another worker
+                # has already been started to replace us
+                log.debug('Worker thread 0x%x exiting after its task was abandoned' % current_thread().ident)
+                return
+
+
+def watchdog(taskManager):
+    """Periodically cancel the tasks that have been running for longer than they are allowed to,
+    and queue again the tasks that are due to be retried, until the TaskManager finishes."""
+    while not taskManager.watchdogStopped.wait(taskManager.watchdogInterval):
+        taskManager.cancelExpiredTasks()
+        taskManager.addDelayedTasks()
 
 
 class TaskManager(object):
@@ -85,64 +234,392 @@ class TaskManager(object):
 
     If two or more tasks have the same priority, it will take the one that was added first to the queue.
 
-    The TaskManager can be controlled asynchronously, as it runs the tasks in a separate thread."""
+    Tasks are performed by a pool of worker threads, so that more than one of them can run at
+    the same time. Each class of task limits how many of its instances can run concurrently
+    through its 'concurrency' attribute; a task that can't get a slot waits until one of
+    its siblings has finished, without blocking tasks of other classes.
 
-    def __init__(self):
+    Adding a task which has the same key as a task still waiting in the queue doesn't
+    queue it again: both are coalesced and the pending one gets the highest of their
+    priorities.
+
+    If a TaskJournal is given, the tasks which provide a journal entry are recorded in it
+    when they are added and when they complete, so that the tasks that didn't complete can
+    be queued again after a restart. Cancelled tasks are not marked as completed.
+
+    When a task with a batch key is started, the tasks with the same batch key directly
+    following it in the queue are taken out of it as well, and all are performed together
+    by a single task obtained from the batch() method of their class. They still count
+    as separate tasks for the progress counters and the journal. Batches are kept small
+    enough to leave some of the waiting tasks to the idle workers (see batchLimit()).
+
+    Tasks can be cancelled through their token. A task running for longer than its class'
+    'timeout' gets cancelled and abandoned: its worker thread is left to die on its own and
+    replaced by a fresh one, so that a task stuck on a network call can't hold up the others.
+
+    A task raising TaskRetry is not marked as completed in the journal, and is queued again
+    after the delays given by the 'retryDelays' of its class.
+
+    The TaskManager can be controlled asynchronously, as it runs the tasks in separate threads."""
+
+    # how often (in seconds) we check whether some tasks exceeded their allotted time
+    watchdogInterval = 1
+
+    def __init__(self, workers = DEFAULT_WORKERS, journal = None):
         super(TaskManager, self).__init__()
 
+        self.journal = journal
+
         # our main task queue
         self.queue = PriorityQueue()
 
         self.taskId = 0    # ID for the next task that will be generated
         self.total = 0     # used to keep track of the total jobs that have been submitted (queue size decreases as we process tasks)
         self.finished = [] # list of task IDs which have finished
-        self.taskDesc = '' # description of the task started last
+        self.running = {}  # task ID -> task, for all the tasks being performed right now
+        self.deadlines = {} # task ID -> time after which a running task should be cancelled
+        self.slots = {}    # task class -> number of tasks of this class being performed right now
+        self.waiting = {}  # task class -> heap of queue items waiting for a free slot
+        self.pending = {}  # task key -> queue item, for the tasks not started yet that have a key
+        self.batches = {}  # task ID -> (batch task, queue items of the other tasks in the batch)
+        self.delayed = []  # heap of (time, count, task) for the tasks waiting to be retried
+        self._delayedCount = itertools.count()
 
         self.lock = Lock()
+        # notified each time a task has been completed
+        self.taskFinished = Condition(self.lock)
 
         log.debug('Main GUI thread is: 0x%x' % current_thread().ident)
 
         self.shouldFinish = False
 
-        # ideally a pool of threads or sth like TBB or ThreadWeaver
-        self.workerThread = Thread(target = worker, args = (self,))
-        self.workerThread.daemon = True
-        self.workerThread.start()
+        self.workers = workers
+        self.workerThreads = []
+        for _ in range(workers):
+            self.startWorker()
+
+        self.watchdogStopped = Event()
+        self.watchdogThread = Thread(target = watchdog, args = (self,))
+        self.watchdogThread.daemon = True
+        self.watchdogThread.start()
+
+
+    def startWorker(self):
+        t = Thread(target = worker, args = (self,))
+        t.daemon = True
+        t.start()
+        # forget the workers that exited after their task was abandoned
+        self.workerThreads = [ w for w in self.workerThreads if w.is_alive() ]
+        self.workerThreads.append(t)
 
 
     def add(self, task):
-        log.info('TaskManager add task: %s' % task.description)
+        key = task.key()
         with self.lock:
+            queued = self.pending.get(key) if key is not None else None
+            if queued is not None:
+                (_, _), queuedTask = queued
+                if task.priority <= queuedTask.priority:
+                    log.debug('TaskManager: task already queued: %s' % task.description)
+                    return
+
+                # the new task replaces the queued one, which will be skipped when its turn comes
+                log.info('TaskManager raise priority of task: %s' % task.description)
+
+            else:
+                log.info('TaskManager add task: %s' % task.description)
+                self.total += 1
+
             # -task.priority because it always gets the lowest one first
-            # we need to put the time as well, because Queue uses heap sort which is not stable, so we
+            # we need to put the task ID as well, because Queue uses heap sort which is not stable, so we
             # had to find a way to make it look stable ;-)
-            self.queue.put(( (-task.priority, time.time()), task ))
-            self.total += 1
+            item = ( (-task.priority, self.taskId), task )
+            self.queue.put(item)
+            self.taskId += 1
+            if key is not None:
+                self.pending[key] = item
+
+                entry = task.journalEntry()
+                if self.journal is not None and entry is not None:
+                    self.journal.taskAdded(key, entry)
+
+
+    def startTask(self, item):
+        """Reserve a slot for the task contained in the given queue item and mark it as running.
+
+        Return False if the task shouldn't be performed now: either all the slots for this class
+        of task are already taken, in which case the item is kept aside until one of them is freed,
+        or it has been superseded by a duplicate task with a higher priority."""
+        (_, taskId), task = item
+        cls = type(task)
+        key = task.key()
+        with self.lock:
+            if key is not None and self.pending.get(key) is not item:
+                # a duplicate with a higher priority replaced it, it has already been accounted for
+                self.queue.task_done()
+                return False
+
+            if self.slots.get(cls, 0) >= task.concurrency:
+                heapq.heappush(self.waiting.setdefault(cls, []), item)
+                return False
+
+            if key is not None:
+                del self.pending[key]
+
+            self.slots[cls] = self.slots.get(cls, 0) + 1
+            self.running[taskId] = task
+            if task.timeout is not None:
+                self.deadlines[taskId] = time.time() + task.timeout
+            return True
+
+
+    def gatherBatch(self, item):
+        """Take the tasks that can be batched with the one in the given (started) queue item
+        out of the queue, and return the task that should be performed: either a batch of all
+        of them, or the task itself if there is nothing to batch it with."""
+        (_, taskId), task = item
+        batchKey = task.batchKey()
+        if batchKey is None or task.batchSize <= 1:
+            return task
+
+        members = []
+        with self.lock:
+            limit = self.batchLimit(task, self.queue.qsize())
+            while len(members) + 1 < limit:
+                try:
+                    other = self.queue.get_nowait()
+                except Empty:
+                    break
+
+                (_, _), otherTask = other
+                key = otherTask.key()
+                if key is not None and self.pending.get(key) is not other:
+                    # superseded by a duplicate task
+                    self.queue.task_done()
+                    continue
+
+                if otherTask.token.cancelled or otherTask.batchKey() != batchKey:
+                    # put it back where it was, it will be taken care of normally
+                    self.queue.put(other)
+                    self.queue.task_done()
+                    break
+
+                if key is not None:
+                    del self.pending[key]
+                members.append(other)
+
+            if not members:
+                return task
+
+            batch = type(task).batch([ task ] + [ t for _, t in members ])
+            self.batches[taskId] = (batch, members)
+            if task.timeout is not None:
+                self.deadlines[taskId] = time.time() + task.timeout * (len(members) + 1)
+
+        log.debug('TaskManager: performing %d tasks in a batch' % (len(members) + 1))
+        return batch
+
+
+    def batchLimit(self, task, queued):
+        """Return the maximum number of tasks in a batch started by the given task when
+        there are queued tasks waiting, so that the workers which are idle and allowed to
+        perform tasks of its class get their share of them. Should be called with the lock
+        held, once the task has been started."""
+        idle = self.workers - len(self.running)
+        freeSlots = task.concurrency - self.slots.get(type(task), 0)
+        takers = 1 + max(0, min(idle, freeSlots))
+        # this task and the queued ones shared among the takers, rounded up
+        return max(1, min(task.batchSize, (queued + takers) // takers))
+
+
+    def performedTasks(self, taskId):
+        """Return the tasks being performed by the worker that started the given task,
+        which are more than one if they have been batched."""
+        with self.lock:
+            if taskId not in self.running:
+                return []
+            _, members = self.batches.get(taskId, (None, []))
+            return [ self.running[taskId] ] + [ member for _, member in members ]
 
 
-    def taskDone(self, taskId):
+    def taskDone(self, taskId, completed = True, retry = ()):
+        """Mark the given task as finished, completed = False meaning that it has been
+        cancelled, and retry being the list of tasks (see performedTasks()) that need
+        to be tried again later. Return False if it had already been abandoned because
+        it took too long."""
         with self.lock:
-            self.finished.append(taskId)
+            if taskId not in self.running:
+                return False
+            self._releaseTask(taskId, completed, retry)
+            return True
+
+
+    def _releaseTask(self, taskId, completed, retry = ()):
+        # needs to be called with self.lock held
+        task = self.running.pop(taskId)
+        self.deadlines.pop(taskId, None)
+        cls = type(task)
+        self.slots[cls] -= 1
+        self.finished.append(taskId)
+
+        self._journalTaskDone(task, completed and task not in retry)
+
+        # the other tasks of the batch were performed at the same time
+        _, members = self.batches.pop(taskId, (None, []))
+        for (_, memberId), member in members:
+            self.finished.append(memberId)
+            self._journalTaskDone(member, completed and member not in retry)
+            self.queue.task_done()
 
-            log.info('Task %d/%d completed!' % (len(self.finished), self.total))
+        for t in retry:
+            self._retryLater(t)
 
-            # if we finished all the tasks, reset the current total
-            if self.queue.empty():
-                self.finished = []
-                self.total = 0
+        log.info('Task %d/%d completed!' % (len(self.finished), self.total))
 
+        # we just freed a slot, send back the first task waiting for it into the queue.
+        # It has been taken out of the queue already, so we need to mark it as done
+        # once it's back in so that the number of unfinished tasks stays correct
+        waiting = self.waiting.get(cls)
+        if waiting:
+            self.queue.put(heapq.heappop(waiting))
             self.queue.task_done()
 
-    def finishNow(self):
+        # if we finished all the tasks, reset the current total
+        if len(self.finished) == self.total:
+            self.finished = []
+            self.total = 0
+
+        self.queue.task_done()
+        self.taskFinished.notify_all()
+
+
+    def _journalTaskDone(self, task, completed):
+        # needs to be called with self.lock held
+        # if a duplicate of this task has been queued in the meantime, it still needs to be performed
+        key = task.key()
+        if completed and self.journal is not None and key is not None and key not in self.pending:
+            self.journal.taskDone(key)
+
+
+    def _retryLater(self, task):
+        # needs to be called with self.lock held
+        if task.attempts >= len(task.retryDelays):
+            log.warning('TaskManager: giving up on task after %d attempts: %s' % (task.attempts + 1, task.description))
+            return
+
+        delay = task.retryDelays[task.attempts]
+        task.attempts += 1
+        log.info('TaskManager: trying again in %d seconds: %s' % (delay, task.description))
+        heapq.heappush(self.delayed, (time.time() + delay, next(self._delayedCount), task))
+
+
+    def addDelayedTasks(self):
+        """Queue again the tasks waiting to be retried whose delay has passed."""
+        now = time.time()
+        due = []
+        with self.lock:
+            while self.delayed and self.delayed[0][0] <= now:
+                due.append(heapq.heappop(self.delayed)[2])
+
+        for task in due:
+            # its previous token might have been cancelled or committed
+            task.token = CancellationToken()
+            self.add(task)
+
+
+    def status(self):
+        """Return a tuple (number of finished tasks, total number of tasks, descriptions of the
+        tasks currently running)."""
+        with self.lock:
+            return (len(self.finished), self.total,
+                    [ self.batches.get(taskId, (task, None))[0].description
+                      for taskId, task in sorted(self.running.items()) ])
+
+
+    def cancelExpiredTasks(self):
+        """Cancel and abandon all the running tasks that went past their deadline."""
+        now = time.time()
+        with self.lock:
+            for taskId, deadline in self.deadlines.items():
+                if deadline < now:
+                    self._abandonTask(taskId, 'timed out')
+
+
+    def _abandonTask(self, taskId, reason):
+        # needs to be called with self.lock held
+        task = self.running[taskId]
+        if not task.token.cancel(reason):
+            # the task is already applying its results, let it finish
+            self.deadlines.pop(taskId, None)
+            return False
+
+        log.warning('TaskManager: giving up on task (%s): %s' % (reason, task.description))
+        self._releaseTask(taskId, completed = False)
+
+        # the thread performing this task might be stuck for a long time, start a new one
+        # so that we keep the same number of workers
+        if not self.shouldFinish:
+            self.startWorker()
+        return True
+
+
+    def _stopWatchdog(self):
+        self.watchdogStopped.set()
+        if current_thread() is not self.watchdogThread:
+            self.watchdogThread.join()
+
+
+    def finish(self):
+        """Wait until all the tasks in the queue have been performed, and then stop the
+        TaskManager. The tasks waiting to be retried are dropped, they are still in
+        the journal."""
+        self.queue.join()
+        self.finishNow()
+
+
+    def finishNow(self, timeout = None):
+        """Stop the TaskManager: no new task will be started, and we wait for the currently
+        running ones to finish. If timeout is given, wait at most that many seconds and then
+        cancel the tasks that are still running.
+
+        Tasks that are already applying their results can't be cancelled, and are always
+        waited for, so that the collection is never left half-updated.
+
+        Return the list of tasks that were running and got cancelled. Tasks that didn't
+        start yet are left in the queue."""
         log.info('TaskManager should finish ASAP, waiting for currently running tasks to finish')
         self.shouldFinish = True
+        self._stopWatchdog()
         with self.lock:
-            if self.total == 0:
-                # worker thread is already waiting on an empty queue, we can't wait for him
+            if not self.running:
+                # worker threads are already waiting on an empty queue, we can't wait for them
                 log.info('No currently running jobs')
-                return
-
-        # FIXME: need to stop worker, we can't always wait for it
-        self.workerThread.join()
-
-        log.info('TaskManager: last running task finished')
+                return []
+
+            end = time.time() + timeout if timeout is not None else None
+            while self.running:
+                if end is None:
+                    self.taskFinished.wait()
+                    continue
+
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+                self.taskFinished.wait(remaining)
+
+            cancelled = []
+            for taskId, task in sorted(self.running.items()):
+                if self._abandonTask(taskId, 'cancelled because TaskManager is finishing'):
+                    cancelled.append(task)
+
+            if self.running:
+                log.info('TaskManager: waiting for %d tasks to finish applying their results' % len(self.running))
+            while self.running:
+                self.taskFinished.wait()
+
+        if cancelled:
+            log.info('TaskManager: cancelled %d running tasks' % len(cancelled))
+        else:
+            log.info('TaskManager: last running task finished')
+
+        return cancelled
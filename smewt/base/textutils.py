@@ -35,10 +35,16 @@ def cleanString(s):
     parts = s.split()
     return ' '.join(p for p in parts if p != '')
 
+
 # regexps-related functions
 import re
 from smewtexception import SmewtException
 
+def normalizeTitle(s):
+    """Return a lowercase version of the given title without punctuation, so that
+    different spellings of the same title compare equal."""
+    return ' '.join(re.sub(r'[\W_]+', ' ', s.lower(), flags = re.UNICODE).split())
+
 def simpleMatch(string, regexp):
     try:
         return re.compile(regexp).search(string).groups()[0]
@@ -138,6 +144,7 @@ def u(o):
     return unicode(result)
 
 def levenshtein(a, b):
+    """Reference implementation of the edit distance, use editDistance instead."""
     if not a: return len(b)
     if not b: return len(a)
 
@@ -166,3 +173,79 @@ def levenshtein(a, b):
                           )
 
     return d[m][n]
+
+
+def editDistance(a, b, cutoff = None):
+    """Return the same edit distance as levenshtein, computed faster.
+
+    If cutoff is given, only the distances up to it are computed exactly: as soon as
+    the distance is known to be greater than it, cutoff + 1 is returned."""
+    if not a or not b:
+        d = len(a or b or '')
+        return d if cutoff is None or d <= cutoff else cutoff + 1
+
+    # the common prefix and suffix don't change the distance
+    m, n = len(a), len(b)
+    start = 0
+    while start < m and start < n and a[start] == b[start]:
+        start += 1
+    while m > start and n > start and a[m-1] == b[n-1]:
+        m -= 1
+        n -= 1
+    a, b = a[start:m], b[start:n]
+
+    # keep the rows as short as possible
+    if len(a) > len(b):
+        a, b = b, a
+    m, n = len(a), len(b)
+
+    # the distance is never more than the length of the longest string, and never
+    # less than the difference between their lengths
+    k = n if cutoff is None or cutoff > n else cutoff
+    big = k + 1
+    if n - m > k:
+        return big
+
+    # only the cells at most k away from the diagonal can lead to a distance <= k,
+    # the other ones are considered to be big (Ukkonen's band)
+    previous = [ i if i <= k else big for i in xrange(m+1) ]
+    for j in xrange(1, n+1):
+        bj = b[j-1]
+        lo, hi = max(1, j - k), min(m, j + k)
+        current = [big] * (m+1)
+        if j <= k:
+            current[0] = j
+        rowMin = left = current[lo-1]
+
+        for i in xrange(lo, hi+1):
+            d = previous[i-1] + (a[i-1] != bj) # substitution
+            up = previous[i]
+            if up < d:
+                d = up + 1                     # deletion
+            if left < d:
+                d = left + 1                   # insertion
+            if d > big:
+                d = big
+            current[i] = left = d
+            if d < rowMin:
+                rowMin = d
+
+        # the distance can only grow from here
+        if rowMin > k:
+            return big
+
+        previous = current
+
+    return previous[m]
+
+
+def editDistances(query, candidates, cutoff = None):
+    """Return the list of the edit distances between the query and each of the
+    candidates (see editDistance), only computing them once for duplicate candidates."""
+    distances = {}
+    result = []
+    for candidate in candidates:
+        if candidate not in distances:
+            distances[candidate] = editDistance(query, candidate, cutoff)
+        result.append(distances[candidate])
+    return result
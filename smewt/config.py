@@ -32,6 +32,49 @@ LOGGING_LEVELS = [ ('smewt.base.cache', logging.INFO),
 # Whether to use a cache that is saved/restored between sessions
 PERSISTENT_CACHE = True
 
+# number of seconds during which a series or movie that couldn't be found online
+# won't be looked up again
+NEGATIVE_CACHE_TTL = 3 * 24 * 3600
+
+# number of seconds after which the TMDB configuration (image urls, ...) is fetched again
+TMDB_CONFIG_TTL = 3 * 24 * 3600
+
+# timeout (in seconds) and number of retries for the requests to web sites
+HTTP_TIMEOUT = 20
+HTTP_RETRIES = 2
+
+# Whether to keep the responses from thetvdb.com and themoviedb.org on disk, and
+# revalidate them with conditional requests instead of downloading them again
+HTTP_CACHE = True
+
+# Whether to keep the series, episodes and movies that have been looked up in a local
+# SQLite mirror, consulted before going online (see smewt.guessers.metadatamirror)
+METADATA_MIRROR = True
+
+# number of seconds after which the information in the metadata mirror is fetched again.
+# It is still used when it can't be
+METADATA_MIRROR_TTL = 7 * 24 * 3600
+
+# number of posters downloaded at the same time, in the background
+POSTER_DOWNLOADS = 4
+
+# maximum size in bytes of the posters resized for the web pages that are kept on disk
+RESIZED_POSTERS_CACHE_SIZE = 50 * 1024 * 1024
+
+# number of seconds between two refreshes of the series information from the TVDB
+# updates lists, 0 to disable
+METADATA_REFRESH_INTERVAL = 24 * 3600
+
+# Whether to watch the collection folders for new and deleted files (with inotify,
+# on Linux), and the number of seconds to wait for things to settle down before
+# importing them
+WATCH_COLLECTIONS = True
+WATCH_DEBOUNCE = 2
+
+# number of seconds between two scans of the collection folders that can't be watched,
+# 0 to disable
+COLLECTION_SCAN_INTERVAL = 3600
+
 # Whether to use the http debug toolbar plugin for pyramid
 PYRAMID_DEBUGTOOLBAR = False
 
@@ -44,3 +87,14 @@ RELOAD_MAKO_TEMPLATES = True
 
 # Whether to regenerate the thumbnails for the speeddial at app startup
 REGENERATE_THUMBNAILS = False
+
+# number of processes used for guessing filenames, None to use all the cores,
+# 0 to guess them in the import tasks themselves
+GUESSIT_PROCESSES = None
+
+# maximum time (in seconds) to wait for running tasks when quitting
+SHUTDOWN_TIMEOUT = 10
+
+# number of slowest imports for which to keep a detailed trace of the time spent
+# in each stage (see /info/pipeline_stats), 0 to disable
+PIPELINE_SLOWEST_TRACES = 0
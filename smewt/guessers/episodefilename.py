@@ -22,7 +22,7 @@
 from smewt.base import GraphAction, SmewtException
 from smewt.base.utils import guessitToPygoo
 from smewt.ontology import Media, foundMetadata
-from guessit import guess_episode_info
+from smewt.guessers import guessitpool
 import logging
 
 log = logging.getLogger(__name__)
@@ -45,7 +45,7 @@ class EpisodeFilename(GraphAction):
 
         media = query.find_one(Media)
 
-        episodeMetadata = guess_episode_info(media.filename)
+        episodeMetadata = guessitpool.guess('episode', media.filename)
         episodeMetadata = guessitToPygoo(episodeMetadata)
 
         averageConfidence = sum(episodeMetadata.confidence(prop) for prop in episodeMetadata) / len(episodeMetadata)
@@ -19,6 +19,7 @@
 #
 
 from smewt.base import GraphAction, SmewtException
+from smewt.base.textutils import normalizeTitle
 from smewt.ontology import Episode, Series, Media
 from pygoo import MemoryObjectGraph, Equal
 from tvdbmetadataprovider import TVDBMetadataProvider
@@ -27,8 +28,59 @@ import logging
 log = logging.getLogger(__name__)
 
 
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EpisodeIndex(object):
+    """The episodes of a series found by TVDBMetadataProvider.startSeries, indexed by
+    (season, episodeNumber) so that we don't need to look at all of them for each file.
+
+    Episodes are also indexed by their absolute number (as given by the TVDB), for the
+    series that are numbered that way."""
+
+    def __init__(self, result):
+        self.result = result
+        self.series = result.find_one(Series)
+        self.episodes = list(result.find_all(Episode))
+
+        self.byNumber = {}
+        self.byAbsoluteNumber = {}
+        for ep in self.episodes:
+            key = (_int(ep.get('season')), _int(ep.get('episodeNumber')))
+            self.byNumber.setdefault(key, []).append(ep)
+
+            absolute = _int(ep.get('absoluteNumber'))
+            if absolute is not None:
+                self.byAbsoluteNumber.setdefault(absolute, []).append(ep)
+
+    def find(self, season, episodeNumber):
+        """Return the episodes that can match the given numbers."""
+        season, episodeNumber = _int(season), _int(episodeNumber)
+        if episodeNumber is None:
+            # nothing to index on, let the solver choose between all of them
+            return self.episodes
+
+        return self.byNumber.get((season, episodeNumber), [])
+
+    def findAbsolute(self, absoluteNumber):
+        """Return the episodes with the given absolute number."""
+        return self.byAbsoluteNumber.get(_int(absoluteNumber), [])
+
+
 class EpisodeTVDB(GraphAction):
 
+    def __init__(self, mdprovider = None, seriesResults = None):
+        super(EpisodeTVDB, self).__init__()
+        self.mdprovider = mdprovider
+        # normalized series name -> EpisodeIndex of the result of
+        # TVDBMetadataProvider.startSeries (or the exception it raised), for the
+        # series that have already been looked up
+        self.seriesResults = seriesResults if seriesResults is not None else {}
+
     def canHandle(self, query):
         if query.find_one(Media).type() not in [ 'video', 'subtitle' ]:
             raise SmewtException("%s: can only handle video or subtitle media objects" % self.__class__.__name__)
@@ -45,12 +97,20 @@ class EpisodeTVDB(GraphAction):
 
         # little hack: if we have no season number, add 1 as default season number
         # (helps for series which have only 1 season)
-        if ep.get('season') is None:
+        # without a season, the episode number might also be an absolute one
+        absolute = ep.get('season') is None
+        if absolute:
             ep.season = 1
 
+        key = normalizeTitle(ep.series.title)
         try:
-            mdprovider = TVDBMetadataProvider()
-            result = mdprovider.startEpisode(ep)
+            index = self.seriesResults.get(key)
+            if isinstance(index, SmewtException):
+                raise index
+            elif index is None:
+                mdprovider = self.mdprovider or TVDBMetadataProvider.instance()
+                index = EpisodeIndex(mdprovider.startEpisode(ep))
+                self.seriesResults[key] = index
 
         except SmewtException:
             # series could not be found, return a dummy Unknown series instead
@@ -59,14 +119,25 @@ class EpisodeTVDB(GraphAction):
             noposter = '/static/images/noposter.png'
             result = MemoryObjectGraph()
             result.Series(title = 'Unknown', loresImage=noposter, hiresImage=noposter)
+            index = EpisodeIndex(result)
 
         # update the series
         query.delete_node(ep.series.node)
-        ep.series = query.add_object(result.find_one(Series)) # this add_object should be unnecessary
+        ep.series = query.add_object(index.series) # this add_object should be unnecessary
 
         series = ep.series
-        # and add all the potential episodes
-        for found_ep in result.find_all(Episode):
+        # and add the potential episodes, only the ones with the right numbers so
+        # that the solver doesn't need to go through the whole series
+        candidates = index.find(ep.get('season'), ep.get('episodeNumber'))
+        if not candidates and absolute:
+            candidates = index.findAbsolute(ep.get('episodeNumber'))[:1]
+            if candidates:
+                # the file is numbered from the start of the series, renumber it like
+                # the episode we found so that the solver can match them
+                ep.season = candidates[0].get('season')
+                ep.episodeNumber = candidates[0].get('episodeNumber')
+
+        for found_ep in candidates:
             data = { 'series': series }
             data.update(found_ep.literal_items())
             ep = query.Episode(**data)
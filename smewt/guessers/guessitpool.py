@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from guessit import guess_episode_info, guess_movie_info
+from multiprocessing import Pool, cpu_count
+from threading import Lock
+from smewt.base.pipelinestats import timed
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+"""This module runs the guessit step of the filename guessers, which is CPU-bound.
+
+By default, guessing happens in the calling thread. If a GuessitPool has been set up
+with setPool(), the filenames given to prefetch() are guessed in advance by a pool of
+worker processes, and guess() then simply returns their result. This allows to use all
+the available cores when importing lots of files.
+
+In both cases, the result is a plain dict (not a guessit.Guess) which also remembers the
+confidence of each property, and which can be given to utils.guessitToPygoo().
+"""
+
+
+class GuessResult(dict):
+    """Dictionary of the properties found by guessit, along with their confidence."""
+
+    def __init__(self, values, confidences):
+        super(GuessResult, self).__init__(values)
+        self.confidences = confidences
+
+    def confidence(self, prop):
+        return self.confidences.get(prop, 0)
+
+
+GUESSERS = { 'episode': guess_episode_info,
+             'movie': guess_movie_info }
+
+def _guess(args):
+    """Run guessit on the given filename and return its result as simple python objects,
+    so that it can be sent back from a worker process."""
+    kind, filename = args
+    guess = GUESSERS[kind](filename)
+    return dict(guess), dict((prop, guess.confidence(prop)) for prop in guess)
+
+
+class GuessitPool(object):
+    # number of filenames sent at once to a worker process
+    chunksize = 16
+
+    # maximum number of results waiting for guess() to be called for their file, and
+    # number of seconds after which they are forgotten (the file might never be
+    # imported, if its task has been cancelled for instance)
+    maxResults = 5000
+    maxAge = 3600
+
+    def __init__(self, processes = None):
+        super(GuessitPool, self).__init__()
+        self.processes = processes or cpu_count()
+        log.info('Starting guessit pool with %d processes' % self.processes)
+        self.pool = Pool(self.processes)
+        self.lock = Lock()
+        # (kind, filename) -> (AsyncResult, index of the file in its chunk, time of prefetch)
+        self.results = {}
+
+    def _purge(self):
+        """Forget the results which have been waiting for too long. Should be called
+        with the lock held."""
+        limit = time.time() - self.maxAge
+        for args, (result, n, prefetched) in self.results.items():
+            if prefetched < limit:
+                del self.results[args]
+
+    def prefetch(self, kind, filenames):
+        """Start guessing the given filenames in the worker processes. Only as many of
+        them as there is room for are prefetched, the other ones will be guessed when
+        guess() is called for them."""
+        with self.lock:
+            self._purge()
+            room = self.maxResults - len(self.results)
+
+        filenames = list(filenames)[:max(room, 0)]
+        for i in range(0, len(filenames), self.chunksize):
+            chunk = [ (kind, f) for f in filenames[i:i+self.chunksize] ]
+            result = self.pool.map_async(_guess, chunk)
+            now = time.time()
+            with self.lock:
+                for n, args in enumerate(chunk):
+                    self.results[args] = (result, n, now)
+
+    def guess(self, kind, filename):
+        with self.lock:
+            prefetched = self.results.pop((kind, filename), None)
+
+        if prefetched is None:
+            return _guess((kind, filename))
+
+        result, n, _ = prefetched
+        try:
+            return result.get()[n]
+        except Exception as e:
+            # guessit failed in the worker process, let it fail again here with the full traceback
+            log.debug('Guessing %s in worker process failed: %s' % (filename, e))
+            return _guess((kind, filename))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+_pool = None
+
+def setPool(pool):
+    global _pool
+    _pool = pool
+
+def closePool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+def prefetch(kind, filenames):
+    if _pool is not None:
+        _pool.prefetch(kind, filenames)
+
+def guess(kind, filename):
+    with timed('guessit'):
+        if _pool is not None:
+            values, confidences = _pool.guess(kind, filename)
+        else:
+            values, confidences = _guess((kind, filename))
+    return GuessResult(values, confidences)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import with_statement
+from smewt.base.textutils import normalizeTitle
+from threading import Lock
+import sqlite3
+import json
+import time
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+"""The metadata mirror is a SQLite file containing the information about the series,
+episodes and movies that have already been looked up online, which the metadata
+provider consults before going online.
+
+It can also be exported to a dump (which is a mirror file itself) and imported by
+another instance, so that a new installation can tag a whole library without having
+to do all the requests to thetvdb.com and themoviedb.org again.
+
+Series and movies are timestamped, so that the ones that have become too old can be
+fetched again.
+"""
+
+SCHEMA = [ '''CREATE TABLE IF NOT EXISTS series (
+                  id INTEGER NOT NULL,
+                  language TEXT NOT NULL,
+                  title TEXT NOT NULL,
+                  updated REAL NOT NULL,
+                  PRIMARY KEY (id, language))''',
+
+           # season and episode numbers are kept as they come from the TVDB
+           '''CREATE TABLE IF NOT EXISTS episodes (
+                  series_id INTEGER NOT NULL,
+                  language TEXT NOT NULL,
+                  season NUMERIC,
+                  episode NUMERIC,
+                  title TEXT,
+                  synopsis TEXT,
+                  air_date TEXT,
+                  absolute_number NUMERIC)''',
+
+           '''CREATE INDEX IF NOT EXISTS episodes_series
+                  ON episodes (series_id, language)''',
+
+           # the normalized names under which a series has been found
+           '''CREATE TABLE IF NOT EXISTS series_names (
+                  name TEXT NOT NULL,
+                  series_id INTEGER NOT NULL,
+                  PRIMARY KEY (name, series_id))''',
+
+           # url is empty when the series has no poster
+           '''CREATE TABLE IF NOT EXISTS series_posters (
+                  series_id INTEGER PRIMARY KEY,
+                  url TEXT NOT NULL)''',
+
+           # details are the parts of the TMDB json responses that we use
+           '''CREATE TABLE IF NOT EXISTS movies (
+                  id INTEGER NOT NULL,
+                  language TEXT NOT NULL,
+                  details TEXT NOT NULL,
+                  updated REAL NOT NULL,
+                  PRIMARY KEY (id, language))''',
+
+           '''CREATE TABLE IF NOT EXISTS movie_names (
+                  name TEXT PRIMARY KEY,
+                  movie_id INTEGER NOT NULL)''',
+           ]
+
+TABLES = [ 'series', 'episodes', 'series_names', 'series_posters', 'movies', 'movie_names' ]
+
+EPISODE_COLUMNS = [ 'series_id', 'language', 'season', 'episode', 'title', 'synopsis', 'air_date',
+                    'absolute_number' ]
+
+
+class MetadataMirror(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+        # the mirror is shared by all the import threads, the lock serializes its use
+        self.conn = sqlite3.connect(filename, check_same_thread = False)
+        with self.lock:
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            if 'absolute_number' not in self._columns('main', 'episodes'):
+                # mirror created before the absolute numbers were kept
+                self.conn.execute('ALTER TABLE episodes ADD COLUMN absolute_number NUMERIC')
+            self.conn.commit()
+
+    def _columns(self, database, table):
+        return [ row[1] for row in self.conn.execute('PRAGMA %s.table_info(%s)' % (database, table)) ]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _stale(self, updated, maxAge):
+        return maxAge is not None and time.time() > updated + maxAge
+
+    def expire(self):
+        """Make all the series and movies stale, so that they are fetched again the next
+        time they are needed, and forget the names and posters we found for them."""
+        with self.lock:
+            self.conn.execute('UPDATE series SET updated = 0')
+            self.conn.execute('UPDATE movies SET updated = 0')
+            for table in ('series_names', 'series_posters', 'movie_names'):
+                self.conn.execute('DELETE FROM %s' % table)
+            self.conn.commit()
+
+    def seriesInfo(self, seriesId, language, maxAge = None):
+        """Return (title, episodes) for the given series, episodes being a list of
+        dicts with the season, episodeNumber, absoluteNumber, title, synopsis and
+        originalAirDate of each episode, or None if the series isn't in the mirror
+        or has been stored more than maxAge seconds ago."""
+        with self.lock:
+            row = self.conn.execute('SELECT title, updated FROM series WHERE id = ? AND language = ?',
+                                    (int(seriesId), language)).fetchone()
+            if row is None or self._stale(row[1], maxAge):
+                return None
+            episodes = self.conn.execute('SELECT season, episode, absolute_number, title, synopsis, air_date '
+                                         'FROM episodes WHERE series_id = ? AND language = ?',
+                                         (int(seriesId), language)).fetchall()
+
+        return row[0], [ { 'season': season,
+                           'episodeNumber': episode,
+                           'absoluteNumber': absolute,
+                           'title': title,
+                           'synopsis': synopsis,
+                           'originalAirDate': airDate }
+                         for season, episode, absolute, title, synopsis, airDate in episodes ]
+
+    def storeSeries(self, seriesId, language, title, episodes):
+        """Store a series and all its episodes, replacing the ones we had. The episodes
+        are given in the same format as returned by seriesInfo."""
+        seriesId = int(seriesId)
+        with self.lock:
+            self.conn.execute('DELETE FROM episodes WHERE series_id = ? AND language = ?',
+                              (seriesId, language))
+            self.conn.executemany('INSERT INTO episodes (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+                                  % ', '.join(EPISODE_COLUMNS),
+                                  [ (seriesId, language, ep['season'], ep['episodeNumber'],
+                                     ep['title'], ep['synopsis'], ep['originalAirDate'],
+                                     ep.get('absoluteNumber'))
+                                    for ep in episodes ])
+            self.conn.execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)',
+                              (seriesId, language, title, time.time()))
+            self.conn.execute('INSERT OR IGNORE INTO series_names VALUES (?, ?)',
+                              (normalizeTitle(title), seriesId))
+            self.conn.commit()
+
+    def addSeriesName(self, name, seriesId):
+        """Remember that the given name refers to the given series."""
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO series_names VALUES (?, ?)',
+                              (normalizeTitle(name), int(seriesId)))
+            self.conn.commit()
+
+    def findSeries(self, name):
+        """Return the series known under the given name, as a list of (id, title, language)
+        tuples like the TVDB search results."""
+        with self.lock:
+            rows = self.conn.execute('SELECT series.id, series.title, series.language '
+                                     'FROM series JOIN series_names ON series.id = series_names.series_id '
+                                     'WHERE series_names.name = ?', (normalizeTitle(name),)).fetchall()
+        return [ (unicode(seriesId), title, language) for seriesId, title, language in rows ]
+
+    def seriesPoster(self, seriesId):
+        """Return the url of the poster of the given series, '' if it has none, or None
+        if we don't know."""
+        with self.lock:
+            row = self.conn.execute('SELECT url FROM series_posters WHERE series_id = ?',
+                                    (int(seriesId),)).fetchone()
+        return row[0] if row is not None else None
+
+    def storeSeriesPoster(self, seriesId, url):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO series_posters VALUES (?, ?)',
+                              (int(seriesId), url or ''))
+            self.conn.commit()
+
+    def movieDetails(self, movieId, language, maxAge = None):
+        """Return the TMDB details of the given movie, or None if it isn't in the mirror
+        or has been stored more than maxAge seconds ago."""
+        with self.lock:
+            row = self.conn.execute('SELECT details, updated FROM movies WHERE id = ? AND language = ?',
+                                    (int(movieId), language)).fetchone()
+        if row is None or self._stale(row[1], maxAge):
+            return None
+        return json.loads(row[0])
+
+    def storeMovie(self, movieId, language, details):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO movies VALUES (?, ?, ?, ?)',
+                              (int(movieId), language, json.dumps(details), time.time()))
+            self.conn.commit()
+
+    def addMovieName(self, name, movieId):
+        """Remember that the given name refers to the given movie."""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO movie_names VALUES (?, ?)',
+                              (normalizeTitle(name), int(movieId)))
+            self.conn.commit()
+
+    def findMovie(self, name):
+        """Return the id of the movie known under the given name, or None."""
+        with self.lock:
+            row = self.conn.execute('SELECT movie_id FROM movie_names WHERE name = ?',
+                                    (normalizeTitle(name),)).fetchone()
+        return row[0] if row is not None else None
+
+    def exportDump(self, filename):
+        """Write the whole contents of the mirror to the given file, which can then be
+        imported by other instances. An existing file is overwritten."""
+        if os.path.exists(filename):
+            os.remove(filename)
+        MetadataMirror(filename).close()
+
+        with self.lock:
+            self.conn.commit()
+            self.conn.execute('ATTACH DATABASE ? AS dump', (filename,))
+            try:
+                for table in TABLES:
+                    self.conn.execute('INSERT INTO dump.%s SELECT * FROM main.%s' % (table, table))
+                self.conn.commit()
+            finally:
+                self.conn.execute('DETACH DATABASE dump')
+
+    def importDump(self, filename):
+        """Import the series and movies of the given dump that are more recent than the
+        ones we have, and return how many series and movies were imported."""
+        with self.lock:
+            self.conn.commit()
+            self.conn.execute('ATTACH DATABASE ? AS dump', (filename,))
+            try:
+                c = self.conn
+                c.execute('DROP TABLE IF EXISTS temp.newer_series')
+                c.execute('DROP TABLE IF EXISTS temp.newer_movies')
+                c.execute('CREATE TEMP TABLE newer_series AS '
+                          'SELECT d.id, d.language FROM dump.series d '
+                          'LEFT JOIN main.series s ON s.id = d.id AND s.language = d.language '
+                          'WHERE s.updated IS NULL OR s.updated < d.updated')
+                c.execute('CREATE TEMP TABLE newer_movies AS '
+                          'SELECT d.id, d.language FROM dump.movies d '
+                          'LEFT JOIN main.movies m ON m.id = d.id AND m.language = d.language '
+                          'WHERE m.updated IS NULL OR m.updated < d.updated')
+
+                isNewer = ('EXISTS (SELECT 1 FROM temp.newer_series n '
+                           'WHERE n.id = %s.series_id AND n.language = %s.language)')
+                c.execute('DELETE FROM main.episodes WHERE ' + isNewer % ('episodes', 'episodes'))
+                # dumps from older versions don't have all the columns
+                dumpColumns = self._columns('dump', 'episodes')
+                c.execute('INSERT INTO main.episodes (%s) SELECT %s FROM dump.episodes e WHERE '
+                          % (', '.join(EPISODE_COLUMNS),
+                             ', '.join(col if col in dumpColumns else 'NULL' for col in EPISODE_COLUMNS)) +
+                          isNewer % ('e', 'e'))
+                c.execute('INSERT OR REPLACE INTO main.series SELECT d.* FROM dump.series d '
+                          'JOIN temp.newer_series n ON n.id = d.id AND n.language = d.language')
+                c.execute('INSERT OR REPLACE INTO main.movies SELECT d.* FROM dump.movies d '
+                          'JOIN temp.newer_movies n ON n.id = d.id AND n.language = d.language')
+
+                # we keep our own names and posters when we have them
+                for table in ('series_names', 'series_posters', 'movie_names'):
+                    c.execute('INSERT OR IGNORE INTO main.%s SELECT * FROM dump.%s' % (table, table))
+
+                nseries = c.execute('SELECT COUNT(*) FROM temp.newer_series').fetchone()[0]
+                nmovies = c.execute('SELECT COUNT(*) FROM temp.newer_movies').fetchone()[0]
+                c.execute('DROP TABLE temp.newer_series')
+                c.execute('DROP TABLE temp.newer_movies')
+                c.commit()
+            except:
+                self.conn.rollback()
+                raise
+            finally:
+                self.conn.execute('DETACH DATABASE dump')
+
+        log.info('Imported %d series and %d movies into the metadata mirror' % (nseries, nmovies))
+        return nseries, nmovies
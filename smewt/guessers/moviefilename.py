@@ -21,7 +21,7 @@
 from smewt.base import GraphAction, SmewtException
 from smewt.ontology import Media, foundMetadata
 from smewt.base.utils import tolist, guessitToPygoo
-from guessit import guess_movie_info
+from smewt.guessers import guessitpool
 import logging
 
 log = logging.getLogger(__name__)
@@ -43,7 +43,7 @@ class MovieFilename(GraphAction):
         self.checkValid(query)
         media = query.find_one(node_type = Media)
 
-        movieMetadata = guess_movie_info(media.filename)
+        movieMetadata = guessitpool.guess('movie', media.filename)
         movieMetadata = guessitToPygoo(movieMetadata)
 
         # FIXME: this is a temporary hack waiting for the pygoo and ontology refactoring
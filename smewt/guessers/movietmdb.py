@@ -32,6 +32,10 @@ class MovieTMDB(GraphAction):
 
     supportedTypes = [ 'video', 'subtitle' ]
 
+    def __init__(self, mdprovider = None):
+        super(MovieTMDB, self).__init__()
+        self.mdprovider = mdprovider
+
     def canHandle(self, query):
         return True
 
@@ -42,7 +46,7 @@ class MovieTMDB(GraphAction):
         movie = query.find_one(Movie)
 
         try:
-            mdprovider = TVDBMetadataProvider()
+            mdprovider = self.mdprovider or TVDBMetadataProvider.instance()
             result = mdprovider.startMovie(movie.title)
         except SmewtException:
             # movie could not be found, return a dummy Unknown movie instead so we can group them somewhere
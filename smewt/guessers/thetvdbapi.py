@@ -21,11 +21,16 @@ import urllib
 import datetime
 import re
 
+from smewt.base import SmewtException
 import xml.etree.cElementTree as ET
 
 class TheTVDB(object):
-    def __init__(self, api_key):
+    def __init__(self, api_key, urlopen = urllib.urlopen, urlstream = None):
         self.api_key = api_key
+        # function used to fetch the urls, returns a file-like object
+        self.urlopen = urlopen
+        # same, but for the large documents which are read as they arrive
+        self.urlstream = urlstream or urlopen
         self.mirror_url = "http://www.thetvdb.com"
         self.base_url =  self.mirror_url + "/api"
         self.base_key_url = "%s/%s" % (self.base_url, self.api_key)
@@ -117,6 +122,23 @@ class TheTVDB(object):
         def __str__(self):
             return repr(self)
 
+    class EpisodeSummary(object):
+        """A lighter version of Episode, containing only the main episode details."""
+        __slots__ = ('id', 'name', 'overview', 'season_number', 'episode_number', 'absolute_number',
+                     'first_aired')
+
+        def __init__(self, node):
+            self.id = node.findtext("id")
+            self.name = node.findtext("EpisodeName")
+            self.overview = node.findtext("Overview")
+            self.season_number = node.findtext("SeasonNumber")
+            self.episode_number = node.findtext("EpisodeNumber")
+            self.absolute_number = node.findtext("absolute_number")
+            self.first_aired = TheTVDB.convert_date(node.findtext("FirstAired"))
+
+        def __str__(self):
+            return repr(self)
+
     @staticmethod
     def convert_time(time_string):
         """Convert a thetvdb time string into a datetime.time object."""
@@ -160,7 +182,7 @@ class TheTVDB(object):
         """Get a list of shows matching show_name."""
         get_args = urllib.urlencode({"seriesname": show_name}, doseq=True)
         url = "%s/GetSeries.php?%s&language=all" % (self.base_url, get_args)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
         show_list = []
 
         if data:
@@ -175,7 +197,7 @@ class TheTVDB(object):
     def get_show(self, show_id, language='en'):
         """Get the show object matching this show_id."""
         url = "%s/series/%s/%s.xml" % (self.base_key_url, show_id, language)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
 
         show = None
         try:
@@ -191,7 +213,7 @@ class TheTVDB(object):
     def get_episode(self, episode_id, language='en'):
         """Get the episode object matching this episode_id."""
         url = "%s/episodes/%s/%s.xml" % (self.base_key_url, episode_id, language)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
 
         episode = None
         try:
@@ -207,7 +229,7 @@ class TheTVDB(object):
     def get_show_and_episodes(self, show_id, language='en'):
         """Get the show object and all matching episode objects for this show_id."""
         url = "%s/series/%s/all/%s.xml" % (self.base_key_url, show_id, language)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
 
         show_and_episodes = None
         try:
@@ -227,10 +249,42 @@ class TheTVDB(object):
 
         return show_and_episodes
 
+    def iter_show_and_episodes(self, show_id, language='en'):
+        """Same as get_show_and_episodes, but parse the document incrementally instead
+        of building its whole tree, and generate the results as they are parsed: first
+        the show object, then an EpisodeSummary object for each of its episodes."""
+        url = "%s/series/%s/all/%s.xml" % (self.base_key_url, show_id, language)
+        data = self.urlstream(url)
+
+        try:
+            context = iter(ET.iterparse(data, events=("start", "end")))
+            _, root = next(context)
+
+            for event, node in context:
+                if event != "end":
+                    continue
+
+                if node.tag == "Series":
+                    yield TheTVDB.Show(node, self.mirror_url)
+                elif node.tag == "Episode":
+                    yield TheTVDB.EpisodeSummary(node)
+                else:
+                    continue
+
+                # we're done with this record, free the memory used by it
+                root.clear()
+
+        except SyntaxError, e:
+            # don't let a truncated document pass for a series with fewer episodes
+            raise SmewtException("TheTVDB: invalid document for show %s: %s" % (show_id, e))
+
+        finally:
+            data.close()
+
     def get_updated_shows(self, period = "day"):
         """Get a list of show ids which have been updated within this period."""
         url = "%s/updates/updates_%s.xml" % (self.base_key_url, period)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
         tree = ET.parse(data)
 
         series_nodes = tree.getiterator("Series")
@@ -240,7 +294,7 @@ class TheTVDB(object):
     def get_updated_episodes(self, period = "day"):
         """Get a list of episode ids which have been updated within this period."""
         url = "%s/updates/updates_%s.xml" % (self.base_key_url, period)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
         tree = ET.parse(data)
 
         episode_nodes = tree.getiterator("Episode")
@@ -250,7 +304,7 @@ class TheTVDB(object):
     def get_show_image_choices(self, show_id):
         """Get a list of image urls and types relating to this show."""
         url = "%s/series/%s/banners.xml" % (self.base_key_url, show_id)
-        data = urllib.urlopen(url)
+        data = self.urlopen(url)
         tree = ET.parse(data)
 
         images = []
@@ -11,29 +11,34 @@ import json
 import requests
 
 class TMDB:
-    def __init__(self, api_key, version=3):
+    # anything with the same get/post/delete functions as the requests module
+    session = requests
+
+    def __init__(self, api_key, version=3, session=None):
         TMDB.api_key = str(api_key)
         TMDB.url = 'https://api.themoviedb.org' + '/' + str(version)
+        if session is not None:
+            TMDB.session = session
 
     @staticmethod
     def _request(method, path, params={}, json_body={}):
         url = TMDB.url + '/' + path + '?api_key=' + TMDB.api_key
         if method == 'GET':
             headers = {'Accept': 'application/json'}
-            content = requests.get(url, params=params, headers=headers).content
+            content = TMDB.session.get(url, params=params, headers=headers).content
         elif method == 'POST':
             for key in params.keys():
                 url += '&' + key + '=' + params[key]
             headers = {'Content-Type': 'application/json', \
                        'Accept': 'application/json'}
-            content = requests.post(url, data=json.dumps(json_body), \
+            content = TMDB.session.post(url, data=json.dumps(json_body), \
                                     headers=headers).content
         elif method == 'DELETE':
             for key in params.keys():
                 url += '&' + key + '=' + params[key]
             headers = {'Content-Type': 'application/json', \
                        'Accept': 'application/json'}
-            content = requests.delete(url, data=json.dumps(json_body), \
+            content = TMDB.session.delete(url, data=json.dumps(json_body), \
                                     headers=headers).content
         else:
             raise Exception('method: ' + method + ' not supported.')
@@ -411,6 +416,14 @@ class TMDB:
             TMDB._set_attrs_to_values(self, response)
             return response
 
+        # same as info, but the response also contains the responses of the given
+        # methods (e.g. ['credits', 'images']) under their names, in a single request
+        # optional parameters: language, include_image_language
+        def info_with(self, methods, params={}):
+            params = dict(params)
+            params['append_to_response'] = ','.join(methods)
+            return self.info(params)
+
         # optional parameters: country
         def alternative_titles(self, params={}):
             path = 'movie' + '/' + str(self.id) + '/alternative_titles'
@@ -18,18 +18,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from smewt.base import cachedmethod, SmewtException
+from smewt.base import cachedmethod, cachedlookup, SmewtException
+from smewt.base.cache import store_cached_value
 from smewt.ontology import Series
 from smewt.base import textutils
+from smewt.base.pipelinestats import timed
+from smewt.base import httpclient, posters
 from smewt.base.utils import tolist, path
+from smewt import config
 from pygoo import MemoryObjectGraph
-from PIL import Image
-from urllib2 import urlopen
+from threading import Lock
 import smewt.settings
 import guessit
+from metadatamirror import MetadataMirror
 import thetvdbapi
 import tmdbsimple
 import datetime
+import json
+import time
 import logging
 
 log = logging.getLogger(__name__)
@@ -39,20 +45,101 @@ def guiLanguage():
     return guessit.Language(language)
 
 
+def movieSummary(details):
+    """Return only the parts of the TMDB details of a movie that are used by
+    getMovieData and getMoviePosterUrl."""
+    credits = details.get('credits', {})
+    posters = details.get('images', {}).get('posters', [])
+    return { 'title': details['title'],
+             'original_title': details['original_title'],
+             'release_date': details.get('release_date'),
+             'genres': [ { 'name': g['name'] } for g in details['genres'] ],
+             'vote_average': details['vote_average'],
+             'overview': details['overview'],
+             'poster_path': details.get('poster_path'),
+             'credits': { 'crew': [ { 'name': c['name'], 'job': c['job'] }
+                                    for c in credits.get('crew', [])
+                                    if c['job'] in ('Director', 'Author') ],
+                          'cast': [ { 'name': c['name'], 'character': c['character'] }
+                                    for c in credits.get('cast', []) ] },
+             'images': { 'posters': [ { 'file_path': p['file_path'] } for p in posters[:1] ] } }
+
+
 class TVDBMetadataProvider(object):
+    """Look up series and movies on thetvdb.com and themoviedb.org.
+
+    There is no state specific to a lookup in here, so a single provider, returned by
+    instance(), can be shared by all the threads."""
+
+    _instance = None
+    _instanceLock = Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
     def __init__(self):
         super(TVDBMetadataProvider, self).__init__()
 
-        self.tvdb = thetvdbapi.TheTVDB("65D91F0290476F3E")
-        self.tmdb = tmdbsimple.TMDB('a8b9f96dde091408a03cb4c78477bd14')
-        self.tmdb.server_config = self.tmdb.Configuration()
-        self.tmdb.server_config.info()
-        self.tmdb.lang = 'en'
+        # the responses from the metadata sites are kept on disk and revalidated when needed
+        http = httpclient.cachingClient()
+        self.tvdb = thetvdbapi.TheTVDB("65D91F0290476F3E", urlopen = http.urlopen, urlstream = http.stream)
+        self.tmdb = tmdbsimple.TMDB('a8b9f96dde091408a03cb4c78477bd14', session = http)
+        self.tmdbConfig = None
+        self.tmdbConfigLock = Lock()
+
+        # series names that we know already, set by the SmewtDaemon (see SeriesIndex)
+        self.seriesIndex = None
+
+        # what has already been looked up is kept in a local mirror, consulted first
+        self.mirror = None
+        if config.METADATA_MIRROR:
+            self.mirror = MetadataMirror(path(smewt.dirs.user_data_dir, 'metadata_mirror.sqlite',
+                                              createdir=True))
+
+    def _tmdbConfigFilename(self):
+        return path(smewt.dirs.user_cache_dir, 'tmdb_configuration.json', createdir=True)
+
+    def getTMDBConfig(self):
+        """Return the TMDB configuration (image base urls, sizes, ...), which is kept
+        on disk and only fetched again once it is older than config.TMDB_CONFIG_TTL."""
+        with self.tmdbConfigLock:
+            if self.tmdbConfig is not None:
+                return self.tmdbConfig
+
+            filename = self._tmdbConfigFilename()
+            try:
+                cached = json.load(open(filename))
+                if time.time() < cached['timestamp'] + config.TMDB_CONFIG_TTL:
+                    self.tmdbConfig = cached['configuration']
+                    return self.tmdbConfig
+            except (IOError, ValueError, KeyError):
+                pass
+
+            log.info('Fetching TMDB configuration')
+            with timed('tmdb.getConfiguration'):
+                self.tmdbConfig = self.tmdb.Configuration().info()
+            try:
+                json.dump({ 'timestamp': time.time(), 'configuration': self.tmdbConfig },
+                          open(filename, 'w'))
+            except IOError, e:
+                log.warning('Could not save TMDB configuration: %s' % e)
 
-    @cachedmethod
+            return self.tmdbConfig
+
+    @cachedlookup
     def getSeries(self, name):
         """Get the TVDBPy series object given its name."""
-        results = self.tvdb.get_matching_shows(name)
+        if self.mirror is not None:
+            results = self.mirror.findSeries(name)
+            if results:
+                return results
+
+        with timed('tvdb.getSeries'):
+            results = self.tvdb.get_matching_shows(name)
         '''
         for id, name, lang in results:
             # FIXME: that doesn't look correct: either yield or no for
@@ -64,43 +151,125 @@ class TVDBMetadataProvider(object):
 
         return results
 
-    @cachedmethod
     def getEpisodes(self, series, language):
         """From a given TVDBPy series object, return a graph containing its information
         as well as its episodes nodes."""
-        show, episodes = self.tvdb.get_show_and_episodes(series, language=language)
+        # the series ids come as strings from the searches and as ints from the
+        # database, both need to refer to the same cache entry
+        return self._getEpisodes(unicode(series), language)
 
-        # TODO: debug to see if this is the correct way to access the series' title
+    @cachedmethod
+    def _getEpisodes(self, series, language):
+        info = None
+        if self.mirror is not None:
+            info = self.mirror.seriesInfo(series, language, config.METADATA_MIRROR_TTL)
+        if info is None:
+            try:
+                info = self.fetchEpisodes(series, language)
+            except Exception, e:
+                # better outdated information than none at all
+                info = self.mirror.seriesInfo(series, language) if self.mirror is not None else None
+                if info is None:
+                    raise
+                log.warning('Could not update series %s, using the one from the mirror: %s' % (series, e))
+        title, episodes = info
+        return self.episodesGraph(series, title, episodes)
+
+    def episodesGraph(self, series, title, episodes):
+        """Return a graph containing the series and its episodes, as given by
+        fetchEpisodes."""
         result = MemoryObjectGraph()
-        smewtSeries = result.Series(title = show.name)
+        smewtSeries = result.Series(title = title, tvdbId = int(series))
 
         for episode in episodes:
             ep = result.Episode(series = smewtSeries,
-                                season = episode.season_number,
-                                episodeNumber = episode.episode_number)
-            ep.set('title', episode.name)
-            ep.set('synopsis', episode.overview)
-            ep.set('originalAirDate', str(episode.first_aired))
+                                season = episode['season'],
+                                episodeNumber = episode['episodeNumber'])
+            ep.set('title', episode['title'])
+            ep.set('synopsis', episode['synopsis'])
+            ep.set('originalAirDate', episode['originalAirDate'])
+            if episode.get('absoluteNumber'):
+                ep.set('absoluteNumber', int(episode['absoluteNumber']))
 
         return result
 
-    @cachedmethod
+    def fetchEpisodes(self, series, language):
+        """Fetch the information about a series and its episodes from thetvdb.com, and
+        update the mirror with it. Return it as (title, episodes), see
+        MetadataMirror.seriesInfo."""
+        with timed('tvdb.getEpisodes'):
+            # the show comes first, followed by all its episodes
+            records = self.tvdb.iter_show_and_episodes(series, language=language)
+            show = next(records, None)
+            if show is None:
+                raise SmewtException("EpisodeTVDB: Could not get episodes for series %s" % series)
+
+            episodes = [ { 'season': episode.season_number,
+                           'episodeNumber': episode.episode_number,
+                           'absoluteNumber': episode.absolute_number,
+                           'title': episode.name,
+                           'synopsis': episode.overview,
+                           'originalAirDate': str(episode.first_aired) }
+                         for episode in records ]
+
+        if self.mirror is not None:
+            self.mirror.storeSeries(series, language, show.name, episodes)
+
+        return show.name, episodes
+
+    @cachedlookup
     def getMovie(self, name):
         """Get the IMDBPy movie object given its name."""
         if not name:
             raise SmewtException('You need to specify at least a probable name for the movie...')
         log.debug('MovieTMDB: looking for movie %s', name)
-        results = self.tmdb.Search().movie({'query': name})['results']
+        if self.mirror is not None:
+            movieId = self.mirror.findMovie(name)
+            if movieId is not None:
+                return movieId
+
+        with timed('tmdb.getMovie'):
+            results = self.tmdb.Search().movie({'query': name})['results']
         for r in results:
-          return r['id']
+            if self.mirror is not None:
+                self.mirror.addMovieName(name, r['id'])
+            return r['id']
 
         raise SmewtException("MovieTMDB: Could not find movie '%s'" % name)
 
+    @cachedmethod
+    def getMovieDetails(self, movieId):
+        """Return the TMDB information about a movie, along with its credits and images,
+        all fetched in a single request (see movieSummary)."""
+        lang = guiLanguage().alpha2
+        if self.mirror is not None:
+            details = self.mirror.movieDetails(movieId, lang, config.METADATA_MIRROR_TTL)
+            if details is not None:
+                return details
+
+        try:
+            with timed('tmdb.getMovieDetails'):
+                details = self.tmdb.Movies(movieId).info_with([ 'credits', 'images' ],
+                                                              { 'language': lang,
+                                                                'include_image_language': '%s,null' % lang })
+        except Exception, e:
+            # better outdated information than none at all
+            details = self.mirror.movieDetails(movieId, lang) if self.mirror is not None else None
+            if details is None:
+                raise
+            log.warning('Could not update movie %s, using the one from the mirror: %s' % (movieId, e))
+            return details
+
+        details = movieSummary(details)
+        if self.mirror is not None:
+            self.mirror.storeMovie(movieId, lang, details)
+
+        return details
+
     @cachedmethod
     def getMovieData(self, movieId):
         """From a given TVDBPy movie object, return a graph containing its information."""
-        m = self.tmdb.Movies(movieId)
-        resp = m.info({'language': self.tmdb.lang})
+        resp = self.getMovieDetails(movieId)
 
         result = MemoryObjectGraph()
         movie = result.Movie(title = unicode(resp['title']))
@@ -111,9 +280,9 @@ class TVDBMetadataProvider(object):
         movie.set('genres', [ unicode(g['name']) for g in resp['genres'] ])
         movie.set('rating', resp['vote_average'])
         movie.set('plot', [unicode(resp['overview'])])
-        resp = m.credits()
-        movie.set('director', [ unicode(c['name']) for c in resp['crew'] if c['job'] == 'Director' ])
-        movie.set('writer', [ unicode(c['name']) for c in resp['crew'] if c['job'] == 'Author' ])
+        resp = resp.get('credits', {})
+        movie.set('director', [ unicode(c['name']) for c in resp.get('crew', []) if c['job'] == 'Director' ])
+        movie.set('writer', [ unicode(c['name']) for c in resp.get('crew', []) if c['job'] == 'Author' ])
         
         try:
             movie.cast = [ unicode(actor['name']) + ' -- ' + unicode(actor['character']) for actor in resp['cast'] ]
@@ -123,77 +292,91 @@ class TVDBMetadataProvider(object):
 
         return result
 
-    def savePoster(self, posterUrl, localId):
-        hiresFilename = path(smewt.dirs.user_data_dir, 'images', '%s_hires.jpg' % localId,
-                             createdir=True)
-
-        loresFilename = path(smewt.dirs.user_data_dir, 'images', '%s_lores.jpg' % localId)
-
-        # TODO: use requests instead of urlopen
-        open(hiresFilename, 'wb').write(urlopen(posterUrl).read())
-
-        # NOTE: we do the resizing here because if we leave it to the browser,
-        #       it will use a fast resampling algorithm, which will be of lower
-        #       quality than what we achieve here
-        # lores = 80px high
-        width, height = 60, 80
-        header_msg = 'Creating %dx%d screenshot' % (width, height)
-        log.info('%s for %s...', header_msg, hiresFilename)
-        im = Image.open(hiresFilename)
-        log.debug('%s: resizing...', header_msg)
-        im.thumbnail((width, height), Image.ANTIALIAS)
-        log.debug('%s: saving to png...', header_msg)
-        im.save(loresFilename, "PNG")
-        log.debug('%s: done!', header_msg)
-
-        return ('/user/images/%s_lores.jpg' % localId,
-                '/user/images/%s_hires.jpg' % localId)
-
     @cachedmethod
-    def getSeriesPoster(self, tvdbID):
-        """Return the low- and high-resolution posters of a tvdb object."""
-        noposter = '/static/images/noposter.png'
-
-        urls = self.tvdb.get_show_image_choices(tvdbID)
+    def getSeriesPosterUrl(self, tvdbID):
+        """Return the url of the poster of a tvdb object, or None if it has none."""
+        if self.mirror is not None:
+            url = self.mirror.seriesPoster(tvdbID)
+            if url is not None:
+                return url or None
+
+        with timed('tvdb.getSeriesPoster'):
+            urls = self.tvdb.get_show_image_choices(tvdbID)
         posters = [url for url in urls if url[1] == 'poster']
-        if posters:
-            return self.savePoster(posters[0][0], 'series_%s' % tvdbID)
+        url = posters[0][0] if posters else None
+        if self.mirror is not None:
+            self.mirror.storeSeriesPoster(tvdbID, url)
 
-        else:
+        if url is None:
             log.warning('Could not find poster for tvdb ID %s' % tvdbID)
-            return (noposter, noposter)
+        return url
 
 
     @cachedmethod
-    def getMoviePoster(self, movieId):
-        """Return the low- and high-resolution posters (if available) of an tvdb object."""
-        noposter = '/static/images/noposter.png'
-        resp = self.tmdb.Movies(movieId).info({'language': self.tmdb.lang})
+    def getMoviePosterUrl(self, movieId):
+        """Return the url of the poster of a tmdb object, or None if it has none."""
+        resp = self.getMovieDetails(movieId)
         image_size = 'original'
-        image_base = self.tmdb.server_config.images['base_url'] + '/' + image_size + '/'
-        
-        if resp['poster_path']:
-            return self.savePoster(image_base + resp['poster_path'], 'movie_%s' % movieId)
+        image_base = self.getTMDBConfig()['images']['base_url'] + '/' + image_size + '/'
 
-        else:
-            log.warning('Could not find poster for tmdb ID %s' % movieId)
-            return (noposter, noposter)
+        posterPath = resp.get('poster_path')
+        if not posterPath:
+            # no poster in the main language, take the first one available
+            posters = resp.get('images', {}).get('posters')
+            posterPath = posters[0]['file_path'] if posters else None
 
+        if posterPath:
+            return image_base + posterPath
 
+        log.warning('Could not find poster for tmdb ID %s' % movieId)
+        return None
 
-    def startEpisode(self, episode):
-        self.tmdb.lang = guiLanguage().alpha2
 
+
+    def startEpisode(self, episode):
         if episode.get('series') is None:
             raise SmewtException("TVDBMetadataProvider: Episode doesn't contain 'series' field: %s", episode)
 
-        name = episode.series.title
+        return self.startSeries(episode.series.title, tolist(episode.get('language', [])))
+
+    def startSeries(self, name, languages = []):
+        """Return a graph containing the series with the given name and all its episodes,
+        languages being the ones in which the series might have been found."""
+        series = self.findSeriesId(name, languages)
+
+        # TODO: at the moment, overwrite the detected language with the one
+        #       from the settings. It would be better to use the detected
+        #       language if it was more reliable (see TODO in findSeriesId)...
+        language = guiLanguage().alpha2
+
+        eps = self.getEpisodes(series, language)
+        if self.seriesIndex is not None:
+            self.seriesIndex.add(series, eps.find_one(Series).title)
+
+        try:
+            # the poster is downloaded in the background, the series shows a
+            # placeholder until then
+            posters.requestPoster(eps.find_one(Series), self.getSeriesPosterUrl(series))
+            return eps
+
+        except Exception, e:
+            log.warning(str(e) + ' -- ' + str(textutils.toUtf8(name)))
+            return MemoryObjectGraph()
+
+    def findSeriesId(self, name, languages = []):
+        """Return the TVDB id of the series that best matches the given name."""
         name = name.replace(',', ' ')
 
-        matching_series = self.getSeries(name)
+        if self.seriesIndex is not None:
+            known = self.seriesIndex.find(name)
+            if known is not None:
+                return str(known)
+
+        # copy it, the cached list is shared between threads
+        matching_series = list(self.getSeries(name))
 
         # Try first with the languages from guessit, and then with english
-        languages = tolist(episode.get('language', [])) + ['en']
+        languages = list(languages) + ['en']
 
         # Sort the series by id (stupid heuristic about most popular series
         #                        might have been added sooner to the db and the db id
@@ -201,7 +384,9 @@ class TVDBMetadataProvider(object):
         # TODO: we should do something smarter like comparing series name distance,
         #       episodes count and/or episodes names
         #print '\n'.join(['%s %s --> %f [%s] %s' % (x[1], name, textutils.levenshtein(x[1], name), x[2], x[0]) for x in matching_series])
-        matching_series.sort(key=lambda x: (textutils.levenshtein(x[1], name), int(x[0])))
+        titles = [ x[1] for x in matching_series ]
+        distance = dict(zip(titles, textutils.editDistances(name, titles)))
+        matching_series.sort(key=lambda x: (distance[x[1]], int(x[0])))
 
         series = None
         language = 'en'
@@ -215,34 +400,35 @@ class TVDBMetadataProvider(object):
                 language = matching_series[0][2]
                 series = matching_series[0][0]
 
-        # TODO: at the moment, overwrite the detected language with the one
-        #       from the settings. It would be better to use the detected
-        #       language if it was more reliable (see previous TODO)...
-        language = guiLanguage().alpha2
+        if self.mirror is not None and series is not None:
+            self.mirror.addSeriesName(name, series)
+        if self.seriesIndex is not None and series is not None:
+            self.seriesIndex.addAlias(name, series)
 
-        eps = self.getEpisodes(series, language)
+        return series
 
-        try:
-            lores, hires = self.getSeriesPoster(series)
-            eps.find_one(Series).update({ 'loresImage': lores,
-                                          'hiresImage': hires })
-            return eps
+    def refreshEpisodes(self, series, language = None):
+        """Same as getEpisodes, but always fetch the episodes again instead of
+        using the cached ones (and update the cache with them)."""
+        language = language or guiLanguage().alpha2
+        title, episodes = self.fetchEpisodes(series, language)
+        result = self.episodesGraph(series, title, episodes)
+        store_cached_value(self._getEpisodes, (unicode(series), language), result, cls = self.__class__)
+        return result
 
-        except Exception, e:
-            log.warning(str(e) + ' -- ' + str(textutils.toUtf8(episode)))
-            return MemoryObjectGraph()
+    def getUpdatedSeries(self, period):
+        """Return the set of TVDB ids of the series that have been updated during the
+        last period, which can be 'day', 'week' or 'month'."""
+        with timed('tvdb.getUpdatedSeries'):
+            return set(int(sid) for sid in self.tvdb.get_updated_shows(period))
 
     def startMovie(self, movieName):
-        self.tmdb.lang = guiLanguage().alpha2
-
         try:
             movieTvdb = self.getMovie(movieName)
             result = self.getMovieData(movieTvdb)
 
             movie = result.find_one('Movie')
-            lores, hires = self.getMoviePoster(movieTvdb)
-            movie.loresImage = lores
-            movie.hiresImage = hires
+            posters.requestPoster(movie, self.getMoviePosterUrl(movieTvdb))
 
             #result.display_graph()
             return result
@@ -25,6 +25,7 @@ import smewt.config
 import sys
 import os
 from pyramid.config import Configurator
+from pyramid.events import NewResponse
 
 # bit of a hack, but solves a lot of unicode issues which we won't have anyway
 # once we switch to python3, so there...
@@ -32,6 +33,14 @@ reload(sys)
 sys.setdefaultencoding('utf-8')
 
 
+POSTERS_MAX_AGE = 365 * 24 * 3600
+
+def immutablePosters(event):
+    if (event.request.path.startswith('/user/posters/') and
+        event.response.status_int == 200):
+        event.response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % POSTERS_MAX_AGE
+
+
 def main():
     """ This function returns a Pyramid WSGI application."""
     settings = { 'pyramid.reload_templates': smewt.config.RELOAD_MAKO_TEMPLATES,
@@ -49,6 +58,11 @@ def main():
 
     config = Configurator(settings=settings)
     config.add_static_view('static', 'smewt:static', cache_max_age=3600)
+    # posters never change once written (see smewt.base.posters.PosterStore), this
+    # needs to come before the 'user' view so that it takes precedence
+    config.add_static_view('user/posters', os.path.join(smewt.dirs.user_data_dir, 'posters'),
+                           cache_max_age=POSTERS_MAX_AGE)
+    config.add_subscriber(immutablePosters, NewResponse)
     config.add_static_view('user', smewt.dirs.user_data_dir, cache_max_age=3600)
 
     config.add_route('home', '/')
@@ -73,6 +87,7 @@ def main():
 
     config.add_route('action', '/action/{action}')
     config.add_route('info', '/info/{name}')
+    config.add_route('img', '/img/{id:[0-9a-f]+}/{width:\d+}x{height:\d+}')
 
     config.add_route('preferences', '/preferences')
     config.add_route('controlpanel', '/controlpanel')
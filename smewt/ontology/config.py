@@ -68,7 +68,8 @@ class Config(BaseObject):
                'incomingFolder': unicode,
                'subtitleLanguage': unicode,
                'collections': CollectionSettings,
-               'feeds': Feed
+               'feeds': Feed,
+               'lastMetadataRefresh': float
                }
     valid = []
     reverse_lookup = { 'feeds': 'config',
@@ -20,6 +20,7 @@
 #
 
 from pygoo import BaseObject, MemoryObjectGraph, Equal
+from smewt.base.pipelinestats import timed
 from guessit.patterns import video_exts, subtitle_exts
 
 
@@ -88,26 +89,27 @@ def foundMetadata(query, result, link = True):
     WARNING: this functions messes with the data in the query graph, do not reuse it after
     calling this function.
     """
-    # TODO: check that result is valid
-    solved = MemoryObjectGraph()
+    with timed('foundMetadata'):
+        # TODO: check that result is valid
+        solved = MemoryObjectGraph()
 
-    # remove the stale 'matches' link before adding the media to the resulting graph
-    #query.display_graph()
-    media = query.find_one(Media)
-    media.matches = []
-    media.metadata = []
-    m = solved.add_object(media)
+        # remove the stale 'matches' link before adding the media to the resulting graph
+        #query.display_graph()
+        media = query.find_one(Media)
+        media.matches = []
+        media.metadata = []
+        m = solved.add_object(media)
 
-    if result is None:
-        return solved
+        if result is None:
+            return solved
 
-    if isinstance(result, list):
-        result = [ solved.add_object(n, recurse = Equal.OnLiterals) for n in result ]
-    else:
-        result = solved.add_object(result, recurse = Equal.OnLiterals)
+        if isinstance(result, list):
+            result = [ solved.add_object(n, recurse = Equal.OnLiterals) for n in result ]
+        else:
+            result = solved.add_object(result, recurse = Equal.OnLiterals)
 
-    #solved.display_graph()
-    if link:
-        m.metadata = result
+        #solved.display_graph()
+        if link:
+            m.metadata = result
 
-    return solved
+        return solved
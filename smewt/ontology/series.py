@@ -27,6 +27,7 @@ class Series(Metadata):
     #typename = 'Series'
 
     schema = { 'title': unicode,
+               'tvdbId': int,
                #'numberSeasons': int,
                #'episodeList': list
                }
@@ -18,14 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from smewt.base import SmewtException, EventServer
+from smewt.base import SmewtException, EventServer, httpclient
 from smewt.base.taskmanager import FuncTask
 from smewt.base.utils import tolist
 from smewt.plugins.tvu import get_show_mapping
 from smewt.ontology import Feed
 from threading import Thread, Timer
 import feedparser
-import urllib2, re
+import re
 import logging
 
 log = logging.getLogger(__name__)
@@ -105,7 +105,7 @@ class FeedWatcher(object):
 
     def updateFeed(self, feed):
         try:
-            pfeed = feedparser.parse(feed['url'])
+            pfeed = feedparser.parse(httpclient.read(feed['url']))
             entries = [ { 'title': entry.title,
                           'updated': list(entry.updated_parsed) } for entry in pfeed.entries ]
 
@@ -154,7 +154,7 @@ class FeedWatcher(object):
         for ep in f.entries[::-1]:
             if list(ep.updated_parsed) > feed['lastUpdate']:
                 EventServer.publish('Found new episode: %s' % ep.title)
-                episodeHtml = urllib2.urlopen(ep.id).read()
+                episodeHtml = httpclient.read(ep.id)
                 ed2kLink = self._ed2kRexp.search(episodeHtml).groups()[0]
                 EventServer.publish('Sending link %s to %s...' %
                                     (ed2kLink, DOWNLOAD_AGENT))
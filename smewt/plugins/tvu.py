@@ -21,7 +21,7 @@
 from bs4 import BeautifulSoup
 from guessit.textutils import clean_string
 from smewt.base.cache import cachedfunc, has_cached_func_value
-import requests
+from smewt.base import httpclient
 import json
 import os.path
 import logging
@@ -42,7 +42,7 @@ def clean_eptitle(title):
 def get_showlist_for_letter(l):
     log.info('Looking for shows starting with letter: %s' % l)
     url = 'http://tvu.org.ru/index.php?show=show&bst=%s' % l
-    r = requests.get(url)
+    r = httpclient.get(url)
     # force utf-8 coding, as it seems it doesn't detect it correctly
     r.encoding = 'utf-8'
     bs = BeautifulSoup(r.text)
@@ -59,7 +59,6 @@ def get_showlist_for_letter(l):
     return shows
 
 def get_show_mapping(only_cached=False):
-    # FIXME: use a session to share the connections between all the requests
     shows = []
     for l in [ 'num' ] + list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
         if only_cached:
@@ -74,7 +73,7 @@ def get_show_mapping(only_cached=False):
 @cachedfunc
 def get_seasons_for_showid(sid, title=None):
     url = 'http://tvu.org.ru/index.php?show=season&sid=%s' % sid
-    r = requests.get(url)
+    r = httpclient.get(url)
     r.encoding = 'utf-8'
 
     feeds = []
@@ -21,7 +21,7 @@
 from smewt.base import SmewtException
 from smewt.ontology import Media, Metadata
 from smewt.solvers.solver import Solver
-from smewt.base.textutils import levenshtein
+from smewt.base.textutils import editDistance
 import logging
 
 log = logging.getLogger(__name__)
@@ -44,7 +44,7 @@ def fuzzyMatch2(baseGuess, md):
     for p1, p2 in zip(baseGuess.unique_key(), md.unique_key()):
         if type(p1) == str or type(p1) == unicode:
             # TODO: levenshtein doesn't cut it here, we need a better string distance
-            if levenshtein(p1.lower(), p2.lower()) > 80:
+            if editDistance(p1.lower(), p2.lower(), 80) > 80:
                 return False
         elif isinstance(p1, Metadata):
             if not fuzzyMatch2(p1, p2):
@@ -55,6 +55,75 @@ def fuzzyMatch2(baseGuess, md):
     return True
 
 
+# stands for the strings in the match keys, which fuzzyMatch2 compares with a distance
+_STRING = object()
+
+def matchKey(md):
+    """Return (key, strings) for the given metadata, where key contains the components
+    of its unique key (recursively for the Metadata ones) that fuzzyMatch2 compares
+    exactly, with a placeholder for the strings, which are returned lowercased in strings.
+
+    Two metadata objects can only match according to fuzzyMatch2 if they have the same
+    key, and their strings are close enough."""
+    key, strings = [], []
+    for p in md.unique_key():
+        if type(p) == str or type(p) == unicode:
+            key.append(_STRING)
+            strings.append(p.lower())
+        elif isinstance(p, Metadata):
+            subkey, substrings = matchKey(p)
+            key.append(subkey)
+            strings.extend(substrings)
+        else:
+            key.append(p)
+    return tuple(key), strings
+
+
+class MatchIndex(object):
+    """Index of metadata objects bucketed by their match key (see matchKey), so that
+    the strings only need to be compared with the candidates of a single bucket, and
+    each distinct string only once."""
+
+    def __init__(self, metadata):
+        self.buckets = {}
+        for i, md in enumerate(metadata):
+            key, strings = matchKey(md)
+            try:
+                self.buckets.setdefault(key, []).append((i, md, strings))
+            except TypeError:
+                # unhashable component, can only be compared the slow way
+                self.buckets.setdefault(None, []).append((i, md, None))
+
+    def matches(self, baseGuess):
+        """Return the indexed metadata that fuzzy-match the given one (as fuzzyMatch2
+        would), in the order they were given."""
+        key, baseStrings = matchKey(baseGuess)
+        try:
+            candidates = list(self.buckets.get(key, []))
+        except TypeError:
+            candidates = []
+        # an unhashable key could still be equal to one of these
+        candidates += self.buckets.get(None, [])
+        candidates.sort(key = lambda c: c[0])
+
+        # TODO: levenshtein doesn't cut it here, we need a better string distance
+        close = {}
+        def isClose(s1, s2):
+            if (s1, s2) not in close:
+                close[(s1, s2)] = editDistance(s1, s2, 80) <= 80
+            return close[(s1, s2)]
+
+        result = []
+        for _, md, strings in candidates:
+            if strings is None:
+                if fuzzyMatch2(baseGuess, md):
+                    result.append(md)
+            elif all(isClose(s1, s2) for s1, s2 in zip(baseStrings, strings)):
+                result.append(md)
+
+        return result
+
+
 class SimpleSolver(Solver):
     '''This solver implements this simple solving strategy:
     - first find the metadata which represents a unique object with
@@ -89,13 +158,9 @@ class SimpleSolver(Solver):
             #return self.found(query, None)
 
         # 2- once we have it, merge data from other nodes that look like him
-        for md in metadata:
-            # do not inadvertently overwrite some data we could have found from another instance
-            if md is baseGuess:
-                continue
-
-            # if there is a match, merge the data
-            if fuzzyMatch2(baseGuess, md):
-                baseGuess.update(dict(md.items()))
+        # do not inadvertently overwrite some data we could have found from another instance
+        index = MatchIndex(md for md in metadata if md is not baseGuess)
+        for md in index.matches(baseGuess):
+            baseGuess.update(dict(md.items()))
 
         return self.found(query, baseGuess)
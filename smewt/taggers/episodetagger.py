@@ -20,11 +20,14 @@
 #
 
 from __future__ import unicode_literals
-from smewt.base import SolvingChain, utils
-from smewt.base.textutils import u
+from smewt.base import SolvingChain, SmewtException, utils
+from smewt.base.textutils import u, normalizeTitle
+from smewt.base.utils import tolist
 from smewt.ontology import Media, Episode
 from smewt.taggers.tagger import Tagger
-from smewt.guessers import EpisodeFilename, EpisodeTVDB
+from smewt.guessers import EpisodeFilename, EpisodeTVDB, guessitpool
+from smewt.guessers.episodetvdb import EpisodeIndex
+from smewt.guessers.tvdbmetadataprovider import TVDBMetadataProvider
 from smewt.solvers import SimpleSolver
 import logging
 
@@ -32,14 +35,64 @@ log = logging.getLogger(__name__)
 
 class EpisodeTagger(Tagger):
 
+    @classmethod
+    def prefetch(cls, filenames):
+        guessitpool.prefetch('episode', filenames)
+
+    @classmethod
+    def newMetadataProvider(cls):
+        return TVDBMetadataProvider.instance()
+
+    def __init__(self, mdprovider = None, online = True):
+        super(EpisodeTagger, self).__init__(mdprovider, online)
+        self.filenameResults = {}
+        self.seriesResults = {}
+
+    def guessFilename(self, query):
+        filename = query.find_one(Media).filename
+        if filename in self.filenameResults:
+            return self.filenameResults.pop(filename)
+        return SolvingChain(EpisodeFilename()).solve(query)
+
+    def prepare(self, queries):
+        # guess all the files first and group them by series, so that each series
+        # only needs to be looked up once online, whatever the number of episodes
+        groups = {}
+        for query in queries:
+            filenameMetadata = self.guessFilename(query)
+            self.filenameResults[query.find_one(Media).filename] = filenameMetadata
+
+            ep = filenameMetadata.find_one(Episode)
+            if ep is not None and ep.get('series') is not None:
+                groups.setdefault(normalizeTitle(ep.series.title), []).append(ep)
+
+        if not self.online:
+            return
+
+        mdprovider = self.mdprovider or self.newMetadataProvider()
+        for name, episodes in groups.items():
+            log.info('EpisodeTagger looking up series %s for %d episodes', name, len(episodes))
+            try:
+                result = mdprovider.startSeries(episodes[0].series.title,
+                                                tolist(episodes[0].get('language', [])))
+                self.seriesResults[name] = EpisodeIndex(result)
+            except SmewtException, e:
+                self.seriesResults[name] = e
+
     def perform(self, query):
         log.info('EpisodeTagger tagging episode: %s', u(query.find_one(Media).filename))
-        filenameMetadata = SolvingChain(EpisodeFilename()).solve(query)
+        filenameMetadata = self.guessFilename(query)
 
         log.info('EpisodeTagger found info: %s', u(filenameMetadata.find_one(Episode)))
-        result = SolvingChain(EpisodeTVDB(), SimpleSolver(Episode)).solve(filenameMetadata)
+        if self.online:
+            result = SolvingChain(EpisodeTVDB(self.mdprovider, self.seriesResults),
+                                  SimpleSolver(Episode)).solve(filenameMetadata)
+        else:
+            result = filenameMetadata
 
         media = result.find_one(Media)
+        if not self.online:
+            self.setDefaultPoster(media.metadata.series)
 
         # if we didn't find a valid episode but we still have a series, let's create a syntactically
         # valid episode anyway so it can be imported
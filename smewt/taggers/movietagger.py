@@ -19,27 +19,42 @@
 #
 
 from __future__ import unicode_literals
-from smewt.base import utils
+from smewt.base import SolvingChain, utils
 from smewt.base.textutils import u
 from smewt.ontology import Media, Movie
 from smewt.taggers.tagger import Tagger
-from smewt.guessers import MovieFilename, MovieTMDB
+from smewt.guessers import MovieFilename, MovieTMDB, guessitpool
+from smewt.guessers.tvdbmetadataprovider import TVDBMetadataProvider
 import logging
 
 log = logging.getLogger(__name__)
 
 class MovieTagger(Tagger):
+
+    @classmethod
+    def prefetch(cls, filenames):
+        guessitpool.prefetch('movie', filenames)
+
+    @classmethod
+    def newMetadataProvider(cls):
+        return TVDBMetadataProvider.instance()
+
     def perform(self, query):
         filename = u(query.find_one(Media).filename)
         log.info('MovieTagger tagging movie: %s' % filename)
-        filenameMetadata = MovieFilename().perform(query)
+        filenameMetadata = SolvingChain(MovieFilename()).solve(query)
         filenameMovie = filenameMetadata.find_one(Movie)
         log.info('MovieTagger found info: %s' % u(filenameMovie))
-        result = MovieTMDB().perform(filenameMetadata)
+        if self.online:
+            result = SolvingChain(MovieTMDB(self.mdprovider)).solve(filenameMetadata)
+        else:
+            result = filenameMetadata
 
         media = result.find_one(Media)
         if not media.metadata:
             log.warning('Could not find any tag for: %s' % u(media))
+        elif not self.online:
+            self.setDefaultPoster(media.metadata)
 
         # import the info we got from the filename if nothing better came in with MovieTMDB
         for prop in filenameMovie.keys():
@@ -22,8 +22,38 @@
 from smewt.ontology import Media, Metadata
 
 class Tagger(object):
-    def __init__(self):
+    noposter = '/static/images/noposter.png'
+
+    def __init__(self, mdprovider = None, online = True):
         super(Tagger, self).__init__()
+        # the online metadata provider used for tagging, None creates one when needed
+        self.mdprovider = mdprovider
+        # whether to look up the metadata online, or only use what can be guessed locally
+        self.online = online
+
+    @classmethod
+    def newMetadataProvider(cls):
+        """Return a metadata provider that can be shared by several instances
+        of this tagger, or None if it doesn't use any."""
+        return None
+
+    @classmethod
+    def prefetch(cls, filenames):
+        """Start the CPU-intensive work needed to tag the given files in the background.
+        This is just a hint, and does nothing by default."""
+        pass
+
+    def prepare(self, queries):
+        """Called with all the queries of a batch before performing them one by one,
+        so that the work they have in common can be done only once.
+        Does nothing by default."""
+        pass
+
+    def setDefaultPoster(self, md):
+        """Give a placeholder poster to metadata which doesn't have one yet."""
+        for prop in ('loresImage', 'hiresImage'):
+            if not md.get(prop):
+                md.set(prop, self.noposter)
 
     def cleanup(self, result):
         for o in result.find_all(Media):
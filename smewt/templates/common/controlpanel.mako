@@ -47,6 +47,8 @@ $('#paneltabs a:first').tab('show');
   Maintenance
   <div class="btn" onclick="window.open('/user/Smewt.log');">show log</div>
   <div class="btn" onclick="action('clear_cache');">clear cache</div>
+  <div class="btn" onclick="action('purge_negative_cache');">retry failed lookups</div>
+  <div class="btn" onclick="action('refresh_metadata');">refresh series information</div>
   <!-- <div class="btn" onclick="action('regenerate_thumbnails');">regenerate speed dial thumbnails</div> -->
 
 </div>
@@ -2,13 +2,14 @@
 
 <%!
 from smewt.base.utils import SDict
+from smewt.base.posters import posterImage
 import urllib
 %>
 
 <%
 movies = sorted([ SDict(title = m.title,
                         url = '/movie/%s' % self.attr.Q(m.title),
-                        poster = m.loresImage)
+                        poster = posterImage(m, 60, 90))
                   for m in context['movies'] ],
                 key = lambda x: x.title)
 %>
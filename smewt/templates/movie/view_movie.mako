@@ -5,6 +5,7 @@ from collections import defaultdict
 from smewt.ontology import Movie
 from smewt.base.utils import tolist
 from smewt.base import SmewtException
+from smewt.base.posters import posterImage
 import os
 import urllib
 
@@ -48,7 +49,7 @@ ${parent.make_lang_selector(context['smewtd'])}
 <div class="container-fluid">
   <div class="row-fluid">
     <div class="span2">
-      <img src="${movie.hiresImage}" height="250px;" width="auto"/>
+      <img src="${posterImage(movie, 170, 250)}" height="250px;" width="auto"/>
     </div>
 %if movie.title != 'Unknown':
     <div class="span10">
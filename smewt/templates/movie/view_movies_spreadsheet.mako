@@ -3,6 +3,7 @@
 
 <%!
 from smewt.base.utils import SDict
+from smewt.base.posters import posterImage
 
 dataTables = '/static/js/DataTables-1.9.2/media'
 %>
@@ -16,7 +17,7 @@ movies = sorted([ SDict({ 'title': m.title,
                     'genres': ', '.join(m.get('genres') or []) or '-',
                     'watched': 'checked' if m.get('watched') else '',
                     'url': '/movie/' + self.attr.Q(m.title),
-                    'poster': m.loresImage })
+                    'poster': posterImage(m, 60, 90) })
                     for m in allmovies ],
                     key = lambda x: x['title'])
 
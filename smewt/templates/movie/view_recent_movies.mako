@@ -2,6 +2,7 @@
 
 <%!
 from smewt.base.utils import tolist, SDict
+from smewt.base.posters import posterImage
 import datetime
 
 def lastViewedString(m):
@@ -25,7 +26,7 @@ movies = sorted([ SDict({ 'title': m.title,
                           'movie': m,
                           'lastViewed': m.lastViewed,
                           'url': '/movie/' + m.title,
-                          'poster': m.loresImage })
+                          'poster': posterImage(m, 60, 90) })
                   for m in context['movies'] ],
                 key = lambda x: -x['lastViewed'])
 
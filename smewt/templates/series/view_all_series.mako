@@ -2,12 +2,13 @@
 
 <%!
 from smewt.base.utils import SDict
+from smewt.base.posters import posterImage
 %>
 
 <%
 series = sorted([ SDict(title = s.title,
                         url = '/series/%s' % self.attr.Q(s.title),
-                        poster = s.loresImage)
+                        poster = posterImage(s, 60, 90))
                   for s in context['series'] ],
                 key = lambda x: x.title)
 %>
@@ -2,6 +2,7 @@
 
 <%!
 from smewt.base.utils import tolist
+from smewt.base.posters import posterImage
 from itertools import groupby
 import datetime
 %>
@@ -51,7 +52,7 @@ suggest = sorted(suggest.items(), key = lambda eps: -tolist(eps[1][0].files)[0].
             <div class="row-fluid"><div class="span12">
             <%
               url = '/series/' + self.attr.Q(s.title)
-              poster = s.get('loresImage')
+              poster = posterImage(s, 60, 90)
             %>
             ${parent.make_title_box(poster, s.title, url)}
             </div></div>
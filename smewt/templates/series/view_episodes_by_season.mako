@@ -5,6 +5,7 @@ from collections import defaultdict
 from smewt.ontology import Episode, Series, Subtitle
 from smewt.base.utils import tolist, SDict
 from smewt.base import SmewtException
+from smewt.base.posters import posterImage
 from guessit.language import ALL_LANGUAGES
 import os.path
 import guessit
@@ -14,7 +15,7 @@ import guessit
 <%
 series = context['series']
 
-poster = series.get('hiresImage')
+poster = posterImage(series, 90, 130)
 
 # First prepare the episodes, grouping them by season
 episodes = defaultdict(list)
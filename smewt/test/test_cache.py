@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base import cache, SmewtException
+import time
+
+
+class Lookup(object):
+    def __init__(self):
+        self.calls = 0
+
+    @cache.cachedlookup
+    def find(self, name):
+        self.calls += 1
+        if name == 'unknown':
+            raise SmewtException('Could not find %s' % name)
+        return name.upper()
+
+    @cache.cachedmethod
+    def get(self, name):
+        self.calls += 1
+        if name == 'unknown':
+            raise SmewtException('Could not get %s' % name)
+        return name.upper()
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.globalCache = cache.globalCache
+        self.negativeTTL = cache.negativeTTL
+        cache.globalCache = {}
+
+    def tearDown(self):
+        cache.globalCache = self.globalCache
+        cache.negativeTTL = self.negativeTTL
+
+    def testNegativeCache(self):
+        lookup = Lookup()
+        self.assertEqual(lookup.find('monk'), 'MONK')
+        self.assertEqual(lookup.find('monk'), 'MONK')
+        self.assertEqual(lookup.calls, 1)
+
+        # failures are remembered as well
+        self.assertRaises(SmewtException, lookup.find, 'unknown')
+        self.assertRaises(SmewtException, lookup.find, 'unknown')
+        self.assertEqual(lookup.calls, 2)
+
+        # until they expire...
+        cache.negativeTTL = 0
+        time.sleep(0.01)
+        self.assertRaises(SmewtException, lookup.find, 'unknown')
+        self.assertEqual(lookup.calls, 3)
+
+        # ...or get purged
+        cache.negativeTTL = 3600
+        self.assertRaises(SmewtException, lookup.find, 'unknown')
+        self.assertEqual(lookup.calls, 3)
+        self.assertEqual(cache.purgeNegative(), 1)
+        self.assertRaises(SmewtException, lookup.find, 'unknown')
+        self.assertEqual(lookup.calls, 4)
+
+        # successful lookups are not purged
+        self.assertEqual(lookup.find('monk'), 'MONK')
+        self.assertEqual(lookup.calls, 4)
+
+    def testCachedMethod(self):
+        lookup = Lookup()
+        self.assertEqual(lookup.get('monk'), 'MONK')
+        self.assertEqual(Lookup().get('monk'), 'MONK')
+        self.assertEqual(lookup.calls, 1)
+
+        # failures are not remembered
+        self.assertRaises(SmewtException, lookup.get, 'unknown')
+        self.assertRaises(SmewtException, lookup.get, 'unknown')
+        self.assertEqual(lookup.calls, 3)
+
+
+suite = allTests(TestCache)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
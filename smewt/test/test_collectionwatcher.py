@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.collection import Collection
+from smewt.base.collectionwatcher import CollectionWatcher, Inotify, filesystemType, IN_Q_OVERFLOW
+import tempfile
+import shutil
+import time
+
+
+class WatchedCollection(object):
+    """Records what the watcher asks a collection to do."""
+
+    name = 'Test'
+
+    def __init__(self, folder):
+        self.folders = [ (folder, True) ]
+        self.imported = []
+        self.removed = []
+        self.known = []
+        self.updates = []
+
+    def isCollectionFile(self, filename):
+        return filename.endswith('.avi')
+
+    def collectionFiles(self, folders):
+        for folder, recursive in folders:
+            for root, dirs, files in os.walk(folder):
+                for f in files:
+                    if self.isCollectionFile(join(root, f)):
+                        yield join(root, f)
+
+    def knownFiles(self, folder):
+        return [ f for f in self.known if Collection.inFolder(f, folder, True) ]
+
+    def importFiles(self, files):
+        self.imported.extend(files)
+        self.known.extend(files)
+
+    def removeFiles(self, files):
+        self.removed.extend(files)
+
+    def update(self, folders = None):
+        self.updates.append(folders)
+
+
+class KnownCollection(Collection):
+    """A collection which has already imported the given files."""
+
+    def __init__(self, folders, known):
+        self.folders = folders
+        self.known = known
+
+    def knownFiles(self, folder):
+        return [ f for f in self.known if self.inFolder(f, folder, True) ]
+
+
+def touch(filename):
+    open(filename, 'w').close()
+
+
+class TestCollectionWatcher(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        try:
+            Inotify().close()
+            self.inotify = True
+        except OSError:
+            self.inotify = False
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def waitFor(self, condition, timeout = 5):
+        start = time.time()
+        while not condition() and time.time() - start < timeout:
+            time.sleep(0.05)
+
+    def testInFolder(self):
+        self.assertTrue(Collection.inFolder('/videos/a.avi', '/videos', False))
+        self.assertTrue(Collection.inFolder('/videos/x/a.avi', '/videos/', True))
+        self.assertFalse(Collection.inFolder('/videos/x/a.avi', '/videos', False))
+        self.assertFalse(Collection.inFolder('/videos2/a.avi', '/videos', True))
+
+    def testEvents(self):
+        if not self.inotify or filesystemType(self.tmpdir) is None:
+            return
+
+        collection = WatchedCollection(self.tmpdir)
+        watcher = CollectionWatcher([ collection ], debounce = 0.2, scanInterval = 0)
+        try:
+            touch(join(self.tmpdir, 'a.avi'))
+            touch(join(self.tmpdir, 'notes.txt'))
+            os.mkdir(join(self.tmpdir, 'Season 1'))
+            touch(join(self.tmpdir, 'Season 1', 'b.avi'))
+
+            self.waitFor(lambda: len(collection.imported) == 2)
+            self.assertEqual(sorted(collection.imported),
+                             [ join(self.tmpdir, 'Season 1', 'b.avi'), join(self.tmpdir, 'a.avi') ])
+
+            # moving a file is removing it and importing the new one
+            os.rename(join(self.tmpdir, 'a.avi'), join(self.tmpdir, 'c.avi'))
+            shutil.rmtree(join(self.tmpdir, 'Season 1'))
+
+            self.waitFor(lambda: len(collection.removed) == 2)
+            self.assertEqual(sorted(collection.removed),
+                             [ join(self.tmpdir, 'Season 1', 'b.avi'), join(self.tmpdir, 'a.avi') ])
+            self.assertEqual(collection.imported[-1], join(self.tmpdir, 'c.avi'))
+
+        finally:
+            watcher.quit()
+
+    def testScans(self):
+        collection = WatchedCollection(self.tmpdir)
+        watcher = CollectionWatcher([ collection ], debounce = 0.2, scanInterval = 0)
+        try:
+            # pretend we couldn't watch anything
+            watcher.unwatched = { collection: collection.folders }
+            watcher.scan()
+            self.assertEqual(collection.updates, [ collection.folders ])
+        finally:
+            watcher.quit()
+
+    def testOverflow(self):
+        collection = WatchedCollection(self.tmpdir)
+        watcher = CollectionWatcher([ collection ], debounce = 0.2, scanInterval = 0)
+        try:
+            # all the missed events only trigger one update
+            with watcher.lock:
+                for i in range(10):
+                    watcher._processEvent(-1, IN_Q_OVERFLOW, 0, '')
+                watcher._updateIfOverflowed()
+                watcher._updateIfOverflowed()
+            self.waitFor(lambda: not watcher.updating)
+            self.assertEqual(collection.updates, [ None ])
+        finally:
+            watcher.quit()
+
+    def testDeletedFiles(self):
+        os.mkdir(join(self.tmpdir, 'Season 1'))
+        touch(join(self.tmpdir, 'a.avi'))
+        known = [ join(self.tmpdir, 'a.avi'),
+                  join(self.tmpdir, 'b.avi'),
+                  join(self.tmpdir, 'Season 1', 'c.avi'),
+                  join(self.tmpdir + '-unmounted', 'd.avi') ]
+
+        collection = KnownCollection([ (self.tmpdir, True), (self.tmpdir + '-unmounted', True) ], known)
+        self.assertEqual(sorted(collection.deletedFiles()),
+                         [ join(self.tmpdir, 'Season 1', 'c.avi'), join(self.tmpdir, 'b.avi') ])
+
+        collection = KnownCollection([ (self.tmpdir, False) ], known)
+        self.assertEqual(list(collection.deletedFiles()), [ join(self.tmpdir, 'b.avi') ])
+
+
+suite = allTests(TestCollectionWatcher)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
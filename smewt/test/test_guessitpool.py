@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.guessers.guessitpool import GuessitPool, _guess
+import time
+
+
+FILENAMES = [ '/data/Series/Monk/Season 1/Monk.S01E0%d.avi' % i for i in range(1, 6) ]
+
+
+class TestGuessitPool(TestCase):
+
+    def setUp(self):
+        self.pool = GuessitPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testGuess(self):
+        self.pool.prefetch('episode', FILENAMES)
+        self.assertEqual(len(self.pool.results), 5)
+
+        for f in FILENAMES:
+            self.assertEqual(self.pool.guess('episode', f), _guess(('episode', f)))
+        self.assertEqual(self.pool.results, {})
+
+        # files that haven't been prefetched are guessed right away
+        self.assertEqual(self.pool.guess('movie', FILENAMES[0]), _guess(('movie', FILENAMES[0])))
+
+    def testBounded(self):
+        self.pool.maxResults = 3
+        self.pool.prefetch('episode', FILENAMES[:2])
+        self.pool.prefetch('episode', FILENAMES[2:])
+        self.assertEqual(sorted(f for kind, f in self.pool.results), FILENAMES[:3])
+
+        for f in FILENAMES:
+            self.assertEqual(self.pool.guess('episode', f), _guess(('episode', f)))
+        self.assertEqual(self.pool.results, {})
+
+    def testExpired(self):
+        self.pool.maxAge = 0.1
+        self.pool.prefetch('episode', FILENAMES[:2])
+        time.sleep(0.2)
+        self.pool.prefetch('episode', FILENAMES[2:])
+        self.assertEqual(sorted(f for kind, f in self.pool.results), FILENAMES[2:])
+
+        self.assertEqual(self.pool.guess('episode', FILENAMES[0]), _guess(('episode', FILENAMES[0])))
+
+
+suite = allTests(TestGuessitPool)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.httpcache import HttpCache, maxAge
+import tempfile
+import shutil
+import time
+
+
+class TestHttpCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = HttpCache(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testMaxAge(self):
+        self.assertEqual(maxAge({}), 0)
+        self.assertEqual(maxAge({ 'cache-control': 'public, max-age=3600' }), 3600)
+        self.assertEqual(maxAge({ 'cache-control': 'max-age=3600, no-cache' }), 0)
+        self.assertEqual(maxAge({ 'cache-control': 'no-store' }), None)
+
+    def testRevalidation(self):
+        url = 'http://thetvdb.com/api/series/1/all/en.xml'
+        self.assertEqual(self.cache.lookup(url), (None, None))
+        self.assertEqual(self.cache.conditionalHeaders(None), {})
+
+        # no max-age: can be stored, but needs to be revalidated right away
+        self.assertTrue(self.cache.store(url, { 'etag': '"abc"',
+                                                'last-modified': 'Mon, 01 Jul 2013 10:00:00 GMT' },
+                                         '<xml/>'))
+        info, body = self.cache.lookup(url)
+        self.assertEqual(body, '<xml/>')
+        self.assertFalse(self.cache.isFresh(info))
+        self.assertEqual(self.cache.conditionalHeaders(info),
+                         { 'If-None-Match': '"abc"',
+                           'If-Modified-Since': 'Mon, 01 Jul 2013 10:00:00 GMT' })
+
+        # the server answered 304 with a new max-age
+        self.cache.refresh(url, info, { 'cache-control': 'max-age=60', 'etag': '"def"' })
+        info, body = self.cache.lookup(url)
+        self.assertEqual(body, '<xml/>')
+        self.assertTrue(self.cache.isFresh(info))
+        self.assertEqual(info['etag'], '"def"')
+
+    def testNoStore(self):
+        url = 'http://api.themoviedb.org/3/configuration'
+        self.assertFalse(self.cache.store(url, { 'cache-control': 'no-store' }, '{}'))
+        self.assertEqual(self.cache.lookup(url), (None, None))
+
+        self.cache.store(url, { 'cache-control': 'max-age=60' }, '{}')
+        self.cache.clear()
+        self.assertEqual(self.cache.lookup(url), (None, None))
+
+    def testStoreStream(self):
+        url = 'http://thetvdb.com/api/series/1/all/en.xml'
+        headers = { 'cache-control': 'max-age=60' }
+
+        # only stored once it has been read until its end
+        chunks = self.cache.storeStream(url, headers, iter([ '<xml>', '</xml>' ]))
+        self.assertEqual(next(chunks), '<xml>')
+        chunks.close()
+        self.assertEqual(self.cache.lookup(url), (None, None))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+        chunks = self.cache.storeStream(url, headers, iter([ '<xml>', '</xml>' ]))
+        self.assertEqual(''.join(chunks), '<xml></xml>')
+        self.assertTrue(self.cache.isFresh(self.cache.lookupInfo(url)))
+        self.assertEqual(self.cache.openBody(url).read(), '<xml></xml>')
+
+
+suite = allTests(TestHttpCache)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
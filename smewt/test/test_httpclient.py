@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.httpclient import HttpClient
+import requests
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content = ''):
+        self.status_code = status_code
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError('%d error' % self.status_code)
+
+
+class FakeSession(object):
+    """Answers the requests with the given responses, or raises them if they are
+    exceptions, in order."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class TestHttpClient(TestCase):
+
+    def client(self, *answers):
+        client = HttpClient(retries = 2)
+        client.retryDelay = 0
+        client.session = FakeSession(*answers)
+        return client
+
+    def testRetryableErrors(self):
+        client = self.client(requests.exceptions.ConnectionError('connection refused'),
+                             FakeResponse(503),
+                             FakeResponse(200, 'ok'))
+        self.assertEqual(client.read('http://example.com/'), 'ok')
+        self.assertEqual(len(client.session.requests), 3)
+
+        client = self.client(requests.exceptions.Timeout('timed out'),
+                             FakeResponse(200, 'ok'))
+        self.assertEqual(client.read('http://example.com/'), 'ok')
+        self.assertEqual(len(client.session.requests), 2)
+
+    def testNonRetryableErrors(self):
+        # client errors are the final answer
+        client = self.client(FakeResponse(404), FakeResponse(403))
+        self.assertEqual(client.get('http://example.com/').status_code, 404)
+        self.assertRaises(requests.exceptions.HTTPError, client.read, 'http://example.com/')
+        self.assertEqual(len(client.session.requests), 2)
+
+        # and so are the errors that have nothing to do with the network
+        client = self.client(ValueError('invalid url'), FakeResponse(200, 'ok'))
+        self.assertRaises(ValueError, client.get, 'http://example.com/')
+        self.assertEqual(len(client.session.requests), 1)
+
+    def testExhaustedRetries(self):
+        client = self.client(FakeResponse(500), FakeResponse(502), FakeResponse(503))
+        self.assertEqual(client.get('http://example.com/').status_code, 503)
+        self.assertEqual(len(client.session.requests), 3)
+
+        client = self.client(*[ requests.exceptions.ConnectionError('connection refused') ] * 3)
+        self.assertRaises(requests.exceptions.ConnectionError, client.get, 'http://example.com/')
+        self.assertEqual(len(client.session.requests), 3)
+
+
+suite = allTests(TestHttpClient)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -20,8 +20,14 @@
 
 from smewttest import *
 from smewt.base import TaskManager, SmewtDaemon
-from smewt.base.importtask import ImportTask
+from smewt.base import posters
+from smewt.base.importtask import ImportTask, EnrichTask
+from smewt.base.posters import PosterPipeline, PosterStore
+from smewt.ontology import Media, Movie
 from smewt.taggers import *
+import tempfile
+import hashlib
+import shutil
 import glob
 
 
@@ -75,6 +81,75 @@ class TestImportTask(TestCase):
 
         self.collectionTest(database)
 
+    def setUpPosters(self, url):
+        # a poster store which already has the poster at the given url
+        self.tmpdir = tempfile.mkdtemp()
+        store = PosterStore(join(self.tmpdir, 'posters'), '/user/posters')
+        h = hashlib.sha1('poster').hexdigest()
+        for variant in PosterStore.variants:
+            open(store.filename(h, variant), 'wb').write('resized')
+        store.index[url] = h
+        pipeline = PosterPipeline(store, downloads = 1)
+        posters.setPipeline(pipeline)
+        return store.url(h, 'list'), store.url(h, 'detail')
+
+    def tearDownPosters(self):
+        posters.pipeline().quit()
+        posters.setPipeline(None)
+        shutil.rmtree(self.tmpdir)
+
+    def testEnrichEpisode(self):
+        database = MemoryObjectGraph()
+        filename = u'/data/Monk/Monk.2x05.Mr.Monk.And.The.Very,.Very.Old.Man.DVDRip.XviD-MEDiEVAL.[tvu.org.ru].avi'
+        ImportTask(database, EpisodeTagger, filename, online = False).perform()
+        ep = database.find_one(Media, filename = filename).metadata
+        self.assertEqual(ep.series.get('tvdbId'), None)
+        ep.watched = True
+        nodes = len(list(database.nodes()))
+
+        posterUrl = u'http://thetvdb.com/banners/posters/78490-1.jpg'
+        images = self.setUpPosters(posterUrl)
+        try:
+            online = MemoryObjectGraph()
+            series = online.Series(title = ep.series.title, tvdbId = 78490, posterUrl = posterUrl)
+            episode = online.Episode(series = series, season = 2, episodeNumber = 5,
+                                     title = u'Mr. Monk and the Very, Very Old Man')
+            EnrichTask.merge(database, online.Media(filename = filename, metadata = episode))
+
+            # the existing nodes have been upgraded with the online information
+            ep = database.find_one(Media, filename = filename).metadata
+            self.assertEqual(ep.title, u'Mr. Monk and the Very, Very Old Man')
+            self.assertEqual(ep.series.tvdbId, 78490)
+            self.assertEqual((ep.series.loresImage, ep.series.hiresImage), images)
+            self.assertEqual(ep.watched, True)
+            self.assertEqual(len(list(database.nodes())), nodes)
+        finally:
+            self.tearDownPosters()
+
+    def testEnrichMovie(self):
+        database = MemoryObjectGraph()
+        filename = u'/data/Movies/Dark.City.DC.BDRip.720p.DTS.X264-CHD.mkv'
+        ImportTask(database, MovieTagger, filename, online = False).perform()
+        movie = database.find_one(Media, filename = filename).metadata
+        self.assertEqual(movie.get('year'), None)
+        movie.watched = True
+
+        posterUrl = u'http://image.tmdb.org/t/p/original/dark_city.jpg'
+        images = self.setUpPosters(posterUrl)
+        try:
+            online = MemoryObjectGraph()
+            found = online.Movie(title = u'Dark City', year = 1998, posterUrl = posterUrl)
+            EnrichTask.merge(database, online.Media(filename = filename, metadata = found))
+
+            # the local movie has been replaced by the one found online
+            movie = database.find_one(Media, filename = filename).metadata
+            self.assertEqual((movie.title, movie.year), (u'Dark City', 1998))
+            self.assertEqual((movie.loresImage, movie.hiresImage), images)
+            self.assertEqual(movie.watched, True)
+            self.assertEqual(len(database.find_all(Movie)), 1)
+        finally:
+            self.tearDownPosters()
+
     def testImportVobsubSubtitle(self):
         database = MemoryObjectGraph()
         t = ImportTask(database, EpisodeTagger, '/home/download/tmp/testsmewt_series/Arrested_development/Arrested.Development.3x07.Prison.Break-In.DVDRip-TOPAZ.[tvu.org.ru].idx')
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.guessers.metadatamirror import MetadataMirror, SCHEMA
+import tempfile
+import sqlite3
+import shutil
+import time
+
+
+def episode(season, number, title, absolute = None):
+    return { 'season': season, 'episodeNumber': number, 'absoluteNumber': absolute,
+             'title': title, 'synopsis': None, 'originalAirDate': '2005-03-24' }
+
+
+class TestMetadataMirror(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = MetadataMirror(join(self.tmpdir, 'mirror.sqlite'))
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testSeries(self):
+        self.assertEqual(self.mirror.seriesInfo(73244, 'en'), None)
+        self.assertEqual(self.mirror.findSeries('The Office (US)'), [])
+
+        self.mirror.storeSeries('73244', 'en', u'The Office (US)',
+                                [ episode(1, 1, u'Pilot', '1'), episode(1, 2, u'Diversity Day', '2') ])
+        title, episodes = self.mirror.seriesInfo(73244, 'en')
+        self.assertEqual(title, u'The Office (US)')
+        self.assertEqual(sorted((ep['title'], ep['absoluteNumber']) for ep in episodes),
+                         [ (u'Diversity Day', 2), (u'Pilot', 1) ])
+        self.assertEqual(self.mirror.seriesInfo(73244, 'fr'), None)
+
+        # found under its normalized title, and the names it was looked up with
+        self.assertEqual(self.mirror.findSeries('the office us'), [ (u'73244', u'The Office (US)', u'en') ])
+        self.mirror.addSeriesName('The Office', 73244)
+        self.assertEqual(len(self.mirror.findSeries('the.office')), 1)
+
+        # storing it again replaces the episodes
+        self.mirror.storeSeries(73244, 'en', u'The Office (US)', [ episode(1, 1, u'Pilot') ])
+        self.assertEqual(len(self.mirror.seriesInfo(73244, 'en')[1]), 1)
+
+        self.assertEqual(self.mirror.seriesPoster(73244), None)
+        self.mirror.storeSeriesPoster(73244, None)
+        self.assertEqual(self.mirror.seriesPoster(73244), '')
+
+    def testMovies(self):
+        self.assertEqual(self.mirror.findMovie('Fear and Loathing in Las Vegas'), None)
+        self.mirror.addMovieName('Fear and Loathing in Las Vegas', 1878)
+        self.mirror.storeMovie(1878, 'en', { 'title': 'Fear and Loathing in Las Vegas',
+                                             'credits': { 'cast': [] } })
+        self.assertEqual(self.mirror.findMovie('fear and loathing in las vegas'), 1878)
+        self.assertEqual(self.mirror.movieDetails(1878, 'en')['credits'], { 'cast': [] })
+        self.assertEqual(self.mirror.movieDetails(1878, 'fr'), None)
+
+    def testExpire(self):
+        self.mirror.storeSeries(73244, 'en', u'The Office (US)', [ episode(1, 1, u'Pilot') ])
+        self.mirror.storeMovie(1878, 'en', { 'title': 'Fear and Loathing in Las Vegas' })
+        self.mirror.addMovieName('Fear and Loathing in Las Vegas', 1878)
+
+        self.assertNotEqual(self.mirror.seriesInfo(73244, 'en', maxAge = 3600), None)
+        self.assertNotEqual(self.mirror.movieDetails(1878, 'en', maxAge = 3600), None)
+
+        # still there for when they can't be fetched again
+        self.mirror.expire()
+        self.assertEqual(self.mirror.seriesInfo(73244, 'en', maxAge = 3600), None)
+        self.assertEqual(self.mirror.movieDetails(1878, 'en', maxAge = 3600), None)
+        self.assertEqual(self.mirror.seriesInfo(73244, 'en')[0], u'The Office (US)')
+        self.assertEqual(self.mirror.findSeries('The Office (US)'), [])
+        self.assertEqual(self.mirror.findMovie('Fear and Loathing in Las Vegas'), None)
+
+    def testDump(self):
+        self.mirror.storeSeries(73244, 'en', u'The Office (US)', [ episode(1, 1, u'Pilot') ])
+        self.mirror.storeMovie(1878, 'en', { 'title': 'Fear and Loathing in Las Vegas' })
+        self.mirror.addMovieName('Fear and Loathing in Las Vegas', 1878)
+        self.mirror.exportDump(join(self.tmpdir, 'dump.sqlite'))
+
+        other = MetadataMirror(join(self.tmpdir, 'other.sqlite'))
+        self.assertEqual(other.importDump(join(self.tmpdir, 'dump.sqlite')), (1, 1))
+        self.assertEqual(other.seriesInfo(73244, 'en')[1][0]['title'], u'Pilot')
+        self.assertEqual(other.findMovie('Fear and Loathing in Las Vegas'), 1878)
+
+        # only what is more recent in the dump gets imported
+        other.storeSeries(73244, 'en', u'The Office (US)', [ episode(1, 1, u'Pilot'),
+                                                            episode(1, 2, u'Diversity Day') ])
+        self.assertEqual(other.importDump(join(self.tmpdir, 'dump.sqlite')), (0, 0))
+        self.assertEqual(len(other.seriesInfo(73244, 'en')[1]), 2)
+        other.close()
+
+    def testOldSchema(self):
+        # mirrors and dumps from before the absolute numbers were kept
+        for name in ('old.sqlite', 'olddump.sqlite'):
+            conn = sqlite3.connect(join(self.tmpdir, name))
+            conn.execute('CREATE TABLE episodes (series_id INTEGER NOT NULL, language TEXT NOT NULL, '
+                         'season NUMERIC, episode NUMERIC, title TEXT, synopsis TEXT, air_date TEXT)')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute('INSERT INTO series VALUES (73244, "en", "The Office (US)", ?)', (time.time(),))
+            conn.execute('INSERT INTO episodes VALUES (73244, "en", 1, 1, "Pilot", NULL, NULL)')
+            conn.commit()
+            conn.close()
+
+        old = MetadataMirror(join(self.tmpdir, 'old.sqlite'))
+        self.assertEqual(old.seriesInfo(73244, 'en')[1][0]['absoluteNumber'], None)
+        old.storeSeries(73244, 'en', u'The Office (US)', [ episode(1, 1, u'Pilot', 1) ])
+        self.assertEqual(old.seriesInfo(73244, 'en')[1][0]['absoluteNumber'], 1)
+        old.close()
+
+        self.assertEqual(self.mirror.importDump(join(self.tmpdir, 'olddump.sqlite')), (1, 0))
+        self.assertEqual(self.mirror.seriesInfo(73244, 'en')[1][0]['title'], u'Pilot')
+
+
+suite = allTests(TestMetadataMirror)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base import cache, pipelinestats
+from smewt.guessers.tvdbmetadataprovider import TVDBMetadataProvider
+from smewt.taggers import EpisodeTagger
+from threading import Lock, Thread
+import tempfile
+import shutil
+import json
+import time
+
+
+DETAILS = { 'title': 'Dark City',
+            'original_title': 'Dark City',
+            'release_date': '1998-02-27',
+            'genres': [ { 'id': 878, 'name': 'Science Fiction' } ],
+            'vote_average': 7.3,
+            'overview': 'A man struggles with memories of his past.',
+            'poster_path': '/dark_city.jpg',
+            'credits': { 'crew': [ { 'name': 'Alex Proyas', 'job': 'Director' } ],
+                         'cast': [ { 'name': 'Rufus Sewell', 'character': 'John Murdoch' } ] },
+            'images': { 'posters': [] } }
+
+
+class FakeTMDB(object):
+    """Answers all the movie requests with DETAILS, and counts them."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def Movies(self, movieId):
+        return self
+
+    def info_with(self, append, params):
+        self.requests += 1
+        return dict(DETAILS)
+
+    def Configuration(self):
+        return FakeTMDBConfiguration(self)
+
+
+class FakeTMDBConfiguration(object):
+    def __init__(self, tmdb):
+        self.tmdb = tmdb
+
+    def info(self):
+        self.tmdb.requests += 1
+        return { 'images': { 'base_url': 'http://image.tmdb.org/t/p/' } }
+
+
+class SlowProvider(TVDBMetadataProvider):
+    """Takes some time to be created, and counts how many times it is."""
+
+    _instance = None
+    created = 0
+
+    def __init__(self):
+        time.sleep(0.1)
+        SlowProvider.created += 1
+
+
+class Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeTVDB(object):
+    """Knows only about Monk, takes some time to answer, and counts the requests."""
+
+    def __init__(self):
+        self.requests = { 'shows': 0, 'episodes': 0, 'images': 0 }
+        self.lock = Lock()
+
+    def request(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+        time.sleep(0.1)
+
+    def get_matching_shows(self, name):
+        self.request('shows')
+        return [ ('78490', 'Monk', 'en') ]
+
+    def iter_show_and_episodes(self, series, language = 'en'):
+        self.request('episodes')
+        yield Record(name = 'Monk')
+        for i in range(1, 9):
+            yield Record(season_number = 2, episode_number = i, absolute_number = None,
+                         name = 'Episode %d' % i, overview = '', first_aired = '2003-07-%02d' % i)
+
+    def get_show_image_choices(self, tvdbID):
+        self.request('images')
+        return []
+
+
+class TestMetadataProvider(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        pipelinestats.stats.reset()
+
+        # without any network access nor mirror
+        self.provider = TVDBMetadataProvider.__new__(TVDBMetadataProvider)
+        self.provider.tmdb = FakeTMDB()
+        self.provider.tmdbConfig = { 'images': { 'base_url': 'http://image.tmdb.org/t/p' } }
+        self.provider.tmdbConfigLock = Lock()
+        self.provider.tvdb = FakeTVDB()
+        self.provider.mirror = None
+        self.provider.seriesIndex = None
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.tmdbConfigFilename = join(self.tmpdir, 'tmdb_configuration.json')
+        self.provider._tmdbConfigFilename = lambda: self.tmdbConfigFilename
+
+    def tearDown(self):
+        cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def testMovieRequests(self):
+        movie = self.provider.getMovieData(1).find_one('Movie')
+        self.assertEqual(movie.title, 'Dark City')
+        self.assertEqual(movie.director, [ 'Alex Proyas' ])
+        self.assertEqual(self.provider.getMoviePosterUrl(1),
+                         'http://image.tmdb.org/t/p/original//dark_city.jpg')
+
+        # the details are fetched once for both, and timed once
+        self.assertEqual(self.provider.tmdb.requests, 1)
+        stages = pipelinestats.stats.toDict()['stages']
+        self.assertEqual([ s for s in stages if s.startswith('tmdb.') ], [ 'tmdb.getMovieDetails' ])
+        self.assertEqual(stages['tmdb.getMovieDetails']['count'], 1)
+
+    def testConcurrentSeriesLookups(self):
+        # the episodes of a show imported at once are spread over several batches, which
+        # are prepared concurrently but still need to look the show up only once
+        def prepare(i):
+            query = MemoryObjectGraph()
+            query.Media(filename = 'Monk/Monk.2x%02d.DVDRip.XviD-MEDiEVAL.avi' % i)
+            tagger = EpisodeTagger(self.provider)
+            tagger.prepare([ query ])
+            results.append(tagger.seriesResults.values())
+
+        results = []
+        threads = [ Thread(target = prepare, args = (i,)) for i in range(1, 9) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.provider.tvdb.requests, { 'shows': 1, 'episodes': 1, 'images': 1 })
+
+    def testRefreshEpisodes(self):
+        self.provider.getEpisodes(78490, 'en')
+        result = self.provider.refreshEpisodes(78490, 'en')
+        self.assertEqual(len(result.find_all('Episode')), 8)
+
+        # fetched once for the refresh, whose result is then the cached one
+        self.assertEqual(self.provider.tvdb.requests['episodes'], 2)
+        self.assert_(self.provider.getEpisodes('78490', 'en') is result)
+        self.assertEqual(self.provider.tvdb.requests['episodes'], 2)
+
+    def testTMDBConfig(self):
+        # a fresh configuration on disk is used as is
+        json.dump({ 'timestamp': time.time() - 3600,
+                    'configuration': { 'images': { 'base_url': 'http://cached/' } } },
+                  open(self.tmdbConfigFilename, 'w'))
+        self.provider.tmdbConfig = None
+        self.assertEqual(self.provider.getTMDBConfig()['images']['base_url'], 'http://cached/')
+        self.assertEqual(self.provider.tmdb.requests, 0)
+
+        # an expired one is fetched again, and saved
+        json.dump({ 'timestamp': time.time() - 4 * 24 * 3600,
+                    'configuration': { 'images': { 'base_url': 'http://cached/' } } },
+                  open(self.tmdbConfigFilename, 'w'))
+        self.provider.tmdbConfig = None
+        self.assertEqual(self.provider.getTMDBConfig()['images']['base_url'], 'http://image.tmdb.org/t/p/')
+        self.assertEqual(self.provider.tmdb.requests, 1)
+        saved = json.load(open(self.tmdbConfigFilename))
+        self.assertEqual(saved['configuration']['images']['base_url'], 'http://image.tmdb.org/t/p/')
+
+        # and then kept in memory
+        self.provider.getTMDBConfig()
+        self.assertEqual(self.provider.tmdb.requests, 1)
+
+    def testConcurrentInstance(self):
+        providers = []
+        threads = [ Thread(target = lambda: providers.append(SlowProvider.instance()))
+                    for i in range(8) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(SlowProvider.created, 1)
+        self.assertEqual(len(providers), 8)
+        self.assert_(all(p is providers[0] for p in providers))
+
+
+suite = allTests(TestMetadataProvider)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.pipelinestats import PipelineStats
+import time
+
+
+class TestPipelineStats(TestCase):
+
+    def testStages(self):
+        stats = PipelineStats()
+        for i in range(100):
+            stats.record('guessit', i / 100.0)
+        with stats.timed('solver'):
+            pass
+
+        result = stats.toDict()
+        self.assertEqual(sorted(result['stages']), [ 'guessit', 'solver' ])
+
+        guessit = result['stages']['guessit']
+        self.assertEqual(guessit['count'], 100)
+        self.assertAlmostEqual(guessit['total'], 49.5)
+        self.assertAlmostEqual(guessit['p50'], 0.5)
+        self.assertAlmostEqual(guessit['p90'], 0.9)
+        self.assertAlmostEqual(guessit['max'], 0.99)
+        self.assertEqual(result['slowest'], [])
+
+    def testSlowestTraces(self):
+        stats = PipelineStats(slowestTraces = 2)
+        for filename, duration in [ ('a', 0.03), ('b', 0.01), ('c', 0.05) ]:
+            with stats.tracing(filename):
+                time.sleep(duration)
+                stats.record('tvdb', duration)
+
+        # stages recorded outside of a trace don't end up in any
+        stats.record('tvdb', 1.0)
+
+        slowest = stats.toDict()['slowest']
+        self.assertEqual([ t['filename'] for t in slowest ], [ 'c', 'a' ])
+        self.assertEqual(slowest[0]['stages'], [ ('tvdb', 0.05) ])
+        self.assertEqual(stats.toDict()['stages']['import']['count'], 3)
+
+        stats.setSlowestTraces(1)
+        self.assertEqual([ t['filename'] for t in stats.toDict()['slowest'] ], [ 'c' ])
+
+
+suite = allTests(TestPipelineStats)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base import httpclient, posters
+from smewt.base.posters import PosterStore, PosterPipeline, ResizedPosterCache, PLACEHOLDER
+from smewt.ontology import Series
+from threading import Event
+import tempfile
+import shutil
+import hashlib
+import json
+import time
+
+
+class FakeClient(object):
+    """Serves a generated image for the posters it knows about, and fails to download
+    the other ones."""
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.downloads = []
+
+    def download(self, url, filename):
+        self.downloads.append(url)
+        if url not in self.urls:
+            # the connection dropped in the middle of the download
+            open(filename, 'wb').write('\x89PNG')
+            raise IOError('Connection reset by peer: %s' % url)
+        from PIL import Image
+        Image.new('RGB', (200, 300), (0, 0, 255)).save(filename, 'PNG')
+
+
+class TestPosterStore(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = PosterStore(join(self.tmpdir, 'posters'), '/user/posters')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, data):
+        filename = join(self.tmpdir, 'download.part')
+        open(filename, 'wb').write(data)
+        return filename
+
+    def testDeduplication(self):
+        url1 = 'http://thetvdb.com/banners/posters/1.jpg'
+        url2 = 'http://cf2.imgobject.com/t/p/original/abc.jpg'
+        self.assertEqual(self.store.lookup(url1), None)
+
+        # pretend the variants of this image have already been created, so that
+        # the store doesn't need to resize it again
+        h = hashlib.sha1('poster').hexdigest()
+        for variant in PosterStore.variants:
+            open(self.store.filename(h, variant), 'wb').write('resized')
+
+        self.assertEqual(self.store.add(url1, self.download('poster')), h)
+        self.assertEqual(self.store.add(url2, self.download('poster')), h)
+        self.assertEqual(self.store.lookup(url2), h)
+        self.assertEqual(self.store.url(h, 'grid'), '/user/posters/%s_grid.jpg' % h)
+
+        # the index is persisted
+        store = PosterStore(join(self.tmpdir, 'posters'), '/user/posters')
+        self.assertEqual(store.lookup(url1), h)
+        self.assertEqual(store.lookup(url2), h)
+
+    def testIndexLog(self):
+        h = hashlib.sha1('poster').hexdigest()
+        for variant in PosterStore.variants:
+            open(self.store.filename(h, variant), 'wb').write('resized')
+        indexFilename = join(self.tmpdir, 'posters', 'index.json')
+        logFilename = join(self.tmpdir, 'posters', 'index.log')
+        urls = [ 'http://thetvdb.com/banners/posters/%d.jpg' % i for i in range(4) ]
+
+        # adding images only appends to the log
+        self.store.compactionThreshold = 3
+        self.store.add(urls[0], self.download('poster'))
+        self.store.add(urls[1], self.download('poster'))
+        self.assertFalse(exists(indexFilename))
+        self.assertEqual(len(open(logFilename).readlines()), 2)
+
+        # until it gets too long
+        self.store.add(urls[2], self.download('poster'))
+        self.assertEqual(open(logFilename).read(), '')
+        self.assertEqual(sorted(json.load(open(indexFilename))), urls[:3])
+
+        # a partially written line is ignored, and the log is merged when loading the store
+        self.store.add(urls[3], self.download('poster'))
+        open(logFilename, 'a').write('["http://thetvdb.com/banners/posters/4.j')
+        store = PosterStore(join(self.tmpdir, 'posters'), '/user/posters')
+        self.assertEqual(sorted(store.index), urls)
+        self.assertEqual(open(logFilename).read(), '')
+        self.assertEqual(sorted(json.load(open(indexFilename))), urls)
+
+    def testVariants(self):
+        from PIL import Image
+        original = join(self.tmpdir, 'poster.png')
+        Image.new('RGBA', (800, 1000), (255, 0, 0, 128)).save(original)
+
+        h = self.store.add('http://thetvdb.com/banners/posters/1.jpg', original)
+        sizes = { 'list': (60, 75), 'grid': (160, 200), 'detail': (400, 500) }
+        for variant, size in sizes.items():
+            im = Image.open(self.store.filename(h, variant))
+            self.assertEqual(im.format, 'JPEG')
+            self.assertEqual(im.mode, 'RGB')
+            self.assertEqual(im.size, size)
+
+        # the same image is not resized again
+        for variant in sizes:
+            open(self.store.filename(h, variant), 'wb').write('resized')
+        self.assertEqual(self.store.add('http://thetvdb.com/banners/posters/2.jpg', original), h)
+        self.assertEqual(open(self.store.filename(h, 'list'), 'rb').read(), 'resized')
+
+    def testResizedCache(self):
+        h = hashlib.sha1('poster').hexdigest()
+        resized = ResizedPosterCache(self.store, join(self.tmpdir, 'resized'), 1024)
+
+        # never bigger than the largest variant
+        self.assertEqual(resized.clampSize(60, 90), (60, 90))
+        self.assertEqual(resized.clampSize(2000, 3000), PosterStore.variants['detail'])
+
+        self.assertEqual(resized.get('../../etc/passwd', 60, 90), None)
+        self.assertEqual(resized.get(h, 60, 90), None)
+
+        # images already on disk are picked up when the cache is created
+        filename = join(self.tmpdir, 'resized', '%s_60x90.jpg' % h)
+        open(filename, 'wb').write('resized')
+        resized = ResizedPosterCache(self.store, join(self.tmpdir, 'resized'), 1024)
+        self.assertEqual(resized.size, len('resized'))
+        self.assertEqual(resized.get(h, 60, 90), filename)
+
+        resized.clear()
+        self.assertFalse(exists(filename))
+
+    def testResizedCacheMiss(self):
+        h = hashlib.sha1('poster').hexdigest()
+        resized = ResizedPosterCache(self.store, join(self.tmpdir, 'resized'), 1024)
+        self.assertFalse(resized.exists(h))
+        self.assertFalse(resized.exists('../../etc/passwd'))
+        open(self.store.filename(h, 'detail'), 'wb').write('poster')
+        self.assertTrue(resized.exists(h))
+
+        # a resized image that disappeared is a cache miss, not an error
+        filename = join(self.tmpdir, 'resized', '%s_60x90.jpg' % h)
+        open(filename, 'wb').write('resized')
+        resized = ResizedPosterCache(self.store, join(self.tmpdir, 'resized'), 1024)
+        os.remove(filename)
+        resized.forget(h, 60, 90)
+        self.assertEqual(resized.size, 0)
+        self.assertEqual(resized.entries, {})
+
+        open(filename, 'wb').write('resized')
+        resized = ResizedPosterCache(self.store, join(self.tmpdir, 'resized'), 1024)
+        os.remove(filename)
+        os.remove(self.store.filename(h, 'detail'))
+        self.assertEqual(resized.get(h, 60, 90), None)
+        self.assertEqual(resized.size, 0)
+
+    def startPipeline(self, urls):
+        httpclient.setClient(FakeClient(urls))
+        pipeline = PosterPipeline(self.store, downloads = 2)
+        posters.setPipeline(pipeline)
+
+        # the graph is updated by a listener, as in SmewtDaemon.posterReady
+        self.graph = MemoryObjectGraph()
+        self.ready = Event()
+        def posterReady(url):
+            for md in self.graph.find_all(Series, posterUrl = url):
+                posters.applyPoster(md)
+            self.ready.set()
+        pipeline.addListener(posterReady)
+        return pipeline
+
+    def stopPipeline(self):
+        posters.pipeline().quit()
+        posters.setPipeline(None)
+        httpclient.setClient(None)
+
+    def testPipeline(self):
+        url = 'http://thetvdb.com/banners/posters/78490-1.jpg'
+        self.startPipeline([ url ])
+        try:
+            series = self.graph.Series(title = 'Monk')
+            posters.requestPoster(series, url)
+            self.assertEqual((series.loresImage, series.hiresImage), (PLACEHOLDER, PLACEHOLDER))
+
+            self.assert_(self.ready.wait(10))
+            h = self.store.lookup(url)
+            self.assertEqual((series.loresImage, series.hiresImage),
+                             (self.store.url(h, 'list'), self.store.url(h, 'detail')))
+            for variant in PosterStore.variants:
+                self.assert_(exists(self.store.filename(h, variant)))
+
+            # it is not downloaded again
+            self.assertEqual(posters.pipeline().request(url), (series.loresImage, series.hiresImage))
+            self.assertEqual(httpclient.client().downloads, [ url ])
+        finally:
+            self.stopPipeline()
+
+    def testPipelineFailedDownload(self):
+        url = 'http://thetvdb.com/banners/posters/missing.jpg'
+        pipeline = self.startPipeline([])
+        try:
+            series = self.graph.Series(title = 'Monk')
+            posters.requestPoster(series, url)
+
+            for i in range(100):
+                if url not in pipeline.pending:
+                    break
+                time.sleep(0.1)
+
+            # the placeholder stays, and the poster can be asked for again later
+            self.assertEqual(httpclient.client().downloads, [ url ])
+            self.assertFalse(self.ready.is_set())
+            self.assertEqual(self.store.lookup(url), None)
+            posters.applyPoster(series)
+            self.assertEqual((series.loresImage, series.hiresImage), (PLACEHOLDER, PLACEHOLDER))
+            self.assertEqual(os.listdir(self.store.directory), [])
+            self.assertEqual(pipeline.request(url), None)
+            self.assert_(url in pipeline.pending)
+        finally:
+            self.stopPipeline()
+
+
+suite = allTests(TestPosterStore)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
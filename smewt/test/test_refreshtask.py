@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base import TaskRetry
+from smewt.base.refreshtask import MetadataRefreshTask
+from smewt.base.smewtdaemon import VersionedMediaGraph
+import time
+
+
+class FakeProvider(object):
+    """Knows the new titles of the episodes of all the series, and records which ones
+    it has been asked for."""
+
+    def __init__(self, updated = (), failing = ()):
+        self.updated = set(updated)
+        self.failing = set(failing)
+        self.periods = []
+        self.refreshed = []
+
+    def getUpdatedSeries(self, period):
+        self.periods.append(period)
+        return self.updated
+
+    def findSeriesId(self, name):
+        return { 'Monk': '78490' }[name]
+
+    def refreshEpisodes(self, tvdbId):
+        self.refreshed.append(tvdbId)
+        if tvdbId in self.failing:
+            raise SmewtException('Could not reach thetvdb.com')
+        result = MemoryObjectGraph()
+        series = result.Series(title = 'Series %d' % tvdbId, tvdbId = tvdbId)
+        for i in range(1, 3):
+            result.Episode(series = series, season = 1, episodeNumber = i,
+                           title = 'New title %d' % i)
+        return result
+
+
+class TestRefreshTask(TestCase):
+
+    def setUp(self):
+        ontology.reload_saved_ontology('media')
+        self.database = VersionedMediaGraph()
+        self.series = {}
+        for title, tvdbId in [ ('Monk', None), ('Lost', 73739), ('Heroes', 79501) ]:
+            series = self.database.Series(title = title)
+            if tvdbId is not None:
+                series.tvdbId = tvdbId
+            for i in range(1, 3):
+                self.database.Episode(series = series, season = 1, episodeNumber = i,
+                                      title = 'Old title %d' % i)
+            self.series[title] = series
+
+    def titles(self, title):
+        return sorted(ep.title for ep in tolist(self.series[title].episodes))
+
+    def testUpdatePeriod(self):
+        task = MetadataRefreshTask(self.database, FakeProvider())
+        self.assertEqual(task.updatePeriod(3600), 'day')
+        self.assertEqual(task.updatePeriod(2 * 24 * 3600), 'week')
+        self.assertEqual(task.updatePeriod(7 * 24 * 3600), 'month')
+        self.assertEqual(task.updatePeriod(30 * 24 * 3600), None)
+
+    def testPatchEpisodes(self):
+        task = MetadataRefreshTask(self.database, FakeProvider())
+        result = MemoryObjectGraph()
+        series = result.Series(title = 'Lost')
+        result.Episode(series = series, season = 1, episodeNumber = 1, title = 'Old title 1')
+        result.Episode(series = series, season = 1, episodeNumber = 2, title = 'Pilot, part 2',
+                       synopsis = 'The survivors...')
+        result.Episode(series = series, season = 5, episodeNumber = 1, title = 'Not in the collection')
+
+        self.assertEqual(task.patchEpisodes(self.series['Lost'], result), 1)
+        self.assertEqual(self.titles('Lost'), [ 'Old title 1', 'Pilot, part 2' ])
+        self.assertEqual(len(tolist(self.series['Lost'].episodes)), 2)
+
+    def testOnlyUpdatedSeries(self):
+        self.database.config.lastMetadataRefresh = time.time() - 3600
+        provider = FakeProvider(updated = [ 73739 ])
+        MetadataRefreshTask(self.database, provider).perform()
+
+        # the series without TVDB id is always looked up, the other ones only if updated
+        self.assertEqual(provider.periods, [ 'day' ])
+        self.assertEqual(sorted(provider.refreshed), [ 73739, 78490 ])
+        self.assertEqual(self.series['Monk'].tvdbId, 78490)
+        self.assertEqual(self.titles('Lost'), [ 'New title 1', 'New title 2' ])
+        self.assertEqual(self.titles('Heroes'), [ 'Old title 1', 'Old title 2' ])
+
+    def testRetryFailedSeries(self):
+        lastRefresh = time.time() - 3 * 24 * 3600
+        self.database.config.lastMetadataRefresh = lastRefresh
+        provider = FakeProvider(updated = [ 73739, 79501 ], failing = [ 79501 ])
+        task = MetadataRefreshTask(self.database, provider)
+        self.assertRaises(TaskRetry, task.perform)
+
+        # the updates of the failed series must not be missed by the next refresh
+        self.assertEqual(self.database.config.lastMetadataRefresh, lastRefresh)
+        self.assertEqual(self.titles('Lost'), [ 'New title 1', 'New title 2' ])
+
+        # only the failed series is fetched again
+        provider.failing.clear()
+        provider.refreshed = []
+        task.perform()
+        self.assertEqual(provider.periods, [ 'week' ])
+        self.assertEqual(provider.refreshed, [ 79501 ])
+        self.assertEqual(self.titles('Heroes'), [ 'New title 1', 'New title 2' ])
+        self.assertEqual(self.database.config.lastMetadataRefresh, task.start)
+
+
+suite = allTests(TestRefreshTask)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
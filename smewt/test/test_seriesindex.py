@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.seriesindex import SeriesIndex
+import tempfile
+import shutil
+
+
+class TestSeriesIndex(TestCase):
+
+    def setUp(self):
+        self.index = SeriesIndex()
+        for tvdbId, title in [ (73244, 'The Office (US)'),
+                               (78107, 'The Office (UK)'),
+                               (78804, 'Doctor Who (2005)'),
+                               (76107, 'Doctor Who'),
+                               (80348, 'The Big Bang Theory'),
+                               (79824, 'Naruto Shippuden') ]:
+            self.index.add(tvdbId, title)
+
+    def testFind(self):
+        self.assertEqual(self.index.find('the.office.us'), 73244)
+        self.assertEqual(self.index.find('Doctor Who'), 76107)
+        self.assertEqual(self.index.find('doctor who 2005'), 78804)
+
+        # close enough
+        self.assertEqual(self.index.find('Big Bang Theory'), 80348)
+        self.assertEqual(self.index.find('Naruto Shipuden'), 79824)
+
+        # too different, or too ambiguous
+        self.assertEqual(self.index.find('Naruto'), None)
+        self.assertEqual(self.index.find('The Office'), None)
+        self.assertEqual(self.index.find('Breaking Bad'), None)
+
+    def testVersions(self):
+        # remakes and regional versions are only found under their exact names
+        index = SeriesIndex()
+        for tvdbId, title in [ (73244, 'The Office (US)'),
+                               (262980, 'House of Cards (US)'),
+                               (73545, 'Battlestar Galactica (2003)') ]:
+            index.add(tvdbId, title)
+
+        self.assertEqual(index.find('The Office'), None)
+        self.assertEqual(index.find('House of Cards'), None)
+        self.assertEqual(index.find('Battlestar Galactica'), None)
+        self.assertEqual(index.find('Battlestar Galactica 1978'), None)
+        self.assertEqual(index.find('Battlestar Galactica (2003)'), 73545)
+        self.assertEqual(index.find('House of Card US'), 262980)
+
+        index.clear()
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.find('The Office (US)'), None)
+
+    def testAliases(self):
+        self.index.addAlias('The Office', 73244)
+        self.assertEqual(self.index.find('the office'), 73244)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = join(tmpdir, 'Smewt.series_index')
+            self.index.save(filename)
+            index = SeriesIndex()
+            index.load(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.find('the office'), 73244)
+        self.assertEqual(index.find('the office uk'), 78107)
+
+
+suite = allTests(TestSeriesIndex)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.solvers.simplesolver import MatchIndex, fuzzyMatch2
+
+
+class TestSimpleSolver(TestCase):
+
+    def setUp(self):
+        ontology.reload_saved_ontology('media')
+
+    def testMatchIndex(self):
+        g = MemoryObjectGraph()
+        office = g.Series(title = 'The Office')
+        other = g.Series(title = 'x' * 100)
+
+        candidates = [ g.Episode(series = series, season = season, episodeNumber = number)
+                       for series in (office, other)
+                       for season in (1, 2)
+                       for number in (1, 2, 3) ]
+
+        base = g.Episode(series = g.Series(title = 'the office'), season = 2, episodeNumber = 3)
+
+        # same result as comparing each of them with fuzzyMatch2
+        expected = [ ep for ep in candidates if fuzzyMatch2(base, ep) ]
+        self.assertEqual(MatchIndex(candidates).matches(base), expected)
+        self.assertEqual([ ep.series.title for ep in expected ], [ 'The Office' ])
+
+
+suite = allTests(TestSimpleSolver)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.taskjournal import TaskJournal
+from smewt.base.collection import UpdateTask
+from smewt.base.smewtdaemon import SmewtDaemon
+from smewt.taggers import EpisodeTagger, MovieTagger
+import tempfile
+import shutil
+
+
+class FakeCollection(object):
+    def __init__(self, name, mediaTagger):
+        self.name = name
+        self.mediaTagger = mediaTagger
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+
+
+class FakeTaskManager(object):
+    """Records the tasks added to it, in its journal too, and performs none."""
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.tasks = []
+
+    def add(self, task):
+        self.tasks.append(task)
+        self.journal.taskAdded(task.key(), task.journalEntry())
+
+
+class TestTaskJournal(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = join(self.tmpdir, 'Smewt.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def entry(self, filename):
+        return { 'type': 'import', 'tagger': 'EpisodeTagger', 'filename': filename, 'priority': 5 }
+
+    def key(self, filename):
+        return ('ImportTask', 'EpisodeTagger', filename)
+
+    def testResume(self):
+        j = TaskJournal(self.filename)
+        for f in [ 'a.avi', 'b.avi', 'c.avi' ]:
+            j.taskAdded(self.key(f), self.entry(f))
+        j.taskDone(self.key('b.avi'))
+        self.assertEqual([ e['filename'] for _, e in j.pendingEntries() ], [ 'a.avi', 'c.avi' ])
+
+        # we saved the database, then completed a task but crashed before saving again
+        j.checkpoint()
+        j.taskDone(self.key('a.avi'))
+        j.close()
+
+        j = TaskJournal(self.filename)
+        self.assertEqual([ key for key, _ in j.pendingEntries() ],
+                         [ self.key('a.avi'), self.key('c.avi') ])
+
+    def testReAddAfterDone(self):
+        j = TaskJournal(self.filename)
+        j.taskAdded(self.key('a.avi'), self.entry('a.avi'))
+        j.taskDone(self.key('a.avi'))
+        j.taskAdded(self.key('a.avi'), self.entry('a.avi'))
+        j.checkpoint()
+        j.close()
+
+        j = TaskJournal(self.filename)
+        self.assertEqual(len(j.pendingEntries()), 1)
+
+    def testCompaction(self):
+        j = TaskJournal(self.filename)
+        j.compactionThreshold = 10
+        for i in range(100):
+            j.taskAdded(self.key('a.avi'), self.entry('a.avi'))
+        self.assert_(len(open(self.filename).readlines()) <= 20)
+
+        for i in range(100):
+            f = '%d.avi' % i
+            j.taskAdded(self.key(f), self.entry(f))
+            j.taskDone(self.key(f))
+        j.close()
+
+        # compaction must not have made completions durable without a checkpoint
+        j = TaskJournal(self.filename)
+        self.assertEqual(len(j.pendingEntries()), 101)
+        j.checkpoint()
+        self.assertEqual(len(open(self.filename).readlines()), 102)
+
+    def testCorruptedLine(self):
+        j = TaskJournal(self.filename)
+        j.taskAdded(self.key('a.avi'), self.entry('a.avi'))
+        j.close()
+        open(self.filename, 'a').write('{"op": "add", "ke')
+
+        j = TaskJournal(self.filename)
+        self.assertEqual(len(j.pendingEntries()), 1)
+
+    def restartDaemon(self):
+        smewtd = SmewtDaemon.__new__(SmewtDaemon)
+        smewtd.database = MemoryObjectGraph()
+        smewtd.taskJournal = TaskJournal(self.filename)
+        smewtd.taskManager = FakeTaskManager(smewtd.taskJournal)
+        smewtd.episodeCollection = FakeCollection('Series', EpisodeTagger)
+        smewtd.movieCollection = FakeCollection('Movie', MovieTagger)
+        smewtd.updateCollections = lambda: self.fail('the collections should not be updated')
+        smewtd.resumeTasks()
+        return smewtd
+
+    def queued(self, smewtd):
+        return [ t.__class__.__name__ for t in smewtd.taskManager.tasks ]
+
+    def testResumeAfterUpdate(self):
+        filename = join(self.tmpdir, 'a.avi')
+        open(filename, 'w').close()
+
+        # a clean start updates the collections
+        smewtd = self.restartDaemon()
+        self.assertEqual(self.queued(smewtd), [ 'UpdateTask' ])
+
+        # the update completed, but not the import of the file it found
+        update = smewtd.taskManager.tasks[0]
+        update.perform()
+        smewtd.taskJournal.taskAdded(self.key(filename), self.entry(filename))
+        smewtd.taskJournal.taskDone(update.key())
+        smewtd.taskJournal.checkpoint()
+        smewtd.taskJournal.close()
+
+        # only the import is resumed, the folders are not walked again
+        smewtd = self.restartDaemon()
+        self.assertEqual(self.queued(smewtd), [ 'ImportTask' ])
+        self.assertEqual(smewtd.episodeCollection.updates, 0)
+        smewtd.taskJournal.close()
+
+    def testResumeInterruptedUpdate(self):
+        filename = join(self.tmpdir, 'a.avi')
+        open(filename, 'w').close()
+
+        j = TaskJournal(self.filename)
+        update = UpdateTask([ FakeCollection('Series', EpisodeTagger) ])
+        j.taskAdded(update.key(), update.journalEntry())
+        j.taskAdded(self.key(filename), self.entry(filename))
+        j.close()
+
+        # the update is performed again, and only once
+        smewtd = self.restartDaemon()
+        self.assertEqual(sorted(self.queued(smewtd)), [ 'ImportTask', 'UpdateTask' ])
+        self.assertEqual([ c.name for c in smewtd.taskManager.tasks[0].collections ], [ 'Series' ])
+        smewtd.taskJournal.close()
+
+
+suite = allTests(TestTaskJournal)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2008 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.taskmanager import Task, TaskManager, TaskCancelled, TaskRetry
+from threading import Thread, Lock, Event
+import time
+
+
+class RecordingTask(Task):
+    concurrency = 1
+
+    running = 0
+    maxRunning = 0
+    lock = Lock()
+
+    def __init__(self, name, log, priority = 5, duration = 0.05):
+        super(RecordingTask, self).__init__(priority)
+        self.name = name
+        self.log = log
+        self.duration = duration
+        self.description = 'Recording %s' % name
+
+    def perform(self):
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.maxRunning = max(cls.maxRunning, cls.running)
+        time.sleep(self.duration)
+        self.log.append(self.name)
+        with cls.lock:
+            cls.running -= 1
+
+
+class ParallelTask(RecordingTask):
+    concurrency = 3
+
+    running = 0
+    maxRunning = 0
+    lock = Lock()
+
+
+class KeyedTask(RecordingTask):
+    def key(self):
+        return (self.__class__.__name__, self.name)
+
+
+class BatchedTask(KeyedTask):
+    batchSize = 3
+    batches = []
+
+    def batchKey(self):
+        return self.__class__.__name__
+
+    @classmethod
+    def batch(cls, tasks):
+        cls.batches.append([ t.name for t in tasks ])
+        return RecordingTask('+'.join(t.name for t in tasks), tasks[0].log, duration = 0)
+
+
+class WideBatchedTask(BatchedTask):
+    concurrency = 3
+    batchSize = 20
+
+
+class FlakyTask(KeyedTask):
+    """Task that fails the given number of times before succeeding."""
+    retryDelays = (0.1,)
+
+    def __init__(self, name, log, failures, priority = 5):
+        super(FlakyTask, self).__init__(name, log, priority, duration = 0)
+        self.failures = failures
+
+    def journalEntry(self):
+        return { 'name': self.name }
+
+    def perform(self):
+        self.log.append(self.name)
+        if self.failures:
+            self.failures -= 1
+            raise TaskRetry('%s failed' % self.name)
+
+
+class FlakyBatchedTask(FlakyTask):
+    batchSize = 3
+
+    def batchKey(self):
+        return self.__class__.__name__
+
+    @classmethod
+    def batch(cls, tasks):
+        return FlakyBatch(tasks)
+
+
+class FlakyBatch(Task):
+    def __init__(self, tasks):
+        super(FlakyBatch, self).__init__()
+        self.tasks = tasks
+        self.token = tasks[0].token
+        self.description = 'Flaky batch'
+
+    def perform(self):
+        failed = []
+        for t in self.tasks:
+            t.log.append(t.name)
+            if t.failures:
+                t.failures -= 1
+                failed.append(t)
+        if failed:
+            raise TaskRetry('%d tasks failed' % len(failed), tasks = failed)
+
+
+class RecordingJournal(object):
+    def __init__(self):
+        self.added = []
+        self.done = []
+
+    def taskAdded(self, key, entry):
+        self.added.append(key)
+
+    def taskDone(self, key):
+        self.done.append(key)
+
+
+class BlockingTask(Task):
+    def __init__(self, event):
+        super(BlockingTask, self).__init__(priority = 10)
+        self.event = event
+        self.description = 'Blocking'
+
+    def perform(self):
+        self.event.wait()
+
+
+class HangingTask(Task):
+    """Task that never returns by itself, like a task stuck on a network call."""
+    timeout = 0.5
+
+    def __init__(self, results):
+        super(HangingTask, self).__init__()
+        self.results = results
+        self.description = 'Hanging'
+
+    def perform(self):
+        time.sleep(3)
+        self.token.commit()
+        self.results.append('committed')
+
+
+class CommittingTask(Task):
+    """Task that takes some time to apply its results once it has committed."""
+
+    def __init__(self, results):
+        super(CommittingTask, self).__init__()
+        self.results = results
+        self.description = 'Committing'
+
+    def perform(self):
+        self.token.commit()
+        time.sleep(0.5)
+        self.results.append('written')
+
+
+class CooperativeTask(Task):
+    def __init__(self, results):
+        super(CooperativeTask, self).__init__()
+        self.results = results
+        self.description = 'Cooperative'
+
+    def perform(self):
+        while not self.token.wait(0.05):
+            pass
+        self.results.append(self.token.reason)
+        self.token.check()
+        self.results.append('not cancelled')
+
+
+class TestTaskManager(TestCase):
+
+    def testStablePriorityOrder(self):
+        tm = TaskManager(workers = 1)
+        log = []
+
+        # keep the only worker busy so that the following tasks pile up in the queue
+        event = Event()
+        tm.add(BlockingTask(event))
+        time.sleep(0.1)
+
+        for name, priority in [ ('a', 5), ('b', 7), ('c', 5), ('d', 7), ('e', 1) ]:
+            tm.add(RecordingTask(name, log, priority, duration = 0))
+
+        event.set()
+        tm.queue.join()
+
+        self.assertEqual(log, [ 'b', 'd', 'a', 'c', 'e' ])
+
+    def testConcurrencyLimits(self):
+        tm = TaskManager(workers = 6)
+        log = []
+
+        for i in range(8):
+            tm.add(ParallelTask('p%d' % i, log))
+            tm.add(RecordingTask('r%d' % i, log))
+
+        tm.queue.join()
+
+        self.assertEqual(len(log), 16)
+        self.assertEqual(ParallelTask.maxRunning, 3)
+        self.assertEqual(RecordingTask.maxRunning, 1)
+
+    def testCounters(self):
+        tm = TaskManager()
+        log = []
+
+        for i in range(10):
+            tm.add(ParallelTask('p%d' % i, log, duration = 0.1))
+
+        finished, total, running = tm.status()
+        self.assertEqual(total, 10)
+        self.assert_(finished + len(running) <= total)
+        self.assert_(len(running) <= ParallelTask.concurrency)
+
+        tm.queue.join()
+
+        self.assertEqual(tm.status(), (0, 0, []))
+
+    def testCoalescing(self):
+        tm = TaskManager(workers = 1)
+        log = []
+
+        event = Event()
+        tm.add(BlockingTask(event))
+        time.sleep(0.1)
+
+        tm.add(KeyedTask('a', log, priority = 5, duration = 0))
+        tm.add(KeyedTask('b', log, priority = 5, duration = 0))
+        tm.add(KeyedTask('a', log, priority = 3, duration = 0))
+        # same key with a higher priority: 'b' should now run first
+        tm.add(KeyedTask('b', log, priority = 8, duration = 0))
+
+        self.assertEqual(tm.status()[1], 3)
+
+        event.set()
+        tm.queue.join()
+
+        self.assertEqual(log, [ 'b', 'a' ])
+        self.assertEqual(tm.status(), (0, 0, []))
+
+        # once a task has been performed, the same one can be queued again
+        tm.add(KeyedTask('a', log, duration = 0))
+        tm.queue.join()
+        self.assertEqual(log, [ 'b', 'a', 'a' ])
+
+    def testBatching(self):
+        tm = TaskManager(workers = 1)
+        log = []
+
+        event = Event()
+        tm.add(BlockingTask(event))
+        time.sleep(0.1)
+
+        for name in 'abcdef':
+            tm.add(BatchedTask(name, log, duration = 0))
+        # supersedes the first 'b', which should be skipped when gathering a batch
+        tm.add(BatchedTask('b', log, priority = 6, duration = 0))
+        # not batchable, stops the batch
+        tm.add(KeyedTask('x', log, priority = 4, duration = 0))
+        tm.add(BatchedTask('g', log, priority = 4, duration = 0))
+
+        self.assertEqual(tm.status()[1], 9)
+
+        event.set()
+        tm.queue.join()
+
+        self.assertEqual(log, [ 'b+a+c', 'd+e+f', 'x', 'g' ])
+        self.assertEqual(BatchedTask.batches, [ ['b', 'a', 'c'], ['d', 'e', 'f'] ])
+        self.assertEqual(tm.status(), (0, 0, []))
+
+    def testBatchLimit(self):
+        tm = TaskManager(workers = 4)
+        task = WideBatchedTask('a', [])
+
+        # the waiting tasks are shared with the idle workers, within the concurrency limit
+        self.assertEqual(tm.batchLimit(task, 0), 1)
+        self.assertEqual(tm.batchLimit(task, 3), 1)
+        self.assertEqual(tm.batchLimit(task, 9), 3)
+        self.assertEqual(tm.batchLimit(task, 40), 11)
+        self.assertEqual(tm.batchLimit(task, 200), 20)
+
+        # without any idle worker, batches are as big as the class allows
+        tm.workers = 0
+        self.assertEqual(tm.batchLimit(task, 9), 10)
+        self.assertEqual(tm.batchLimit(task, 40), 20)
+
+    def testRetry(self):
+        journal = RecordingJournal()
+        tm = TaskManager(workers = 1, journal = journal)
+        tm.watchdogInterval = 0.05
+        log = []
+
+        tm.add(FlakyTask('a', log, failures = 1))
+        # fails more often than it is allowed to be tried again
+        tm.add(FlakyTask('b', log, failures = 5))
+
+        tm.queue.join()
+        # wait for the watchdog to queue the failed tasks again
+        time.sleep(1.5)
+        tm.queue.join()
+
+        self.assertEqual(log, [ 'a', 'b', 'a', 'b' ])
+        # the task that kept failing stays in the journal, to be tried after a restart
+        self.assertEqual(journal.done, [ ('FlakyTask', 'a') ])
+        self.assertEqual(tm.status(), (0, 0, []))
+
+    def testRetryInBatch(self):
+        journal = RecordingJournal()
+        tm = TaskManager(workers = 1, journal = journal)
+        tm.watchdogInterval = 0.05
+        log = []
+
+        event = Event()
+        tm.add(BlockingTask(event))
+        time.sleep(0.1)
+
+        tm.add(FlakyBatchedTask('a', log, failures = 0))
+        tm.add(FlakyBatchedTask('b', log, failures = 1))
+        tm.add(FlakyBatchedTask('c', log, failures = 0))
+
+        event.set()
+        tm.queue.join()
+        # wait for the watchdog to queue the failed tasks again
+        time.sleep(1.5)
+        tm.queue.join()
+
+        # only the task that failed is performed again
+        self.assertEqual(log, [ 'a', 'b', 'c', 'b' ])
+        self.assertEqual(journal.done, [ ('FlakyBatchedTask', 'a'), ('FlakyBatchedTask', 'c'),
+                                         ('FlakyBatchedTask', 'b') ])
+
+    def testCancellationToken(self):
+        t = Task()
+        t.token.check()
+        self.assert_(t.token.cancel('stopped'))
+        self.assertRaises(TaskCancelled, t.token.check)
+        self.assertRaises(TaskCancelled, t.token.commit)
+
+        # once a task is committing its results, it can't be cancelled anymore
+        t = Task()
+        t.token.commit()
+        self.assertFalse(t.token.cancel())
+        t.token.check()
+
+    def testTimeout(self):
+        tm = TaskManager(workers = 1)
+        tm.watchdogInterval = 0.1
+        results, log = [], []
+
+        tm.add(HangingTask(results))
+        tm.add(RecordingTask('after', log, duration = 0))
+
+        start = time.time()
+        tm.queue.join()
+
+        # the hanging task has been abandoned and a new worker took over the next one
+        self.assert_(time.time() - start < 2)
+        self.assertEqual(log, [ 'after' ])
+        self.assertEqual(tm.status(), (0, 0, []))
+
+        # the abandoned task eventually wakes up, but isn't allowed to apply its results
+        time.sleep(3)
+        self.assertEqual(results, [])
+
+    def testFinishNowTimeout(self):
+        tm = TaskManager()
+        results = []
+        task = CooperativeTask(results)
+        tm.add(task)
+        tm.add(RecordingTask('never', []))
+        time.sleep(0.1)
+
+        start = time.time()
+        cancelled = tm.finishNow(timeout = 0.3)
+
+        self.assert_(time.time() - start < 1)
+        self.assertEqual(cancelled, [ task ])
+        time.sleep(0.2)
+        self.assertEqual(results, [ 'cancelled because TaskManager is finishing' ])
+
+    def testFinishNowCommitted(self):
+        tm = TaskManager()
+        results = []
+        tm.add(CommittingTask(results))
+        time.sleep(0.1)
+
+        # too late to cancel it, it is waited for whatever the timeout
+        cancelled = tm.finishNow(timeout = 0.1)
+        self.assertEqual(cancelled, [])
+        self.assertEqual(results, [ 'written' ])
+
+    def testWorkerThreads(self):
+        tm = TaskManager(workers = 2)
+        dead = Thread(target = lambda: None)
+        dead.start()
+        dead.join()
+        tm.workerThreads.append(dead)
+
+        # dead workers are forgotten when new ones are started
+        tm.startWorker()
+        self.assertEqual(len(tm.workerThreads), 3)
+        self.assertTrue(dead not in tm.workerThreads)
+
+    def testWatchdogStops(self):
+        # as soon as the TaskManager is told to finish, even with nothing running
+        tm = TaskManager(workers = 1)
+        self.assert_(tm.watchdogThread.is_alive())
+        tm.finishNow()
+        self.assertFalse(tm.watchdogThread.is_alive())
+
+        # or once it has performed all its tasks
+        tm = TaskManager(workers = 1)
+        log = []
+        for name in [ 'a', 'b' ]:
+            tm.add(RecordingTask(name, log))
+        tm.finish()
+        self.assertEqual(log, [ 'a', 'b' ])
+        self.assertFalse(tm.watchdogThread.is_alive())
+
+
+suite = allTests(TestTaskManager)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
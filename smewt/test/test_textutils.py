@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base.textutils import levenshtein, editDistance, editDistances
+import random
+
+
+class TestTextUtils(TestCase):
+
+    def testEditDistance(self):
+        self.assertEqual(editDistance('', ''), 0)
+        self.assertEqual(editDistance('', 'abc'), 3)
+        self.assertEqual(editDistance('kitten', 'sitting'), 3)
+        self.assertEqual(editDistance(u'The Office (US)', u'The Office'), 5)
+
+        # once the cutoff is exceeded, we only know that it is
+        self.assertEqual(editDistance('kitten', 'sitting', 3), 3)
+        self.assertEqual(editDistance('kitten', 'sitting', 2), 3)
+        self.assertEqual(editDistance('a' * 100, 'b', 80), 81)
+
+    def testSameAsReference(self):
+        rnd = random.Random(42)
+        def randomString():
+            return ''.join(rnd.choice('abc ') for i in range(rnd.randint(0, 12)))
+
+        for i in range(2000):
+            a, b = randomString(), randomString()
+            d = levenshtein(a, b)
+            self.assertEqual(editDistance(a, b), d)
+            cutoff = rnd.randint(0, 12)
+            self.assertEqual(editDistance(a, b, cutoff), min(d, cutoff + 1))
+
+    def testEditDistances(self):
+        self.assertEqual(editDistances('office', [ 'the office', 'office', 'the office' ]),
+                         [ 4, 0, 4 ])
+        self.assertEqual(editDistances('office', [ 'the office', 'office' ], 2), [ 3, 0 ])
+
+
+suite = allTests(TestTextUtils)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Smewt - A smart collection manager
+# Copyright (c) 2013 Nicolas Wack <wackou@smewt.com>
+#
+# Smewt is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Smewt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from smewttest import *
+from smewt.base import SmewtException
+from smewt.guessers.thetvdbapi import TheTVDB
+from StringIO import StringIO
+import datetime
+
+
+class TestTheTVDB(TestCase):
+
+    def setUp(self):
+        self.document = open(join(currentPath(), 'test_tvdb', 'monk_all_en.xml')).read()
+        self.urls = []
+
+    def tvdb(self, document):
+        def urlopen(url):
+            self.urls.append(url)
+            return StringIO(document)
+        return TheTVDB('APIKEY', urlopen = urlopen)
+
+    def testIterShowAndEpisodes(self):
+        records = list(self.tvdb(self.document).iter_show_and_episodes(78490, language = 'en'))
+        self.assertEqual(self.urls, [ 'http://www.thetvdb.com/api/APIKEY/series/78490/all/en.xml' ])
+
+        show, episodes = records[0], records[1:]
+        self.assertEqual(show.name, 'Monk')
+        self.assertEqual(show.genre, [ 'Comedy', 'Crime', 'Drama' ])
+        self.assertEqual(show.first_aired, datetime.date(2002, 7, 12))
+
+        self.assertEqual([ (ep.season_number, ep.episode_number, ep.absolute_number) for ep in episodes ],
+                         [ ('0', '1', ''), ('1', '1', '1'), ('1', '2', '2'), ('2', '1', '14') ])
+        self.assertEqual(episodes[3].name, 'Mr. Monk Goes Back to School')
+        self.assertEqual(episodes[3].first_aired, datetime.date(2003, 6, 20))
+
+    def testTruncatedDocument(self):
+        truncated = self.document[:self.document.index('Mr. Monk and the Candidate (2)')]
+        records = self.tvdb(truncated).iter_show_and_episodes(78490)
+        self.assertRaises(SmewtException, list, records)
+
+
+suite = allTests(TestTheTVDB)
+
+if __name__ == '__main__':
+    TextTestRunner(verbosity=2).run(suite)
+    shutdown()
@@ -19,6 +19,8 @@
 #
 
 from smewttest import *
+from smewt.guessers.episodetvdb import EpisodeIndex
+from smewt.base.textutils import normalizeTitle
 import glob
 
 class TestTVDB(TestCase):
@@ -49,6 +51,50 @@ class TestTVDB(TestCase):
             else:
                 self.assertEqual(result, [])
 
+    def seriesWithGap(self):
+        g = MemoryObjectGraph()
+        series = g.Series(title = 'Naruto')
+        # the TVDB has no episode with the absolute number 4
+        absolute = { (1, 1): 1, (1, 2): 2, (1, 3): 3, (2, 1): 5, (2, 2): 6, (2, 3): 7 }
+        for season, count in [ (0, 2), (1, 3), (2, 3) ]:
+            for number in range(1, count + 1):
+                ep = g.Episode(series = series, season = season, episodeNumber = number,
+                               title = 'Episode %dx%02d' % (season, number))
+                if (season, number) in absolute:
+                    ep.absoluteNumber = absolute[(season, number)]
+        return g
+
+    def testEpisodeIndex(self):
+        index = EpisodeIndex(self.seriesWithGap())
+        self.assertEqual(index.series.title, 'Naruto')
+
+        found = index.find(2, 1)
+        self.assertEqual([ (ep.season, ep.episodeNumber) for ep in found ], [ (2, 1) ])
+        self.assertEqual(index.find(2, 5), [])
+
+        found = index.findAbsolute(6)
+        self.assertEqual([ (ep.season, ep.episodeNumber) for ep in found ], [ (2, 2) ])
+        self.assertEqual(index.findAbsolute(4), [])
+
+        # without an episode number, all of them are candidates
+        self.assertEqual(len(index.find(1, None)), 8)
+
+    def testAbsoluteNumber(self):
+        index = EpisodeIndex(self.seriesWithGap())
+
+        # what EpisodeFilename finds for 'Naruto - 06.avi'
+        query = MemoryObjectGraph()
+        series = query.Series(title = 'Naruto')
+        ep = query.Episode(allow_incomplete = True, confidence = 0.9, series = series, episodeNumber = 6)
+        query.Media(filename = 'Naruto - 06.avi', metadata = ep)
+
+        chain = SolvingChain(EpisodeTVDB(seriesResults = { normalizeTitle('Naruto'): index }),
+                             SimpleSolver(Episode))
+        result = chain.solve(query).find_one(Media).metadata
+
+        self.assertEqual((result.season, result.episodeNumber), (2, 2))
+        self.assertEqual(result.title, 'Episode 2x02')
+
 
 # add a single test function for each file contained in the test_imdb/ directory
 for filename in glob.glob(join(currentPath(), 'test_tvdb', '*.yaml')):
@@ -1,8 +1,9 @@
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPFound, HTTPNotFound, HTTPNotModified
+from pyramid.response import FileResponse
 
 from smewt import SMEWTD_INSTANCE
-from smewt.base import EventServer, SmewtException, utils
+from smewt.base import EventServer, SmewtException, utils, pipelinestats, posters
 from smewt.ontology import Metadata, Movie, Series, Episode
 from smewt.plugins import mldonkey, tvu, mplayer
 from smewt.actions import get_subtitles, play_video, play_file
@@ -215,6 +216,22 @@ def action(request):
             SMEWTD_INSTANCE.clearCache()
             return 'Cache cleared!'
 
+        elif action == 'refresh_metadata':
+            SMEWTD_INSTANCE.refreshMetadata()
+            return 'Refreshing series information...'
+
+        elif action == 'import_metadata_dump':
+            nseries, nmovies = SMEWTD_INSTANCE.importMetadataDump(request.params['path'])
+            return 'Imported %d series and %d movies!' % (nseries, nmovies)
+
+        elif action == 'export_metadata_dump':
+            SMEWTD_INSTANCE.exportMetadataDump(request.params['path'])
+            return 'OK'
+
+        elif action == 'purge_negative_cache':
+            count = SMEWTD_INSTANCE.purgeNegativeCache()
+            return 'Forgot %d failed lookups!' % count
+
         elif action == 'subscribe':
             SMEWTD_INSTANCE.feedWatcher.addFeed(request.params['feed'])
             return 'OK'
@@ -261,15 +278,18 @@ def action(request):
         elif action == 'set_collection_folders':
             folders = json.loads(request.params['folders'])
             get_collection(request.params['collection']).setFolders(folders)
+            SMEWTD_INSTANCE.collectionFoldersChanged()
             return 'OK'
 
         elif action == 'add_collection_folder':
             get_collection(request.params['collection']).addFolder()
+            SMEWTD_INSTANCE.collectionFoldersChanged()
             return 'OK'
 
         elif action == 'delete_collection_folder':
             index = int(request.params['index'])
             get_collection(request.params['collection']).deleteFolder(index)
+            SMEWTD_INSTANCE.collectionFoldersChanged()
             return 'OK'
 
         elif action == 'classify_incoming_files':
@@ -411,11 +431,14 @@ def info(request):
                   ) for f in feeds ]
 
     elif name == 'task_manager_status':
-        tm = SMEWTD_INSTANCE.taskManager
-        if tm.total == 0:
+        finished, total, running = SMEWTD_INSTANCE.taskManager.status()
+        if total == 0:
             return 'idle'
         else:
-            return 'Task %d/%d completed!<br>Currently: %s' % (len(tm.finished), tm.total, tm.taskDesc)
+            return 'Task %d/%d completed!<br>Currently: %s' % (finished, total, '<br>'.join(running))
+
+    elif name == 'pipeline_stats':
+        return pipelinestats.stats.toDict()
 
     elif name == 'video_position':
         return '%02d:%02d:%02d' % (int(mplayer.pos / 3600),
@@ -426,6 +449,36 @@ def info(request):
         return 'Error: unknown info: %s' % name
 
 
+@view_config(route_name='img')
+def resized_image(request):
+    contentHash = request.matchdict['id']
+    resized = posters.resizedCache()
+    width, height = resized.clampSize(int(request.matchdict['width']),
+                                      int(request.matchdict['height']))
+
+    # the image for a given hash and size never changes, as long as it is in the store
+    etag = '%s-%dx%d' % (contentHash, width, height)
+    if etag in request.if_none_match and resized.exists(contentHash):
+        return HTTPNotModified(etag = etag)
+
+    for attempt in range(2):
+        filename = resized.get(contentHash, width, height)
+        if filename is None:
+            return HTTPNotFound()
+        try:
+            response = FileResponse(filename, request = request, content_type = 'image/jpeg')
+            break
+        except (IOError, OSError):
+            # evicted by another request before we could open it, resize it again
+            if attempt:
+                raise
+            resized.forget(contentHash, width, height)
+
+    response.etag = etag
+    response.cache_control = 'public, max-age=%d' % (7 * 24 * 3600)
+    return response
+
+
 @view_config(route_name='preferences',
              renderer='smewt:templates/common/preferences.mako')
 def preferences_view(request):